@@ -0,0 +1,150 @@
+"""
+Agreement and calibration benchmark: logprob mode vs. structured outputs.
+
+Classifies the same conversations with every classifier twice, chunk by chunk: once with
+the structured yes/no/unsure response (the default) and once in logprob mode (a
+single-token answer whose logprobs give P(yes)). For each classifier it reports the
+chunk-level and conversation-level ("any" aggregation, P(yes) >= 0.5) agreement with the
+structured labels, the Brier score and expected calibration error of P(yes) against
+them, and the tokens and average latency of each mode. A Platt calibration of P(yes) is
+fitted on all chunks against the structured labels and saved to --calibration_path,
+for `python main.py --analyze ... --logprobs --logprob-calibration PATH`.
+
+Run from the repository root:
+    python -m Classifiers.benchmark_logprobs --input_path conversations_output/all_conversations_3_per_persona.jsonl \
+        --output_path logprob_agreement.json --calibration_path conversations_output/logprob_calibration.json --limit 20
+"""
+import argparse
+import asyncio
+import json
+
+import Classifiers.emoclassifiers.classification as classification
+import Classifiers.emoclassifiers.aggregation as aggregation
+from Classifiers.benchmark_single_call import classify_all, load_conversation_list
+from Classifiers.emoclassifiers.calibration import PlattCalibration, brier_score, expected_calibration_error
+from Common.accounting import TOKEN_FIELDS, UsageLedger
+
+
+def mode_usage(ledger: UsageLedger, classifier_name: str) -> dict:
+    """Calls, tokens and average latency of one classifier's requests in one mode."""
+    totals = ledger.by_tag["classifier"].get(classifier_name)
+    if totals is None:
+        return {"calls": 0, "tokens": 0, "latency": None}
+    return {
+        "calls": totals["calls"],
+        "tokens": sum(totals[field] for field in TOKEN_FIELDS),
+        "latency": totals["latency"] / totals["calls"] if totals["calls"] else None,
+    }
+
+
+def agreement_report(
+    classifiers: dict[str, classification.EmoClassifier],
+    structured: list[dict],
+    logprobs: list[dict],
+    structured_ledger: UsageLedger,
+    logprobs_ledger: UsageLedger,
+) -> tuple[dict, list[float], list[bool]]:
+    """
+    Per-classifier agreement and calibration of P(yes) against the structured labels, and
+    the (P(yes), structured label is YES) pairs of all chunks.
+    """
+    any_aggregator = aggregation.AGGREGATOR_DICT["any"]
+    noisy_or = aggregation.AGGREGATOR_DICT["noisy_or"]
+    report = {}
+    all_scores, all_labels = [], []
+    for name, classifier in classifiers.items():
+        scores, labels = [], []
+        conversation_agree = 0
+        conversation_scores, conversation_labels = [], []
+        for structured_results, logprob_results in zip(structured, logprobs):
+            reference, candidate = structured_results[name], logprob_results[name]
+            for chunk_id, label in reference.items():
+                if chunk_id in candidate:
+                    scores.append(candidate[chunk_id])
+                    labels.append(classification.is_yes(label))
+            reference_any = any_aggregator.aggregate(reference)
+            conversation_agree += reference_any == any_aggregator.aggregate(candidate)
+            conversation_scores.append(noisy_or.aggregate(candidate))
+            conversation_labels.append(reference_any)
+        all_scores.extend(scores)
+        all_labels.extend(labels)
+        definition_name = classifier.classifier_definition["name"]
+        report[name] = {
+            "chunks": len(scores),
+            "chunk_agreement": (sum(classification.is_yes(score) == label for score, label in zip(scores, labels))
+                                / len(scores) if scores else None),
+            "conversation_agreement": conversation_agree / len(structured) if structured else None,
+            "chunk_brier": brier_score(scores, labels),
+            "chunk_calibration_error": expected_calibration_error(scores, labels),
+            "conversation_brier": brier_score(conversation_scores, conversation_labels),
+            "structured": mode_usage(structured_ledger, definition_name),
+            "logprobs": mode_usage(logprobs_ledger, definition_name),
+        }
+    return report, all_scores, all_labels
+
+
+async def run_benchmark(
+    conversation_list: list[list[dict]],
+    classifiers: dict[str, classification.EmoClassifier],
+    logprob_classifiers: dict[str, classification.EmoClassifier],
+) -> tuple[dict, list[float], list[bool]]:
+    structured, structured_ledger = await classify_all(conversation_list, classifiers, single_call=False)
+    logprobs, logprobs_ledger = await classify_all(conversation_list, logprob_classifiers, single_call=False)
+    return agreement_report(classifiers, structured, logprobs, structured_ledger, logprobs_ledger)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, required=True)
+    parser.add_argument("--output_path", type=str, required=True)
+    parser.add_argument("--calibration_path", type=str,
+                        help="Where to save the Platt calibration fitted against the structured labels")
+    parser.add_argument("--classifier_set", type=str, default="v1")
+    parser.add_argument("--classifiers", type=str, help="Comma-separated subset of classifiers to benchmark")
+    parser.add_argument("--limit", type=int, help="Only use the first N conversations")
+    args = parser.parse_args()
+
+    conversation_list = load_conversation_list(args.input_path, args.limit)
+    model_wrapper = classification.ModelWrapper(model="gpt-4o-mini-2024-07-18")
+    # Same client and rate limiter, so both modes share one concurrency limit
+    logprob_wrapper = classification.ModelWrapper(
+        openai_client=model_wrapper.openai_client,
+        model=model_wrapper.model,
+        rate_limiter=model_wrapper.rate_limiter,
+        logprobs=True,
+    )
+    classifiers = classification.load_classifiers(classifier_set=args.classifier_set, model_wrapper=model_wrapper)
+    logprob_classifiers = classification.load_classifiers(classifier_set=args.classifier_set,
+                                                          model_wrapper=logprob_wrapper)
+    if args.classifiers:
+        names = [name.strip() for name in args.classifiers.split(",") if name.strip()]
+        classifiers = {name: classifiers[name] for name in names}
+        logprob_classifiers = {name: logprob_classifiers[name] for name in names}
+
+    print(f"Benchmarking {len(classifiers)} classifiers on {len(conversation_list)} conversations")
+    report, scores, labels = asyncio.run(run_benchmark(conversation_list, classifiers, logprob_classifiers))
+
+    for name, entry in report.items():
+        print(f"  {name}: chunk agreement {entry['chunk_agreement'] or 0:.0%}, conversation agreement "
+              f"{entry['conversation_agreement'] or 0:.0%}, Brier {entry['chunk_brier'] or 0:.3f}, tokens "
+              f"{entry['structured']['tokens']} -> {entry['logprobs']['tokens']}")
+    summary = {"conversations": len(conversation_list), "chunks": len(scores),
+               "brier": brier_score(scores, labels), "calibration_error": expected_calibration_error(scores, labels)}
+    if args.calibration_path and scores:
+        calibration = PlattCalibration.fit(scores, labels)
+        calibrated = calibration.apply(scores).tolist()
+        summary.update({
+            "calibration": {"slope": calibration.slope, "intercept": calibration.intercept},
+            "calibrated_brier": brier_score(calibrated, labels),
+            "calibrated_calibration_error": expected_calibration_error(calibrated, labels),
+        })
+        calibration.save(args.calibration_path)
+        print(f"Brier score {summary['brier']:.3f} -> {summary['calibrated_brier']:.3f} after calibration; "
+              f"saved calibration to {args.calibration_path}")
+    with open(args.output_path, "w") as f:
+        json.dump({**summary, "classifiers": report}, f, indent=2)
+    print(f"Saved agreement report to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Equivalence benchmark: prefix-stable vs. default classifier prompt layout.
+
+Classifies the same conversations with every classifier twice, chunk by chunk: once with
+the default prompt layout and once with the prefix-stable one (shared instructions and the
+definitions of the whole classifier set, then the target classifier's name, then the chunk;
+see classification.PROMPT_LAYOUTS). For each classifier it reports chunk-level and
+conversation-level ("any" aggregation) label
+agreement between the two layouts, so a layout change can be checked for label drift,
+and per layout the tokens used and the fraction of input tokens the provider served from
+its prompt cache (from the `usage` of each response). It also reports, without API calls,
+the estimated length of the prompt prefix shared by all chunks of a classifier and by all
+classifiers in each layout. Providers only cache prefixes above a minimum length (1024
+tokens for OpenAI), so the shared prefix is what decides whether caching can trigger.
+
+Run from the repository root:
+    python -m Classifiers.benchmark_prompt_layout --input_path conversations_output/all_conversations_3_per_persona.jsonl \
+        --output_path prompt_layout_agreement.json --limit 20
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import Classifiers.emoclassifiers.classification as classification
+import Classifiers.emoclassifiers.aggregation as aggregation
+from Classifiers.benchmark_single_call import classify_all, load_conversation_list
+from Classifiers.emoclassifiers.chunking import CHUNKER_DICT
+from Common.accounting import TOKEN_FIELDS, UsageLedger, cached_input_ratio
+from Common.rate_limiting import estimate_tokens
+
+
+def shared_prefix_tokens(prompts: list[str]) -> int:
+    """Estimated number of tokens of the longest prefix all prompts share."""
+    return estimate_tokens(os.path.commonprefix(prompts)) if prompts else 0
+
+
+def layout_prompts(
+    conversation_list: list[list[dict]],
+    classifiers: dict[str, classification.EmoClassifier],
+    layout: str,
+) -> dict[str, list[str]]:
+    """Per-chunk prompts of every classifier in one layout, as its model wrapper renders them."""
+    prompts = {}
+    for name, classifier in classifiers.items():
+        definition = classifier.classifier_definition
+        chunker = CHUNKER_DICT[definition["chunker"]]
+        prompts[name] = [
+            classification.get_emo_classifiers_prompt(classifier_definition=definition, chunk=chunk, layout=layout,
+                                                      set_definitions=classifier.model_wrapper.set_definitions)
+            for conversation in conversation_list
+            for chunk in chunker.chunk_simple_convo(conversation).values()
+        ]
+    return prompts
+
+
+def agreement_report(
+    classifiers: dict[str, classification.EmoClassifier],
+    default: list[dict],
+    prefix_stable: list[dict],
+    ledgers: dict[str, UsageLedger],
+    prompts: dict[str, dict[str, list[str]]],
+) -> dict:
+    """
+    Per-classifier agreement between the two layouts, and per layout the tokens used,
+    the cached input ratio and the shared prompt prefix.
+    """
+    any_aggregator = aggregation.AGGREGATOR_DICT["any"]
+    report = {}
+    for name, classifier in classifiers.items():
+        chunk_total = chunk_agree = conversation_agree = 0
+        for default_results, prefix_stable_results in zip(default, prefix_stable):
+            reference, candidate = default_results[name], prefix_stable_results[name]
+            for chunk_id, label in reference.items():
+                chunk_total += 1
+                chunk_agree += candidate.get(chunk_id) == label
+            conversation_agree += any_aggregator.aggregate(reference) == any_aggregator.aggregate(candidate)
+        report[name] = {
+            "chunk_agreement": chunk_agree / chunk_total if chunk_total else None,
+            "conversation_agreement": conversation_agree / len(default) if default else None,
+        }
+        for layout, ledger in ledgers.items():
+            # Calls are tagged with the definition's name, which may differ from its key
+            totals = ledger.by_tag["classifier"].get(classifier.classifier_definition["name"])
+            report[name][layout] = {
+                "calls": totals["calls"] if totals else 0,
+                "tokens": sum(totals[field] for field in TOKEN_FIELDS) if totals else 0,
+                "cached_input_ratio": cached_input_ratio(totals) if totals else None,
+                "shared_prefix_tokens": shared_prefix_tokens(prompts[layout][name]),
+            }
+    return report
+
+
+def layout_summary(ledgers: dict[str, UsageLedger], prompts: dict[str, dict[str, list[str]]]) -> dict:
+    """Tokens, cached input ratio and prefix shared by all classifiers, per layout."""
+    return {
+        layout: {
+            "tokens": ledger.total_tokens(),
+            "cached_input_ratio": cached_input_ratio(ledger.totals),
+            # The static instructions and the set's definitions, in the prefix-stable layout
+            "shared_prefix_tokens": shared_prefix_tokens([p for chunks in prompts[layout].values() for p in chunks]),
+        }
+        for layout, ledger in ledgers.items()
+    }
+
+
+async def run_benchmark(
+    conversation_list: list[list[dict]],
+    classifiers: dict[str, classification.EmoClassifier],
+    prefix_stable_classifiers: dict[str, classification.EmoClassifier],
+) -> tuple[dict, dict]:
+    default, default_ledger = await classify_all(conversation_list, classifiers, single_call=False)
+    prefix_stable, prefix_stable_ledger = await classify_all(conversation_list, prefix_stable_classifiers,
+                                                             single_call=False)
+    ledgers = {"default": default_ledger, "prefix_stable": prefix_stable_ledger}
+    prompts = {"default": layout_prompts(conversation_list, classifiers, "default"),
+               "prefix_stable": layout_prompts(conversation_list, prefix_stable_classifiers, "prefix_stable")}
+    return (agreement_report(classifiers, default, prefix_stable, ledgers, prompts),
+            layout_summary(ledgers, prompts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, required=True)
+    parser.add_argument("--output_path", type=str, required=True)
+    parser.add_argument("--classifier_set", type=str, default="v1")
+    parser.add_argument("--classifiers", type=str, help="Comma-separated subset of classifiers to benchmark")
+    parser.add_argument("--limit", type=int, help="Only use the first N conversations")
+    parser.add_argument("--min_agreement", type=float, default=0.95,
+                        help="Chunk-level agreement below which a classifier is flagged as drifting")
+    args = parser.parse_args()
+
+    conversation_list = load_conversation_list(args.input_path, args.limit)
+    model_wrapper = classification.ModelWrapper(model="gpt-4o-mini-2024-07-18")
+    # Same client and rate limiter, so both layouts share one concurrency limit
+    prefix_stable_wrapper = classification.ModelWrapper(
+        openai_client=model_wrapper.openai_client,
+        model=model_wrapper.model,
+        rate_limiter=model_wrapper.rate_limiter,
+        prompt_layout="prefix_stable",
+    )
+    classifiers = classification.load_classifiers(classifier_set=args.classifier_set, model_wrapper=model_wrapper)
+    prefix_stable_classifiers = classification.load_classifiers(classifier_set=args.classifier_set,
+                                                                model_wrapper=prefix_stable_wrapper)
+    if args.classifiers:
+        names = [name.strip() for name in args.classifiers.split(",") if name.strip()]
+        classifiers = {name: classifiers[name] for name in names}
+        prefix_stable_classifiers = {name: prefix_stable_classifiers[name] for name in names}
+
+    print(f"Benchmarking {len(classifiers)} classifiers on {len(conversation_list)} conversations")
+    report, summary = asyncio.run(run_benchmark(conversation_list, classifiers, prefix_stable_classifiers))
+
+    drifting = []
+    for name, entry in report.items():
+        if entry["chunk_agreement"] is not None and entry["chunk_agreement"] < args.min_agreement:
+            drifting.append(name)
+        print(f"  {name}: chunk agreement {entry['chunk_agreement'] or 0:.0%}, conversation agreement "
+              f"{entry['conversation_agreement'] or 0:.0%}, cached input "
+              f"{entry['default']['cached_input_ratio'] or 0:.0%} -> {entry['prefix_stable']['cached_input_ratio'] or 0:.0%}, "
+              f"shared prefix ~{entry['default']['shared_prefix_tokens']} -> "
+              f"~{entry['prefix_stable']['shared_prefix_tokens']} tokens{' [drift]' if name in drifting else ''}")
+    for layout, entry in summary.items():
+        print(f"{layout}: {entry['tokens']} tokens, {entry['cached_input_ratio'] or 0:.0%} of input cached, "
+              f"~{entry['shared_prefix_tokens']} tokens shared by all classifiers")
+    with open(args.output_path, "w") as f:
+        json.dump({"conversations": len(conversation_list), "min_agreement": args.min_agreement, **summary,
+                   "classifiers": report, "drifting": drifting}, f, indent=2)
+    print(f"Saved agreement report to {args.output_path}")
+    if drifting:
+        print(f"Labels drift between layouts for: {', '.join(drifting)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Agreement benchmark: single-call vs. per-chunk classification.
+
+Classifies the same conversations with every classifier twice: once per chunk (the
+default, where each chunk repeats up to 3 context messages) and once in single-call
+mode (the whole conversation sent once, one label per target message). For each
+classifier it reports chunk-level and conversation-level ("any" aggregation) agreement
+and the tokens each mode used, and recommends the classifiers whose conversation-level
+agreement is at least --min_agreement. The recommended names can be passed to
+`python main.py --single-call-classifiers`.
+
+Run from the repository root:
+    python -m Classifiers.benchmark_single_call --input_path conversations_output/all_conversations_3_per_persona.jsonl \
+        --output_path single_call_agreement.json --limit 20
+"""
+import argparse
+import asyncio
+import json
+
+import Classifiers.emoclassifiers.io_utils as io_utils
+import Classifiers.emoclassifiers.classification as classification
+import Classifiers.emoclassifiers.aggregation as aggregation
+from Common.accounting import TOKEN_FIELDS, UsageLedger, set_ledger
+
+
+def load_conversation_list(path: str, limit: int | None = None) -> list[list[dict]]:
+    """
+    Conversations of a JSONL file of records with a "conversation" field, or of bare message lists.
+    """
+    records = io_utils.load_jsonl(path)[:limit]
+    return [record["conversation"] if isinstance(record, dict) else record for record in records]
+
+
+async def classify_all(
+    conversation_list: list[list[dict]],
+    classifiers: dict[str, classification.EmoClassifier],
+    single_call: bool,
+) -> tuple[list[dict], UsageLedger]:
+    """
+    Raw results per conversation and classifier in one mode, with the ledger of its calls.
+    """
+    ledger = UsageLedger()
+    previous = set_ledger(ledger)
+    try:
+        futures = []
+        keys = []
+        for conversation_id, conversation in enumerate(conversation_list):
+            for name, classifier in classifiers.items():
+                if single_call:
+                    futures.append(classifier.classify_conversation_single_call(conversation))
+                else:
+                    futures.append(classifier.classify_conversation_chunked(conversation))
+                keys.append((conversation_id, name))
+        results = [{} for _ in conversation_list]
+        for (conversation_id, name), raw_result in zip(keys, await asyncio.gather(*futures)):
+            results[conversation_id][name] = raw_result
+    finally:
+        set_ledger(previous)
+    return results, ledger
+
+
+def agreement_report(
+    classifiers: dict[str, classification.EmoClassifier],
+    chunked: list[dict],
+    single_call: list[dict],
+    chunked_ledger: UsageLedger,
+    single_call_ledger: UsageLedger,
+    min_agreement: float,
+) -> dict:
+    """
+    Per-classifier agreement between the two modes and the tokens each used.
+    """
+    any_aggregator = aggregation.AGGREGATOR_DICT["any"]
+    report = {}
+    for name, classifier in classifiers.items():
+        chunk_total = chunk_agree = conversation_agree = 0
+        chunked_yes = single_call_yes = 0
+        for chunked_results, single_call_results in zip(chunked, single_call):
+            reference, candidate = chunked_results[name], single_call_results[name]
+            for chunk_id, label in reference.items():
+                chunk_total += 1
+                chunk_agree += candidate.get(chunk_id) == label
+            reference_any = any_aggregator.aggregate(reference)
+            candidate_any = any_aggregator.aggregate(candidate)
+            conversation_agree += reference_any == candidate_any
+            chunked_yes += reference_any
+            single_call_yes += candidate_any
+        tokens = {}
+        for mode, ledger in [("chunked", chunked_ledger), ("single_call", single_call_ledger)]:
+            # Calls are tagged with the definition's name, which may differ from its key
+            totals = ledger.by_tag["classifier"].get(
+                classifier.classifier_definition["name"], {"calls": 0, **{field: 0 for field in TOKEN_FIELDS}}
+            )
+            tokens[mode] = {
+                "calls": totals["calls"],
+                "tokens": sum(totals[field] for field in TOKEN_FIELDS),
+            }
+        conversation_agreement = conversation_agree / len(chunked) if chunked else 0.0
+        report[name] = {
+            "chunk_agreement": chunk_agree / chunk_total if chunk_total else None,
+            "conversation_agreement": conversation_agreement,
+            "conversations_detected": {"chunked": chunked_yes, "single_call": single_call_yes},
+            **{f"{mode}_{key}": value for mode, entry in tokens.items() for key, value in entry.items()},
+            "token_savings": (1 - tokens["single_call"]["tokens"] / tokens["chunked"]["tokens"]
+                              if tokens["chunked"]["tokens"] else None),
+            "recommended": conversation_agreement >= min_agreement,
+        }
+    return report
+
+
+async def run_benchmark(
+    conversation_list: list[list[dict]],
+    classifiers: dict[str, classification.EmoClassifier],
+    min_agreement: float,
+) -> dict:
+    chunked, chunked_ledger = await classify_all(conversation_list, classifiers, single_call=False)
+    single_call, single_call_ledger = await classify_all(conversation_list, classifiers, single_call=True)
+    return agreement_report(classifiers, chunked, single_call, chunked_ledger, single_call_ledger, min_agreement)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, required=True)
+    parser.add_argument("--output_path", type=str, required=True)
+    parser.add_argument("--classifier_set", type=str, default="v1")
+    parser.add_argument("--classifiers", type=str, help="Comma-separated subset of classifiers to benchmark")
+    parser.add_argument("--limit", type=int, help="Only use the first N conversations")
+    parser.add_argument("--min_agreement", type=float, default=0.9,
+                        help="Conversation-level agreement required to recommend single-call mode")
+    args = parser.parse_args()
+
+    conversation_list = load_conversation_list(args.input_path, args.limit)
+    model_wrapper = classification.ModelWrapper(model="gpt-4o-mini-2024-07-18")
+    classifiers = classification.load_classifiers(
+        classifier_set=args.classifier_set,
+        model_wrapper=model_wrapper,
+    )
+    if args.classifiers:
+        names = [name.strip() for name in args.classifiers.split(",") if name.strip()]
+        classifiers = {name: classifiers[name] for name in names}
+
+    print(f"Benchmarking {len(classifiers)} classifiers on {len(conversation_list)} conversations")
+    report = asyncio.run(run_benchmark(conversation_list, classifiers, args.min_agreement))
+
+    for name, entry in report.items():
+        savings = f"{entry['token_savings']:.0%}" if entry["token_savings"] is not None else "n/a"
+        print(f"  {name}: conversation agreement {entry['conversation_agreement']:.0%}, "
+              f"chunk agreement {entry['chunk_agreement'] or 0:.0%}, tokens "
+              f"{entry['chunked_tokens']} -> {entry['single_call_tokens']} ({savings} saved)"
+              f"{' [recommended]' if entry['recommended'] else ''}")
+    recommended = [name for name, entry in report.items() if entry["recommended"]]
+    with open(args.output_path, "w") as f:
+        json.dump({"min_agreement": args.min_agreement, "conversations": len(conversation_list),
+                   "classifiers": report, "recommended": recommended}, f, indent=2)
+    print(f"Saved agreement report to {args.output_path}")
+    if recommended:
+        print(f"Use single-call mode with: --single-call-classifiers \"{','.join(recommended)}\"")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
+import math
 from math import comb
 from typing import Any
 
-from Classifiers.emoclassifiers.classification import YesNoUnsureEnum
+from Classifiers.emoclassifiers.classification import YesNoUnsureEnum, is_yes, yes_probability
 
 
 
@@ -14,6 +15,14 @@ class Aggregator:
         """
         raise NotImplementedError("Subclass must implement this method")
 
+    @classmethod
+    def decided(cls, results: dict[str, YesNoUnsureEnum]) -> bool:
+        """
+        Whether the results so far already determine the aggregate, whatever the
+        remaining chunks return (so their classification can be skipped).
+        """
+        return False
+
 
 
 class RawAggregator(Aggregator):
@@ -21,7 +30,7 @@ class RawAggregator(Aggregator):
     @classmethod
     def aggregate(cls, results: dict[str, YesNoUnsureEnum]) -> bool:
         return {
-            k: val == YesNoUnsureEnum.YES
+            k: is_yes(val)
             for k, val in results.items()
         }
 
@@ -30,7 +39,11 @@ class AnyAggregator(Aggregator):
 
     @classmethod
     def aggregate(cls, results: dict[str, YesNoUnsureEnum]) -> bool:
-        return any(val == YesNoUnsureEnum.YES for val in results.values())
+        return any(is_yes(val) for val in results.values())
+
+    @classmethod
+    def decided(cls, results: dict[str, YesNoUnsureEnum]) -> bool:
+        return cls.aggregate(results)
 
 
 class AdjustedAggregator(Aggregator):
@@ -43,7 +56,7 @@ class AdjustedAggregator(Aggregator):
             raise ValueError(f"avg_num_chunks must be positive")
 
         # Calculate the number of True values in elems
-        num_true = sum(elem == YesNoUnsureEnum.YES for elem in elems)
+        num_true = sum(is_yes(elem) for elem in elems)
         num_false = num_elems - num_true
 
         # Handle the case where the sample size exceeds the total number of elements
@@ -70,8 +83,25 @@ class AdjustedAggregator(Aggregator):
         return expected_value
 
 
+class NoisyOrAggregator(Aggregator):
+
+    @classmethod
+    def aggregate(cls, results: dict[str, YesNoUnsureEnum | float]) -> float:
+        """
+        Probability that at least one chunk is YES, treating the chunks' P(yes) (from
+        logprob mode; a label counts as 0 or 1) as independent: the probabilistic
+        counterpart of the "any" aggregator.
+        """
+        return 1.0 - math.prod(1.0 - yes_probability(val) for val in results.values())
+
+    @classmethod
+    def decided(cls, results: dict[str, YesNoUnsureEnum | float]) -> bool:
+        return cls.aggregate(results) >= 1.0
+
+
 AGGREGATOR_DICT = {
     "raw": RawAggregator,
     "any": AnyAggregator,
     "adjusted": AdjustedAggregator,
+    "noisy_or": NoisyOrAggregator,
 }
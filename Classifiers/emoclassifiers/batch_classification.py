@@ -0,0 +1,293 @@
+"""
+Corpus-scale classification through the OpenAI Batch API.
+
+Every (conversation, classifier, chunk) task is rendered to a chat completion request
+and written to a request JSONL file, which is uploaded and submitted as batch jobs (split
+at the API's per-job limit). Once the jobs complete, their output is joined back by
+custom_id into the usual per-classifier {chunk_id: YesNoUnsureEnum} dicts, so the
+aggregators and reports work unchanged. Batch jobs are billed at half price and do not
+count against the per-minute rate limits, so large files need no hand-splitting.
+Requests that fail in the batch are re-sent as real-time requests, so a failure does not
+silently turn into a missing (negative) label.
+"""
+import asyncio
+import json
+import os
+
+import pydantic
+
+from Classifiers.emoclassifiers.cascade import get_cascade
+from Classifiers.emoclassifiers.chunking import CHUNKER_DICT
+from Classifiers.emoclassifiers.classification import (
+    EmoClassifier, ResponseFormat, YesNoUnsureEnum, get_emo_classifiers_prompt, is_yes
+)
+from Classifiers.emoclassifiers.result_cache import ClassificationCache, get_classification_cache
+from Common.accounting import accounting_tags, get_ledger
+from Common.clients import get_client_factory
+
+# Upper bound on requests per batch job imposed by the API
+MAX_BATCH_REQUESTS = 50000
+# Batch statuses after which a job produces no further output
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def response_format_param(response_format: type[pydantic.BaseModel]) -> dict:
+    """
+    Strict json_schema response_format of a request body, as sent by chat.completions.parse.
+    """
+    schema = response_format.model_json_schema()
+    schema["additionalProperties"] = False
+    schema["required"] = list(schema.get("properties", {}))
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": response_format.__name__, "schema": schema, "strict": True},
+    }
+
+
+class BatchClassifier:
+    def __init__(
+        self,
+        openai_client=None,
+        model: str = "gpt-4o-mini-2024-07-18",
+        poll_interval: float = 30,
+        output_folder: str = ".",
+        max_completion_tokens: int = 20,
+        prompt_layout: str = "default",
+    ):
+        """
+        Classifies conversations with one batch request per (conversation, classifier, chunk).
+        Request files and the task index are written to output_folder; poll_interval is
+        the number of seconds between batch status checks. Prompts use prompt_layout (see
+        classification.PROMPT_LAYOUTS).
+        """
+        if openai_client is None:
+            openai_client = get_client_factory().openai_async()
+        self.openai_client = openai_client
+        self.model = model
+        self.poll_interval = poll_interval
+        self.output_folder = output_folder
+        self.max_completion_tokens = max_completion_tokens
+        self.prompt_layout = prompt_layout
+        self.batches_submitted = 0
+        self.cached_tasks = 0
+        self.local_tasks = 0
+        self.resent_tasks = 0
+
+    def enumerate_tasks(
+        self,
+        conversations: dict[str, list[dict]],
+        classifiers: dict[str, dict[str, EmoClassifier]],
+    ) -> list[dict]:
+        """
+        One task per (conversation, classifier, chunk). classifiers maps each conversation
+        id to the classifiers to run on it. Custom ids are positional ("t<n>"), so they
+        stay within the API's limits whatever the conversation ids look like.
+        """
+        tasks = []
+        for conversation_id, conversation in conversations.items():
+            for classifier_name, classifier in classifiers[conversation_id].items():
+                chunker = CHUNKER_DICT[classifier.classifier_definition["chunker"]]
+                for chunk_id, chunk in chunker.chunk_simple_convo(conversation).items():
+                    tasks.append({
+                        "custom_id": f"t{len(tasks)}",
+                        "conversation_id": conversation_id,
+                        "classifier_name": classifier_name,
+                        "classifier_tag": classifier.classifier_definition.get("name"),
+                        "chunk_id": chunk_id,
+                        "chunk": chunk,
+                        "prompt": get_emo_classifiers_prompt(
+                            classifier_definition=classifier.classifier_definition,
+                            chunk=chunk,
+                            layout=self.prompt_layout,
+                            set_definitions=classifier.model_wrapper.set_definitions,
+                        ),
+                    })
+        return tasks
+
+    def request_line(self, task: dict) -> dict:
+        return {
+            "custom_id": task["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [{"role": "user", "content": task["prompt"]}],
+                "response_format": response_format_param(ResponseFormat),
+                "max_completion_tokens": self.max_completion_tokens,
+            },
+        }
+
+    def write_request_files(self, tasks: list[dict], name: str) -> list[str]:
+        """
+        Write the request JSONL file(s), at most MAX_BATCH_REQUESTS requests each.
+        """
+        paths = []
+        for start in range(0, len(tasks), MAX_BATCH_REQUESTS):
+            path = os.path.join(self.output_folder, f"{name}_requests_{len(paths) + 1}.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for task in tasks[start:start + MAX_BATCH_REQUESTS]:
+                    f.write(json.dumps(self.request_line(task)) + "\n")
+            paths.append(path)
+        return paths
+
+    async def run_batch(self, path: str) -> list[dict]:
+        """
+        Upload one request file, submit it as a batch job, wait for it to finish and
+        return its output lines.
+        """
+        await get_ledger().wait_for_budget()
+        with open(path, "rb") as f:
+            input_file = await self.openai_client.files.create(file=f, purpose="batch")
+        batch = await self.openai_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        self.batches_submitted += 1
+        print(f"  Submitted classification batch {batch.id} ({os.path.basename(path)})")
+
+        while batch.status not in FINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            batch = await self.openai_client.batches.retrieve(batch.id)
+        if batch.status != "completed":
+            print(f"  Batch {batch.id} ended with status {batch.status}")
+        if batch.error_file_id:
+            errors = await self.openai_client.files.content(batch.error_file_id)
+            print(f"  Batch {batch.id}: {len(errors.text.splitlines())} failed requests")
+        if not batch.output_file_id:
+            return []
+        output = await self.openai_client.files.content(batch.output_file_id)
+        return [json.loads(line) for line in output.text.splitlines() if line.strip()]
+
+    async def classify_conversations(
+        self,
+        conversations: dict[str, list[dict]],
+        classifiers: dict[str, dict[str, EmoClassifier]],
+        name: str = "classification_batch",
+    ) -> dict[str, dict[str, dict]]:
+        """
+        Classify all conversations through batch jobs. Returns
+        {conversation_id: {classifier_name: {chunk_id: YesNoUnsureEnum}}}, the raw results
+        classify_conversation would give. Tasks the cascade labels locally (except for the
+        ones picked for an audit) or that are already in the classification cache are not
+        submitted, and identical prompts are submitted once. Requests that fail in the batch are re-sent through the
+        classifier's ModelWrapper (see resend_failed); only chunks whose real-time
+        request fails too are missing from the result.
+        """
+        results = {
+            conversation_id: {classifier_name: {} for classifier_name in classifiers[conversation_id]}
+            for conversation_id in conversations
+        }
+        cache = get_classification_cache()
+        cascade = get_cascade()
+        schema = ResponseFormat.model_json_schema()
+        # Identical prompts (repeated messages, duplicate conversations) are submitted once
+        tasks = []
+        duplicates = {}
+        # Locally labeled tasks still classified by the LLM to measure the cascade's agreement
+        audited = []
+        for task in self.enumerate_tasks(conversations, classifiers):
+            if cascade is not None:
+                local_label = cascade.predict(task["classifier_tag"], task["chunk"])
+                if local_label is not None and cascade.should_audit():
+                    task["local_label"] = local_label
+                    audited.append(task)
+                elif local_label is not None:
+                    self.local_tasks += 1
+                    results[task["conversation_id"]][task["classifier_name"]][task["chunk_id"]] = \
+                        YesNoUnsureEnum.YES if local_label else YesNoUnsureEnum.NO
+                    continue
+            task["cache_key"] = ClassificationCache.key(self.model, task["prompt"], schema)
+            if cache is not None:
+                cached = cache.get(task["cache_key"])
+                if cached is not None:
+                    self.cached_tasks += 1
+                    parsed = ResponseFormat.model_validate(cached)
+                    results[task["conversation_id"]][task["classifier_name"]][task["chunk_id"]] = parsed.response
+                    continue
+            if task["cache_key"] in duplicates:
+                duplicates[task["cache_key"]].append(task)
+                continue
+            duplicates[task["cache_key"]] = [task]
+            tasks.append(task)
+        print(f"Classifying {len(tasks)} chunks in batch jobs ({self.local_tasks} labeled by the cascade, "
+              f"{self.cached_tasks} answered from the cache, "
+              f"{sum(len(group) - 1 for group in duplicates.values())} duplicates)")
+        if not tasks:
+            self.record_audits(cascade, audited, results)
+            return results
+
+        # The task index lets the output be joined back by custom_id
+        with open(os.path.join(self.output_folder, f"{name}_tasks.jsonl"), "w", encoding="utf-8") as f:
+            for task in tasks:
+                f.write(json.dumps({key: task[key] for key in ["custom_id", "conversation_id", "classifier_name",
+                                                              "chunk_id"]}) + "\n")
+        tasks_by_id = {task["custom_id"]: task for task in tasks}
+
+        outputs = await asyncio.gather(*[self.run_batch(path) for path in self.write_request_files(tasks, name)])
+        answered = set()
+        for line in (line for output in outputs for line in output):
+            task = tasks_by_id.get(line["custom_id"])
+            response = line.get("response") or {}
+            if task is None or line.get("error") or response.get("status_code") != 200:
+                continue
+            body = response["body"]
+            with accounting_tags(stage="classifier", classifier=task["classifier_tag"],
+                                 conversation_id=task["conversation_id"]):
+                get_ledger().record("openai", self.model, body.get("usage"), batch=True)
+            try:
+                parsed = ResponseFormat.model_validate_json(body["choices"][0]["message"]["content"])
+            except (pydantic.ValidationError, KeyError, IndexError, TypeError):
+                continue
+            answered.add(task["custom_id"])
+            for same_task in duplicates[task["cache_key"]]:
+                results[same_task["conversation_id"]][same_task["classifier_name"]][same_task["chunk_id"]] = \
+                    parsed.response
+            if cache is not None:
+                cache.put(task["cache_key"], parsed.model_dump(mode="json"))
+
+        failed = [task for task in tasks if task["custom_id"] not in answered]
+        if failed:
+            print(f"  {len(failed)} batch requests failed; re-sending them as real-time requests")
+            still_failed = await self.resend_failed(failed, classifiers, duplicates, results)
+            if still_failed:
+                print(f"  {still_failed} re-sent requests failed too; their chunks are missing from the results")
+        self.record_audits(cascade, audited, results)
+        return results
+
+    @staticmethod
+    def record_audits(cascade, audited: list[dict], results: dict[str, dict[str, dict]]):
+        """
+        Record the cascade's agreement with the LLM on audited tasks, once their results
+        are in (tasks without a result are not counted).
+        """
+        for task in audited:
+            result = results[task["conversation_id"]][task["classifier_name"]].get(task["chunk_id"])
+            if result is not None:
+                cascade.record_audit(task["classifier_tag"], task["local_label"], is_yes(result))
+
+    async def resend_failed(
+        self,
+        tasks: list[dict],
+        classifiers: dict[str, dict[str, EmoClassifier]],
+        duplicates: dict[str, list[dict]],
+        results: dict[str, dict[str, dict]],
+    ) -> int:
+        """
+        Classify tasks whose batch request failed with real-time requests through their
+        classifier's ModelWrapper (rate limited, cached and accounted as usual), and fill
+        in the results of the task and its duplicates. Returns the number of tasks whose
+        real-time request failed as well.
+        """
+        async def resend(task: dict):
+            model_wrapper = classifiers[task["conversation_id"]][task["classifier_name"]].model_wrapper
+            with accounting_tags(conversation_id=task["conversation_id"]):
+                parsed = await model_wrapper.parse(task["prompt"], ResponseFormat, self.max_completion_tokens,
+                                                   task["classifier_tag"])
+            self.resent_tasks += 1
+            for same_task in duplicates[task["cache_key"]]:
+                results[same_task["conversation_id"]][same_task["classifier_name"]][same_task["chunk_id"]] = \
+                    parsed.response
+
+        outcomes = await asyncio.gather(*[resend(task) for task in tasks], return_exceptions=True)
+        return sum(isinstance(outcome, Exception) for outcome in outcomes)
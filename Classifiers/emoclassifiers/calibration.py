@@ -0,0 +1,86 @@
+"""
+Calibration of the P(yes) scores read from answer-token logprobs.
+
+Token probabilities of an instruction-tuned model are usually overconfident: most chunks
+score close to 0 or 1. PlattCalibration maps a raw score p to
+sigmoid(slope * logit(p) + intercept), with the two parameters fitted by logistic
+regression against reference labels (e.g. the structured-output labels of the same
+chunks, see Classifiers/benchmark_logprobs.py), and is saved as JSON so that
+`python main.py --logprob-calibration PATH` can apply it.
+"""
+import json
+
+import numpy as np
+
+# Raw scores are clipped away from 0 and 1 before taking the logit
+EPSILON = 1e-6
+
+
+def logit(probabilities: np.ndarray) -> np.ndarray:
+    probabilities = np.clip(probabilities, EPSILON, 1 - EPSILON)
+    return np.log(probabilities / (1 - probabilities))
+
+
+class PlattCalibration:
+    def __init__(self, slope: float = 1.0, intercept: float = 0.0):
+        """Logistic map of the logit of a raw score (the defaults leave scores unchanged)."""
+        self.slope = slope
+        self.intercept = intercept
+
+    def __call__(self, probability: float) -> float:
+        return float(self.apply(np.asarray([probability]))[0])
+
+    def apply(self, probabilities: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-(self.slope * logit(probabilities) + self.intercept)))
+
+    @classmethod
+    def fit(cls, probabilities: list[float], labels: list[bool], iterations: int = 50,
+            l2: float = 1e-3) -> "PlattCalibration":
+        """
+        Fit slope and intercept by Newton's method on the log loss of the labels (with a
+        small ridge penalty, so that perfectly separated scores still converge).
+        """
+        x = logit(np.asarray(probabilities, dtype=np.float64))
+        y = np.asarray(labels, dtype=np.float64)
+        features = np.stack([x, np.ones_like(x)], axis=1)
+        params = np.array([1.0, 0.0])
+        for _ in range(iterations):
+            predicted = 1.0 / (1.0 + np.exp(-(features @ params)))
+            gradient = features.T @ (predicted - y) + l2 * params
+            hessian = (features.T * (predicted * (1 - predicted))) @ features + l2 * np.eye(2)
+            step = np.linalg.solve(hessian, gradient)
+            params -= step
+            if np.abs(step).max() < 1e-8:
+                break
+        return cls(slope=float(params[0]), intercept=float(params[1]))
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"slope": self.slope, "intercept": self.intercept}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "PlattCalibration":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(slope=data["slope"], intercept=data["intercept"])
+
+
+def brier_score(probabilities: list[float], labels: list[bool]) -> float | None:
+    """Mean squared difference between scores and labels (lower is better)."""
+    if not probabilities:
+        return None
+    return float(np.mean((np.asarray(probabilities) - np.asarray(labels, dtype=np.float64)) ** 2))
+
+
+def expected_calibration_error(probabilities: list[float], labels: list[bool], num_bins: int = 10) -> float | None:
+    """Mean |YES rate - mean score| over equal-width score bins, weighted by bin size."""
+    if not probabilities:
+        return None
+    scores = np.asarray(probabilities)
+    y = np.asarray(labels, dtype=np.float64)
+    bins = np.minimum((scores * num_bins).astype(int), num_bins - 1)
+    error = 0.0
+    for b in np.unique(bins):
+        in_bin = bins == b
+        error += in_bin.sum() * abs(y[in_bin].mean() - scores[in_bin].mean())
+    return float(error / len(scores))
@@ -0,0 +1,274 @@
+"""
+CPU-only pre-classifier cascade.
+
+For many classifiers almost every chunk is an obvious NO, yet each one costs an LLM
+request. The cascade puts a cheap local model in front of the LLM: per classifier, a
+logistic regression over hashed word n-grams of the chunk (the target message and its
+context hashed separately), trained on labels the LLM already gave (see
+Classifiers/train_cascade.py, which reads them from the classification cache). Chunks
+the local model scores beyond a classifier's thresholds are labeled locally; only the
+uncertain ones are sent to the LLM.
+
+Thresholds are chosen per classifier on held-out labels, so that the locally labeled
+chunks agree with the LLM at least as often as the target agreement; a side (YES or NO)
+that cannot reach it is never labeled locally.
+"""
+import json
+import random
+import re
+import zlib
+
+import numpy as np
+
+from Classifiers.emoclassifiers.chunking import Chunk
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def hashed_features(chunk: Chunk, num_features: int) -> dict[int, float]:
+    """
+    Hashed word unigrams and bigrams of a chunk. The target (last) message and the
+    context messages use separate feature spaces, and counts are L2-normalized.
+    """
+    counts = {}
+    for i, message in enumerate(chunk.chunk):
+        prefix = f"t:{message['role']}:" if i == len(chunk.chunk) - 1 else "c:"
+        tokens = TOKEN_PATTERN.findall(message["content"].lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for gram in grams:
+            index = zlib.crc32((prefix + gram).encode("utf-8")) % num_features
+            counts[index] = counts.get(index, 0.0) + 1.0
+    norm = sum(value * value for value in counts.values()) ** 0.5
+    return {index: value / norm for index, value in counts.items()} if norm else {}
+
+
+def to_sparse_rows(rows: list[dict[int, float]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR arrays (indptr, indices, data) of a list of sparse feature dicts."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((index for row in rows for index in row), dtype=np.int64, count=indptr[-1])
+    data = np.fromiter((value for row in rows for value in row.values()), dtype=np.float64, count=indptr[-1])
+    return indptr, indices, data
+
+
+class LogisticModel:
+    def __init__(self, num_features: int, weights: np.ndarray | None = None, bias: float = 0.0):
+        """Binary logistic regression over sparse hashed features."""
+        self.num_features = num_features
+        self.weights = np.zeros(num_features) if weights is None else weights
+        self.bias = bias
+
+    def scores(self, rows: list[dict[int, float]]) -> np.ndarray:
+        indptr, indices, data = to_sparse_rows(rows)
+        row_ids = np.repeat(np.arange(len(rows)), np.diff(indptr))
+        logits = np.bincount(row_ids, weights=self.weights[indices] * data, minlength=len(rows)) + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def fit(self, rows: list[dict[int, float]], labels: list[bool], epochs: int = 300,
+            learning_rate: float = 0.5, l2: float = 1e-4):
+        """
+        Full-batch gradient descent (with Adam steps) on the class-balanced log loss.
+        """
+        y = np.asarray(labels, dtype=np.float64)
+        indptr, indices, data = to_sparse_rows(rows)
+        row_ids = np.repeat(np.arange(len(rows)), np.diff(indptr))
+        # Balance the classes, so that rare YES labels are not drowned out
+        positives = max(y.sum(), 1.0)
+        negatives = max(len(y) - y.sum(), 1.0)
+        sample_weights = np.where(y == 1, len(y) / (2 * positives), len(y) / (2 * negatives)) / len(y)
+        params = np.zeros(self.num_features + 1)
+        moment = np.zeros_like(params)
+        velocity = np.zeros_like(params)
+        for step in range(1, epochs + 1):
+            logits = np.bincount(row_ids, weights=params[indices] * data, minlength=len(rows)) + params[-1]
+            errors = (1.0 / (1.0 + np.exp(-logits)) - y) * sample_weights
+            gradient = np.empty_like(params)
+            gradient[:-1] = np.bincount(indices, weights=data * errors[row_ids], minlength=self.num_features)
+            gradient[:-1] += l2 * params[:-1]
+            gradient[-1] = errors.sum()
+            moment = 0.9 * moment + 0.1 * gradient
+            velocity = 0.999 * velocity + 0.001 * gradient ** 2
+            params -= (learning_rate * (moment / (1 - 0.9 ** step))
+                       / (np.sqrt(velocity / (1 - 0.999 ** step)) + 1e-8)) / np.sqrt(step)
+        self.weights = params[:-1]
+        self.bias = float(params[-1])
+        return self
+
+
+def choose_threshold(scores: np.ndarray, labels: np.ndarray, target_agreement: float,
+                     label_yes: bool) -> float | None:
+    """
+    Loosest threshold at which the chunks labeled locally on one side (score >= threshold
+    for YES, <= threshold for NO) agree with the LLM labels at least target_agreement of
+    the time. None if no threshold does.
+    """
+    order = np.argsort(-scores if label_yes else scores)
+    correct = (labels[order] == label_yes).astype(np.float64)
+    agreement = np.cumsum(correct) / np.arange(1, len(order) + 1)
+    valid = np.nonzero(agreement >= target_agreement)[0]
+    if len(valid) == 0:
+        return None
+    return float(scores[order][valid[-1]])
+
+
+class ChunkCascade:
+    def __init__(self, num_features: int = 2 ** 16, audit_rate: float = 0.0):
+        """
+        Per-classifier local models with their thresholds, keyed by classifier name.
+        With audit_rate, that fraction of the locally labeled chunks is still sent to the
+        LLM to measure live agreement.
+        """
+        self.num_features = num_features
+        self.audit_rate = audit_rate
+        # File the cascade was loaded from, if any
+        self.path = None
+        self.models = {}
+        self.thresholds = {}
+        self.training_report = {}
+        self.counts = {}
+
+    def fit_classifier(
+        self,
+        name: str,
+        chunks: list[Chunk],
+        labels: list[bool],
+        target_agreement: float = 0.98,
+        validation_fraction: float = 0.3,
+        min_examples: int = 200,
+        seed: int = 0,
+    ) -> dict:
+        """
+        Train the local model of one classifier on (chunk, LLM label is YES) pairs and
+        choose its thresholds on a held-out split. Classifiers with fewer than min_examples
+        labels are not cascaded. Returns the classifier's training report.
+        """
+        if len(chunks) < min_examples:
+            report = {"examples": len(chunks), "cascaded": False, "reason": f"fewer than {min_examples} labels"}
+            self.training_report[name] = report
+            return report
+        rows = [hashed_features(chunk, self.num_features) for chunk in chunks]
+        order = list(range(len(rows)))
+        random.Random(seed).shuffle(order)
+        num_validation = max(1, int(len(order) * validation_fraction))
+        validation, train = order[:num_validation], order[num_validation:]
+        y = np.asarray(labels, dtype=bool)
+
+        model = LogisticModel(self.num_features).fit([rows[i] for i in train], y[train].tolist())
+        scores = model.scores([rows[i] for i in validation])
+        y_validation = y[validation]
+        no_threshold = choose_threshold(scores, y_validation, target_agreement, label_yes=False)
+        yes_threshold = choose_threshold(scores, y_validation, target_agreement, label_yes=True)
+        if no_threshold is not None and yes_threshold is not None and yes_threshold <= no_threshold:
+            # Overlapping bands would label the same chunk both ways; keep the larger side
+            if (scores <= no_threshold).sum() >= (scores >= yes_threshold).sum():
+                yes_threshold = None
+            else:
+                no_threshold = None
+
+        local_no = scores <= no_threshold if no_threshold is not None else np.zeros(len(scores), dtype=bool)
+        local_yes = scores >= yes_threshold if yes_threshold is not None else np.zeros(len(scores), dtype=bool)
+        local = local_no | local_yes
+        agreed = (local_no & ~y_validation) | (local_yes & y_validation)
+        report = {
+            "examples": len(chunks),
+            "yes_rate": float(y.mean()),
+            "cascaded": bool(local.any()),
+            "no_threshold": no_threshold,
+            "yes_threshold": yes_threshold,
+            "validation_examples": len(validation),
+            "validation_local_fraction": float(local.mean()),
+            "validation_local_agreement": float(agreed.sum() / local.sum()) if local.any() else None,
+        }
+        self.training_report[name] = report
+        if report["cascaded"]:
+            self.models[name] = model
+            self.thresholds[name] = (no_threshold, yes_threshold)
+        return report
+
+    def predict(self, name: str, chunk: Chunk) -> bool | None:
+        """
+        Local label of a chunk: True (YES), False (NO), or None if it should go to the LLM
+        (uncertain, or no model for this classifier).
+        """
+        model = self.models.get(name)
+        if model is None:
+            return None
+        counts = self.counts.setdefault(name, {"local_yes": 0, "local_no": 0, "deferred": 0,
+                                               "audited": 0, "audit_agreed": 0})
+        score = model.scores([hashed_features(chunk, self.num_features)])[0]
+        no_threshold, yes_threshold = self.thresholds[name]
+        if no_threshold is not None and score <= no_threshold:
+            counts["local_no"] += 1
+            return False
+        if yes_threshold is not None and score >= yes_threshold:
+            counts["local_yes"] += 1
+            return True
+        counts["deferred"] += 1
+        return None
+
+    def should_audit(self) -> bool:
+        return self.audit_rate > 0 and random.random() < self.audit_rate
+
+    def record_audit(self, name: str, local_label: bool, llm_label: bool):
+        counts = self.counts[name]
+        counts["audited"] += 1
+        counts["audit_agreed"] += local_label == llm_label
+
+    def report(self) -> dict:
+        """Chunks labeled locally (LLM calls saved), deferred and audited, per classifier."""
+        report = {}
+        for name, counts in self.counts.items():
+            local = counts["local_yes"] + counts["local_no"]
+            total = local + counts["deferred"]
+            report[name] = {
+                **counts,
+                "calls_saved": local - counts["audited"],
+                "local_fraction": local / total if total else 0.0,
+                "audit_agreement": counts["audit_agreed"] / counts["audited"] if counts["audited"] else None,
+            }
+        return report
+
+    def save(self, path: str):
+        """Save the models, thresholds and training report to an .npz file."""
+        names = sorted(self.models)
+        np.savez_compressed(
+            path,
+            metadata=np.array(json.dumps({
+                "num_features": self.num_features,
+                "names": names,
+                "biases": [self.models[name].bias for name in names],
+                "thresholds": [self.thresholds[name] for name in names],
+                "training_report": self.training_report,
+            })),
+            weights=np.stack([self.models[name].weights for name in names]) if names
+            else np.zeros((0, self.num_features)),
+        )
+
+    @classmethod
+    def load(cls, path: str, audit_rate: float = 0.0) -> "ChunkCascade":
+        with np.load(path) as archive:
+            metadata = json.loads(str(archive["metadata"]))
+            weights = archive["weights"]
+        cascade = cls(num_features=metadata["num_features"], audit_rate=audit_rate)
+        cascade.path = path
+        cascade.training_report = metadata["training_report"]
+        for i, name in enumerate(metadata["names"]):
+            cascade.models[name] = LogisticModel(metadata["num_features"], weights[i], metadata["biases"][i])
+            cascade.thresholds[name] = tuple(metadata["thresholds"][i])
+        return cascade
+
+
+_cascade = None
+
+
+def get_cascade() -> ChunkCascade | None:
+    """Return the cascade shared by the whole process, or None if it is off (the default)."""
+    return _cascade
+
+
+def set_cascade(cascade: ChunkCascade | None) -> ChunkCascade | None:
+    """Install the shared cascade (None turns it off). Returns the previous one."""
+    global _cascade
+    previous = _cascade
+    _cascade = cascade
+    return previous
@@ -0,0 +1,82 @@
+"""
+Order in which the chunks of a conversation are classified when classification may stop
+early (see EmoClassifier.classify_conversation_until).
+
+With the "any" aggregator a conversation is decided by its first YES chunk, so the chunks
+most likely to be YES should be sent first. ChunkPrior orders chunks forward, in reverse
+(latest messages first), or by a learned prior: the YES rate of each classifier by the
+chunk's relative position in the conversation, counted from earlier results and
+optionally persisted as JSON so the next run starts with it.
+"""
+import json
+import os
+
+from Classifiers.emoclassifiers.classification import YesNoUnsureEnum, is_yes
+
+CHUNK_ORDERS = ["forward", "reverse", "learned"]
+
+
+class ChunkPrior:
+    def __init__(self, order: str = "learned", path: str | None = None, num_buckets: int = 5):
+        """
+        Chunk ordering strategy (one of CHUNK_ORDERS). The learned prior splits each
+        conversation into num_buckets relative positions and keeps YES/total counts per
+        classifier and position; it is loaded from and saved to path, if given.
+        """
+        if order not in CHUNK_ORDERS:
+            raise ValueError(f"Unknown chunk order {order!r}, expected one of {CHUNK_ORDERS}")
+        self.order_name = order
+        self.path = path
+        self.num_buckets = num_buckets
+        # {classifier: {"yes": [per bucket], "total": [per bucket]}}
+        self.counts = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("num_buckets") == num_buckets:
+                self.counts = data["counts"]
+
+    def bucket(self, position: int, num_chunks: int) -> int:
+        return min(self.num_buckets - 1, position * self.num_buckets // max(num_chunks, 1))
+
+    def yes_rate(self, classifier: str, bucket: int) -> float:
+        """Laplace-smoothed YES rate of a classifier at a relative position (0.5 without data)."""
+        counts = self.counts.get(classifier)
+        if counts is None:
+            return 0.5
+        return (counts["yes"][bucket] + 1) / (counts["total"][bucket] + 2)
+
+    def order(self, classifier: str, chunk_ids: list[int]) -> list[int]:
+        """Chunk ids in the order they should be classified."""
+        if self.order_name == "forward":
+            return list(chunk_ids)
+        # Ties (and the learned order without data) go to the latest chunks first
+        reverse = list(reversed(chunk_ids))
+        if self.order_name == "reverse":
+            return reverse
+        positions = {chunk_id: position for position, chunk_id in enumerate(chunk_ids)}
+        return sorted(
+            reverse,
+            key=lambda chunk_id: -self.yes_rate(classifier, self.bucket(positions[chunk_id], len(chunk_ids))),
+        )
+
+    def update(self, classifier: str, chunk_ids: list[int], results: dict[int, YesNoUnsureEnum | float]):
+        """
+        Count the classified chunks (results may cover only some of chunk_ids, when
+        classification stopped early).
+        """
+        counts = self.counts.setdefault(
+            classifier, {"yes": [0] * self.num_buckets, "total": [0] * self.num_buckets}
+        )
+        for position, chunk_id in enumerate(chunk_ids):
+            if chunk_id not in results:
+                continue
+            bucket = self.bucket(position, len(chunk_ids))
+            counts["total"][bucket] += 1
+            counts["yes"][bucket] += is_yes(results[chunk_id])
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"num_buckets": self.num_buckets, "counts": self.counts}, f, indent=2)
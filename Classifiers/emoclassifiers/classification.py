@@ -1,10 +1,20 @@
 import asyncio
+import functools
+import itertools
+import math
+import string
 from enum import Enum
 import openai
 import pydantic
 import Classifiers.emoclassifiers.io_utils as io_utils
+from Classifiers.emoclassifiers.calibration import PlattCalibration
+from Classifiers.emoclassifiers.cascade import ChunkCascade, get_cascade
 from Classifiers.emoclassifiers.chunking import Chunk, CHUNKER_DICT
+from Classifiers.emoclassifiers.result_cache import ClassificationCache, get_classification_cache
 import Classifiers.emoclassifiers.prompt_templates as prompt_templates
+from Common.accounting import accounting_tags
+from Common.clients import get_client_factory
+from Common.rate_limiting import RateLimiter, estimate_tokens
 
 
 CLASSIFIER_DEFINITION_PATH_DICT = {
@@ -14,6 +24,13 @@ CLASSIFIER_DEFINITION_PATH_DICT = {
 }
 
 
+# Per-chunk prompt layouts: "default" puts the classifier name and prompt near the top and
+# the snippet in the middle; "prefix_stable" starts with instructions and the definitions of
+# every classifier in the set, then names the target classifier, then the snippet, so all
+# prompts of a set share a cacheable prefix (see prompt_templates.EMO_CLASSIFIER_STATIC_INSTRUCTIONS)
+PROMPT_LAYOUTS = ["default", "prefix_stable"]
+
+
 class YesNoUnsureEnum(Enum):
     """
     Classification output.
@@ -30,6 +47,56 @@ class ResponseFormat(pydantic.BaseModel):
     response: YesNoUnsureEnum
 
 
+class AnswerProbabilities(pydantic.BaseModel):
+    """
+    Probability of each answer, read from the logprobs of a single-token answer and
+    normalized over the three answers.
+    """
+    yes: float
+    no: float
+    unsure: float
+
+
+# Number of most likely first tokens whose logprobs are returned in logprob mode
+TOP_LOGPROBS = 10
+
+
+def answer_probabilities(top_logprobs: list) -> AnswerProbabilities:
+    """
+    Answer probabilities from the top logprobs of the first output token. Every token
+    that starts one of the answers, ignoring case, whitespace and punctuation ("Yes",
+    " no", "Yes.", "uns", ...), counts toward it. If none of the top tokens is an
+    answer, the chunk is "unsure" rather than an error.
+    """
+    mass = {label: 0.0 for label in YesNoUnsureEnum}
+    for entry in top_logprobs:
+        token = entry.token.strip(string.whitespace + string.punctuation).lower()
+        if not token:
+            continue
+        for label in YesNoUnsureEnum:
+            if label.value.startswith(token):
+                mass[label] += math.exp(entry.logprob)
+                break
+    total = sum(mass.values())
+    if total == 0:
+        return AnswerProbabilities(yes=0.0, no=0.0, unsure=1.0)
+    return AnswerProbabilities(**{label.value: value / total for label, value in mass.items()})
+
+
+def is_yes(result: YesNoUnsureEnum | float) -> bool:
+    """Whether a chunk result is a YES: a YES label, or a P(yes) of at least one half."""
+    if isinstance(result, YesNoUnsureEnum):
+        return result == YesNoUnsureEnum.YES
+    return result >= 0.5
+
+
+def yes_probability(result: YesNoUnsureEnum | float) -> float:
+    """P(yes) of a chunk result; a label counts as 1.0 if YES and 0.0 otherwise."""
+    if isinstance(result, YesNoUnsureEnum):
+        return 1.0 if result == YesNoUnsureEnum.YES else 0.0
+    return result
+
+
 def format_criteria(criteria: list[str]) -> str:
     """
     Format criteria for EmoClassifiers V2.
@@ -39,14 +106,48 @@ def format_criteria(criteria: list[str]) -> str:
     )
 
 
+def get_classifier_title(classifier_definition: dict) -> str:
+    """
+    Name a per-chunk prompt gives the classifier (the full name for EmoClassifiers V2).
+    """
+    if classifier_definition["version"] == "v2":
+        return classifier_definition["full_name"]
+    return classifier_definition["name"]
+
+
+def get_prefix_stable_definitions_text(
+    classifier_definition: dict,
+    set_definitions: dict[str, dict] | None,
+) -> str:
+    """
+    Definitions listed in the shared prefix of the prefix-stable layout: every per-chunk
+    classifier of the set, in set order, and the target classifier if it is not one of them.
+    """
+    definitions = [definition for definition in (set_definitions or {}).values()
+                   if definition["version"] in ("v1", "v2")]
+    if classifier_definition not in definitions:
+        definitions.append(classifier_definition)
+    return "\n\n".join(get_grouped_definition_text(get_classifier_title(definition), definition)
+                       for definition in definitions)
+
+
 def get_emo_classifiers_v1_prompt(
     classifier_definition: dict,
     chunk: Chunk,
+    layout: str = "default",
+    set_definitions: dict[str, dict] | None = None,
 ) -> str:
     """
     Construct classification prompt for EmoClassifiers V1 (sub-classifier).
     """
     assert classifier_definition["version"] == "v1"
+    if layout == "prefix_stable":
+        return prompt_templates.EMO_CLASSIFIER_V1_PREFIX_STABLE_PROMPT_TEMPLATE.format(
+            definitions=get_prefix_stable_definitions_text(classifier_definition, set_definitions),
+            classifier_name=get_classifier_title(classifier_definition),
+            snippet_string=chunk.to_string(),
+            prompt_short=classifier_definition["prompt"].splitlines()[0],
+        )
     return prompt_templates.EMO_CLASSIFIER_V1_PROMPT_TEMPLATE.format(
         classifier_name=classifier_definition["name"],
         prompt=classifier_definition["prompt"],
@@ -73,11 +174,20 @@ def get_emo_classifiers_v1_top_level_prompt(
 def get_emo_classifiers_v2_prompt(
     classifier_definition: dict,
     chunk: Chunk,
+    layout: str = "default",
+    set_definitions: dict[str, dict] | None = None,
 ) -> str:
     """
     Construct classification prompt for EmoClassifiers V2.
     """
     assert classifier_definition["version"] == "v2"
+    if layout == "prefix_stable":
+        return prompt_templates.EMO_CLASSIFIER_V2_PREFIX_STABLE_PROMPT_TEMPLATE.format(
+            definitions=get_prefix_stable_definitions_text(classifier_definition, set_definitions),
+            classifier_name=get_classifier_title(classifier_definition),
+            snippet_string=chunk.to_string(),
+            prompt=classifier_definition["prompt"],
+        )
     return prompt_templates.EMO_CLASSIFIER_V2_PROMPT_TEMPLATE.format(
         classifier_name=classifier_definition["full_name"],
         criteria=format_criteria(classifier_definition["criteria"]),
@@ -89,57 +199,404 @@ def get_emo_classifiers_v2_prompt(
 def get_emo_classifiers_prompt(
     classifier_definition: dict,
     chunk: Chunk,
+    layout: str = "default",
+    set_definitions: dict[str, dict] | None = None,
 ) -> str:
     """
-    Construct classification prompt.
+    Construct classification prompt in one of PROMPT_LAYOUTS (V1 top-level prompts have
+    a single layout). The prefix-stable layout lists set_definitions (the classifier set
+    the definition belongs to) in its shared prefix.
     """
+    if layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout {layout!r}, expected one of {PROMPT_LAYOUTS}")
     if classifier_definition["version"] == "v1":
-        return get_emo_classifiers_v1_prompt(classifier_definition=classifier_definition, chunk=chunk)
+        return get_emo_classifiers_v1_prompt(classifier_definition=classifier_definition, chunk=chunk, layout=layout,
+                                             set_definitions=set_definitions)
     elif classifier_definition["version"] == "v1_top_level":
         return get_emo_classifiers_v1_top_level_prompt(classifier_definition=classifier_definition, chunk=chunk)
     elif classifier_definition["version"] == "v2":
-        return get_emo_classifiers_v2_prompt(classifier_definition=classifier_definition, chunk=chunk)
+        return get_emo_classifiers_v2_prompt(classifier_definition=classifier_definition, chunk=chunk, layout=layout,
+                                             set_definitions=set_definitions)
     else:
         raise ValueError(f"Unknown version: {classifier_definition['version']}")
 
 
+def get_grouped_definition_text(name: str, classifier_definition: dict) -> str:
+    """
+    Render one classifier definition as a task of a grouped prompt.
+    """
+    prompt = classifier_definition["prompt"]
+    if classifier_definition["version"] == "v2":
+        prompt = f"{prompt}\nCriteria:\n{format_criteria(classifier_definition['criteria'])}"
+    return prompt_templates.EMO_CLASSIFIER_GROUPED_DEFINITION_TEMPLATE.format(
+        classifier_name=name,
+        prompt=prompt,
+    )
+
+
+def get_emo_classifiers_grouped_prompt(
+    classifier_definitions: dict[str, dict],
+    chunk: Chunk,
+) -> str:
+    """
+    Construct one classification prompt for several classifiers that share a chunker.
+    Tasks are titled (and answered) by the keys of classifier_definitions.
+    """
+    return prompt_templates.EMO_CLASSIFIER_GROUPED_PROMPT_TEMPLATE.format(
+        num_classifiers=len(classifier_definitions),
+        classifier_definitions="\n\n".join(
+            get_grouped_definition_text(name, definition)
+            for name, definition in classifier_definitions.items()
+        ),
+        snippet_string=chunk.to_string(),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_grouped_response_format(names: tuple[str, ...]) -> type[pydantic.BaseModel]:
+    """
+    Response format for a grouped classification: one yes/no/unsure field per classifier,
+    keyed by classifier name (field aliases, since names contain spaces).
+    """
+    return pydantic.create_model(
+        "GroupedResponseFormat",
+        **{
+            f"classifier_{i}": (YesNoUnsureEnum, pydantic.Field(alias=name))
+            for i, name in enumerate(names)
+        },
+    )
+
+
+# What each chunker's chunk ids refer to, for the single-call conversation prompt
+CONVERSATION_TARGET_DESCRIPTIONS = {
+    "user_message": "each numbered user message listed below",
+    "assistant_message": "each numbered assistant message listed below",
+    "u_a_exchange": "each numbered assistant message listed below, together with the user message it responds to (as an exchange)",
+    "a_u_exchange": "each numbered user message listed below, together with the assistant message it responds to (as an exchange)",
+}
+
+
+def format_indexed_conversation(conversation: list[dict]) -> str:
+    """
+    Render a conversation with the index of every message, as used for chunk ids.
+    """
+    return "\n".join(
+        '[{index}] [{role}]: "{content}"'.format(
+            index=i,
+            role=message["role"].upper(),
+            content=message["content"].strip(),
+        )
+        for i, message in enumerate(conversation)
+    )
+
+
+def get_emo_classifiers_conversation_prompt(
+    classifier_definition: dict,
+    conversation: list[dict],
+    indices: list[int],
+) -> str:
+    """
+    Construct one classification prompt for the whole conversation, asking for a label
+    per target message index (the chunk ids of the classifier's chunker).
+    """
+    prompt = classifier_definition["prompt"]
+    if classifier_definition["version"] == "v2":
+        prompt = f"{prompt}\nCriteria:\n{format_criteria(classifier_definition['criteria'])}"
+    return prompt_templates.EMO_CLASSIFIER_CONVERSATION_PROMPT_TEMPLATE.format(
+        classifier_name=classifier_definition.get("full_name", classifier_definition["name"]),
+        prompt=prompt,
+        target_description=CONVERSATION_TARGET_DESCRIPTIONS[classifier_definition["chunker"]],
+        conversation_string=format_indexed_conversation(conversation),
+        prompt_short=classifier_definition["prompt"].splitlines()[0],
+        indices=", ".join(str(index) for index in indices),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_indexed_response_format(indices: tuple[int, ...]) -> type[pydantic.BaseModel]:
+    """
+    Response format for a single-call classification: one yes/no/unsure field per
+    target message, keyed by the message index.
+    """
+    return pydantic.create_model(
+        "IndexedResponseFormat",
+        **{
+            f"message_{index}": (YesNoUnsureEnum, pydantic.Field(alias=str(index)))
+            for index in indices
+        },
+    )
+
+
 class ModelWrapper:
     def __init__(
         self,
         openai_client: openai.AsyncOpenAI | None = None,
         model: str = "gpt-4o-mini-2024-07-18",
-        max_concurrent: int = 5,
+        initial_concurrency: int = 5,
+        rate_limiter: RateLimiter | None = None,
+        cache: ClassificationCache | None = None,
+        cascade: ChunkCascade | None = None,
+        logprobs: bool = False,
+        calibration: PlattCalibration | None = None,
+        prompt_layout: str = "default",
+        set_definitions: dict[str, dict] | None = None,
     ):
         """
-        A wrapper around the OpenAI async client with semaphore and model name.
+        A wrapper around the OpenAI async client with model name.
+        The rate limiter may be shared with other components to enforce one RPM/TPM budget.
+        Requests in flight are bounded by the rate limiter's adaptive concurrency limit for
+        the model, which starts at initial_concurrency (if this wrapper creates it) and
+        adjusts to the latencies and overload errors it sees.
+        Results are looked up in cache first (default: the shared classification cache, if any),
+        and chunks the cascade (default: the shared one, if any) is confident about are
+        labeled locally.
+        With logprobs, a chunk is classified with a single-token answer and its result is
+        P(yes) (a float) read from the token logprobs, mapped through calibration if given,
+        instead of a YesNoUnsureEnum label. Grouped and single-call requests still answer
+        with labels.
+        Per-chunk prompts use prompt_layout (one of PROMPT_LAYOUTS); the prefix-stable layout
+        lists set_definitions in its shared prefix (load_classifiers sets them to the loaded
+        set if not given).
         """
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {prompt_layout!r}, expected one of {PROMPT_LAYOUTS}")
         if openai_client is None:
-            openai_client = openai.AsyncOpenAI()
+            openai_client = get_client_factory().openai_async()
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
         self.openai_client = openai_client
         self.model = model
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.cascade = cascade
+        self.logprobs = logprobs
+        self.calibration = calibration
+        self.prompt_layout = prompt_layout
+        self.set_definitions = set_definitions
+        self.concurrency = rate_limiter.adaptive_concurrency("openai", model, initial_limit=initial_concurrency)
+        # Pending requests by content key; identical concurrent requests await the same one
+        self.in_flight = {}
+        self.coalesced_calls = 0
 
-    async def classify_conversation_chunk(
+    async def parse(
         self,
-        classifier_definition: dict,
-        chunk: Chunk,
-        max_completion_tokens: int = 20,
-    ) -> YesNoUnsureEnum:
+        prompt: str,
+        response_format: type[pydantic.BaseModel],
+        max_completion_tokens: int,
+        classifier: str | None = None,
+        request=None,
+    ) -> pydantic.BaseModel:
+        """
+        Send one structured-output request (or another kind of request: `request` is
+        called like self.request and returns a response_format instance) and return the
+        parsed response. An identical
+        earlier request (same model, prompt and response format) is answered from the
+        classification cache without an API call, and an identical request that is still
+        in flight is awaited instead of being sent again (counted in coalesced_calls).
+        """
+        key = ClassificationCache.key(self.model, prompt, response_format.model_json_schema())
+        cache = self.cache if self.cache is not None else get_classification_cache()
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return response_format.model_validate(cached)
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            self.coalesced_calls += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # The request we waited for was cancelled (e.g. its conversation was already
+            # decided), but this caller still needs the answer: send it again
+            self.coalesced_calls -= 1
+            return await self.parse(prompt, response_format, max_completion_tokens, classifier, request)
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            parsed = await (request or self.request)(prompt, response_format, max_completion_tokens, classifier)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here, so that a failure without waiters is not logged
+            raise
+        finally:
+            del self.in_flight[key]
+        future.set_result(parsed)
+        if cache is not None:
+            cache.put(key, parsed.model_dump(mode="json", by_alias=True))
+        return parsed
+
+    async def request(
+        self,
+        prompt: str,
+        response_format: type[pydantic.BaseModel],
+        max_completion_tokens: int,
+        classifier: str | None = None,
+    ) -> pydantic.BaseModel:
         """
-        Classify a single conversaiton chunk.
+        Send one structured-output request through the rate limiter.
         """
-        prompt = get_emo_classifiers_prompt(classifier_definition=classifier_definition, chunk=chunk)
-        async with self.semaphore:
-            response = await self.openai_client.beta.chat.completions.parse(
+        with accounting_tags(stage="classifier", classifier=classifier):
+            response = await self.rate_limiter.call(
+                "openai", self.model, estimate_tokens(prompt, max_output_tokens=max_completion_tokens),
+                self.openai_client.beta.chat.completions.parse,
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
-                response_format=ResponseFormat,
+                response_format=response_format,
                 max_completion_tokens=max_completion_tokens,
             )
         message = response.choices[0].message
         assert message.parsed, "Failed to parse response"
-        return message.parsed.response
+        return message.parsed
+
+    async def request_logprobs(
+        self,
+        prompt: str,
+        response_format: type[AnswerProbabilities],
+        max_completion_tokens: int,
+        classifier: str | None = None,
+    ) -> AnswerProbabilities:
+        """
+        Send one single-token request through the rate limiter and read the answer
+        probabilities from the logprobs of its token.
+        """
+        with accounting_tags(stage="classifier", classifier=classifier):
+            response = await self.rate_limiter.call(
+                "openai", self.model, estimate_tokens(prompt, max_output_tokens=max_completion_tokens),
+                self.openai_client.chat.completions.create,
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_completion_tokens=max_completion_tokens,
+                logprobs=True,
+                top_logprobs=TOP_LOGPROBS,
+            )
+        content = response.choices[0].logprobs.content
+        assert content, "No logprobs in response"
+        return answer_probabilities(content[0].top_logprobs)
+
+    async def classify_conversation_chunk(
+        self,
+        classifier_definition: dict,
+        chunk: Chunk,
+        max_completion_tokens: int = 20,
+    ) -> YesNoUnsureEnum | float:
+        """
+        Classify a single conversaiton chunk. Chunks the cascade is confident about are
+        labeled locally, without a request. In logprob mode, returns P(yes) instead of a
+        label (see classify_conversation_chunk_probability).
+        """
+        name = classifier_definition.get("name")
+        cascade, local_label = self.cascade_label(name, chunk)
+        if local_label is not None and not cascade.should_audit():
+            return yes_probability(local_label) if self.logprobs else local_label
+        if self.logprobs:
+            result = await self.classify_conversation_chunk_probability(classifier_definition, chunk)
+        else:
+            prompt = get_emo_classifiers_prompt(classifier_definition=classifier_definition, chunk=chunk,
+                                                layout=self.prompt_layout, set_definitions=self.set_definitions)
+            result = (await self.parse(prompt, ResponseFormat, max_completion_tokens, name)).response
+        if local_label is not None:
+            cascade.record_audit(name, local_label == YesNoUnsureEnum.YES, is_yes(result))
+        return result
+
+    async def classify_conversation_chunk_probability(
+        self,
+        classifier_definition: dict,
+        chunk: Chunk,
+    ) -> float:
+        """
+        P(yes) of a single conversation chunk, from the logprobs of a one-token answer
+        (normalized over yes/no/unsure, then calibrated if this wrapper has a calibration).
+        Cached and coalesced like structured requests; the cache holds the raw
+        probabilities, so changing the calibration does not invalidate it.
+        """
+        prompt = (get_emo_classifiers_prompt(classifier_definition=classifier_definition, chunk=chunk,
+                                             layout=self.prompt_layout, set_definitions=self.set_definitions)
+                  + prompt_templates.SINGLE_TOKEN_ANSWER_SUFFIX)
+        probabilities = await self.parse(prompt, AnswerProbabilities, 1, classifier_definition.get("name"),
+                                         request=self.request_logprobs)
+        if self.calibration is not None:
+            return self.calibration(probabilities.yes)
+        return probabilities.yes
+
+    def cascade_label(self, name: str, chunk: Chunk) -> tuple[ChunkCascade | None, YesNoUnsureEnum | None]:
+        """
+        The cascade in use (this wrapper's, or the shared one) and its local label of the
+        chunk for the named classifier, or None if the chunk needs the LLM.
+        """
+        cascade = self.cascade if self.cascade is not None else get_cascade()
+        if cascade is None:
+            return None, None
+        label = cascade.predict(name, chunk)
+        if label is None:
+            return cascade, None
+        return cascade, YesNoUnsureEnum.YES if label else YesNoUnsureEnum.NO
 
+    async def classify_conversation_chunk_grouped(
+        self,
+        classifier_definitions: dict[str, dict],
+        chunk: Chunk,
+        max_completion_tokens: int | None = None,
+    ) -> dict[str, YesNoUnsureEnum]:
+        """
+        Classify a single conversation chunk with several classifiers in one request.
+        Returns the answer of each classifier, keyed like classifier_definitions.
+        Classifiers the cascade labels locally are left out of the request, except for
+        the ones picked for an audit, as in classify_conversation_chunk.
+        """
+        all_names = list(classifier_definitions)
+        local = {}
+        audited = {}
+        for name, definition in classifier_definitions.items():
+            cascade, local_label = self.cascade_label(definition.get("name"), chunk)
+            if local_label is None:
+                continue
+            if cascade.should_audit():
+                audited[name] = (cascade, local_label)
+            else:
+                local[name] = local_label
+        if len(local) == len(all_names):
+            return local
+        requested = {name: definition for name, definition in classifier_definitions.items() if name not in local}
+        names = tuple(requested)
+        if max_completion_tokens is None:
+            max_completion_tokens = 20 + 15 * len(names)
+        prompt = get_emo_classifiers_grouped_prompt(classifier_definitions=requested, chunk=chunk)
+        # One request answers the whole group, so its usage is booked under the group
+        # ("Fear of Movement + Pain Catastrophizing") rather than split between classifiers
+        tag = " + ".join(definition.get("name", name) for name, definition in requested.items())
+        parsed = await self.parse(prompt, get_grouped_response_format(names), max_completion_tokens, tag)
+        answers = {name: getattr(parsed, f"classifier_{i}") for i, name in enumerate(names)}
+        for name, (cascade, local_label) in audited.items():
+            cascade.record_audit(classifier_definitions[name].get("name"), local_label == YesNoUnsureEnum.YES,
+                                 is_yes(answers[name]))
+        return {name: local[name] if name in local else answers[name] for name in all_names}
+
+    async def classify_conversation_indexed(
+        self,
+        classifier_definition: dict,
+        conversation: list[dict],
+        indices: list[int],
+        max_completion_tokens: int | None = None,
+    ) -> dict[int, YesNoUnsureEnum]:
+        """
+        Classify the messages at the given indices of a conversation in one request that
+        contains the whole conversation once. Returns the answer per index.
+        """
+        if max_completion_tokens is None:
+            max_completion_tokens = 20 + 10 * len(indices)
+        prompt = get_emo_classifiers_conversation_prompt(
+            classifier_definition=classifier_definition,
+            conversation=conversation,
+            indices=indices,
+        )
+        parsed = await self.parse(prompt, get_indexed_response_format(tuple(indices)), max_completion_tokens,
+                                  classifier_definition.get("name"))
+        return {index: getattr(parsed, f"message_{index}") for index in indices}
 
 
 class EmoClassifier:
@@ -147,36 +604,113 @@ class EmoClassifier:
         self,
         classifier_definition: dict,
         model_wrapper: ModelWrapper,
+        single_call: bool = False,
     ):
         """
         Main classifier object for performing classification over a conversation.
+        With single_call, the conversation is sent once with indexed messages instead of
+        once per chunk (see classify_conversation_single_call).
         """
         self.model_wrapper = model_wrapper
         self.classifier_definition = classifier_definition
-        self.semaphore = asyncio.Semaphore(5)  # Limit to 20 concurrent calls
+        self.single_call = single_call
+        # Chunk calls skipped or cancelled by classify_conversation_until
+        self.short_circuited_chunks = 0
+
 
 
+    async def classify_conversation_single_call(self, conversation: list[dict]) -> dict[int, YesNoUnsureEnum]:
+        """
+        Classify every chunk of the conversation in one request. The whole conversation is
+        sent once with numbered messages, and the model labels each chunk's target message
+        (the chunk id), instead of every chunk repeating its context messages. Returns the
+        same {chunk_id: result} map as classify_conversation.
+        """
+        chunker_name = self.classifier_definition["chunker"]
+        if chunker_name not in CONVERSATION_TARGET_DESCRIPTIONS:
+            # A whole-conversation classifier is already a single call
+            return await self.classify_conversation_chunked(conversation)
+        indices = list(CHUNKER_DICT[chunker_name].chunk_simple_convo(conversation))
+        if not indices:
+            return {}
+        return await self.model_wrapper.classify_conversation_indexed(
+            classifier_definition=self.classifier_definition,
+            conversation=conversation,
+            indices=indices,
+        )
 
     async def classify_conversation(self, conversation: list[dict]) -> list[dict]:
+        if self.single_call:
+            return await self.classify_conversation_single_call(conversation)
+        return await self.classify_conversation_chunked(conversation)
+
+    async def classify_conversation_chunked(self, conversation: list[dict]) -> list[dict]:
         chunker = CHUNKER_DICT[self.classifier_definition["chunker"]]
         chunks = chunker.chunk_simple_convo(conversation)
         keys = []
         futures = []
-
-        async def classify_chunk(chunk_id, chunk):
-            async with self.semaphore:
-                return await self.model_wrapper.classify_conversation_chunk(
+        for chunk_id, chunk in chunks.items():
+            futures.append(
+                self.model_wrapper.classify_conversation_chunk(
                     classifier_definition=self.classifier_definition,
                     chunk=chunk,
                 )
-
-        for chunk_id, chunk in chunks.items():
-            futures.append(classify_chunk(chunk_id, chunk))
+            )
             keys.append(chunk_id)
 
         results = await asyncio.gather(*futures)
         return {key: result for key, result in zip(keys, results)}
 
+    async def classify_conversation_until(
+        self,
+        conversation: list[dict],
+        aggregator,
+        chunk_prior=None,
+        window: int = 4,
+    ) -> dict[int, YesNoUnsureEnum]:
+        """
+        Classify chunks in priority order (chunk_prior.order, default: conversation order),
+        at most `window` at a time, until aggregator.decided() holds for the results so
+        far; the remaining queued and in-flight chunk calls are then skipped or cancelled
+        (counted in short_circuited_chunks).
+        Returns only the classified chunks, which aggregate to the same value as the full
+        result. Single-call classifiers send one request anyway and are not cut short.
+        """
+        if self.single_call:
+            return await self.classify_conversation_single_call(conversation)
+        chunks = CHUNKER_DICT[self.classifier_definition["chunker"]].chunk_simple_convo(conversation)
+        chunk_ids = list(chunks)
+        name = self.classifier_definition.get("name")
+        order = chunk_prior.order(name, chunk_ids) if chunk_prior is not None else chunk_ids
+
+        # The window bounds the speculative calls per conversation; the model wrapper's
+        # concurrency limit bounds the calls of all conversations together
+        queue = iter(order)
+        pending = {}
+        results = {}
+        try:
+            while not aggregator.decided(results):
+                for chunk_id in itertools.islice(queue, window - len(pending)):
+                    task = asyncio.create_task(self.model_wrapper.classify_conversation_chunk(
+                        classifier_definition=self.classifier_definition,
+                        chunk=chunks[chunk_id],
+                    ))
+                    pending[task] = chunk_id
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[pending.pop(task)] = task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        self.short_circuited_chunks += len(chunk_ids) - len(results)
+        if chunk_prior is not None:
+            chunk_prior.update(name, chunk_ids, results)
+        return {chunk_id: results[chunk_id] for chunk_id in chunk_ids if chunk_id in results}
+
     # async def classify_conversation(self, conversation: list[dict]) -> list[dict]:
     #     """
     #     Classify a conversation. Depending on the classifier definition, it may
@@ -199,13 +733,80 @@ class EmoClassifier:
     #     return {key: result for key, result in zip(keys, results)}
 
 
+def group_classifiers(
+    classifiers: dict[str, EmoClassifier],
+    max_group_size: int | None = None,
+) -> tuple[list[list[str]], dict[str, EmoClassifier]]:
+    """
+    Names of the classifiers that can be asked together (same chunker and model wrapper),
+    at most max_group_size per group, and the single-call classifiers, which are not grouped.
+    """
+    groups = {}
+    single_call = {}
+    for name, classifier in classifiers.items():
+        if classifier.single_call:
+            single_call[name] = classifier
+            continue
+        key = (classifier.classifier_definition["chunker"], id(classifier.model_wrapper))
+        groups.setdefault(key, []).append(name)
+    if max_group_size is None:
+        return list(groups.values()), single_call
+    return [
+        names[start:start + max_group_size]
+        for names in groups.values()
+        for start in range(0, len(names), max_group_size)
+    ], single_call
+
+
+async def classify_conversation_grouped(
+    classifiers: dict[str, EmoClassifier],
+    conversation: list[dict],
+    max_group_size: int | None = None,
+) -> dict[str, dict]:
+    """
+    Multi-label counterpart of EmoClassifier.classify_conversation for a set of classifiers.
+    Classifiers that share a chunker (and model wrapper) are asked together: one request
+    per chunk covers all of them, instead of one request per (classifier, chunk). Groups
+    larger than max_group_size are split, and single-call classifiers keep their own
+    one-request-per-conversation mode. Returns the same per-classifier result dicts
+    ({chunk_id: YesNoUnsureEnum}) as calling classify_conversation on each classifier.
+    """
+    groups, single_call = group_classifiers(classifiers, max_group_size)
+    results = {name: {} for name in classifiers}
+    keys = []
+    futures = []
+    for names in groups:
+        first = classifiers[names[0]]
+        chunker = CHUNKER_DICT[first.classifier_definition["chunker"]]
+        definitions = {name: classifiers[name].classifier_definition for name in names}
+        for chunk_id, chunk in chunker.chunk_simple_convo(conversation).items():
+            futures.append(first.model_wrapper.classify_conversation_chunk_grouped(
+                classifier_definitions=definitions,
+                chunk=chunk,
+            ))
+            keys.append(chunk_id)
+    single_call_results = asyncio.gather(*[
+        classifier.classify_conversation_single_call(conversation) for classifier in single_call.values()
+    ])
+    grouped_results, single_call_results = await asyncio.gather(asyncio.gather(*futures), single_call_results)
+    for chunk_id, answers in zip(keys, grouped_results):
+        for name, answer in answers.items():
+            results[name][chunk_id] = answer
+    results.update(zip(single_call, single_call_results))
+    return results
+
+
 def load_classifiers(
     classifier_set: str = "v2",
     model_wrapper: ModelWrapper | None = None,
     custom_path: str | None = None,
+    single_call: str | list[str] | None = None,
 ) -> dict[str, EmoClassifier]:
     """
     Load a set of classifiers from a JSON file. Defaults to loading from predefined paths.
+    single_call lists the classifiers that classify a conversation in one request ("all" for every one).
+    Unless the model wrapper already has set_definitions, the loaded set becomes the shared
+    prefix of its prefix-stable prompts.
     """
     if model_wrapper is None:
         model_wrapper = ModelWrapper()
@@ -214,10 +815,13 @@ def load_classifiers(
     else:
         path = custom_path
     definitions = io_utils.load_json(io_utils.get_path(path))
+    if model_wrapper.set_definitions is None:
+        model_wrapper.set_definitions = definitions
     return {
         name: EmoClassifier(
             classifier_definition=definition,
             model_wrapper=model_wrapper,
+            single_call=single_call == "all" or name in (single_call or []),
         )
         for name, definition in definitions.items()
     }
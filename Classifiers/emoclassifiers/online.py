@@ -0,0 +1,65 @@
+"""
+Online classification of a conversation while it is being generated.
+"""
+
+import asyncio
+
+from Classifiers.emoclassifiers.aggregation import Aggregator, AnyAggregator
+from Classifiers.emoclassifiers.chunking import CHUNKER_DICT
+from Classifiers.emoclassifiers.classification import EmoClassifier, YesNoUnsureEnum
+
+
+class OnlineTargetMonitor:
+    def __init__(
+        self,
+        classifiers: dict[str, EmoClassifier],
+        aggregator: type[Aggregator] = AnyAggregator,
+    ):
+        """
+        Tracks a set of target classifiers over a growing conversation.
+        Each update only classifies the chunks that are new since the previous update
+        (chunks end at a message and never change once produced; the "whole" chunk is
+        the exception and is classified again). A target that has been detected is
+        not classified any further, since AnyAggregator can no longer change its result.
+        """
+        self.classifiers = classifiers
+        self.aggregator = aggregator
+        self.chunk_results = {name: {} for name in classifiers}
+        self.detected = {name: False for name in classifiers}
+        self.num_classified_chunks = 0
+
+    async def update(self, conversation: list[dict]) -> dict[str, bool]:
+        """
+        Classify the new chunks of the conversation and return the current result per target.
+        """
+        async def classify_chunk(name, chunk_id, chunk):
+            result = await self.classifiers[name].model_wrapper.classify_conversation_chunk(
+                classifier_definition=self.classifiers[name].classifier_definition,
+                chunk=chunk,
+            )
+            self.chunk_results[name][chunk_id] = result
+
+        futures = []
+        for name, classifier in self.classifiers.items():
+            if self.detected[name]:
+                continue
+            chunker_name = classifier.classifier_definition["chunker"]
+            chunks = CHUNKER_DICT[chunker_name].chunk_simple_convo(conversation)
+            for chunk_id, chunk in chunks.items():
+                if chunk_id not in self.chunk_results[name] or chunker_name == "whole":
+                    futures.append(classify_chunk(name, chunk_id, chunk))
+        self.num_classified_chunks += len(futures)
+        await asyncio.gather(*futures)
+
+        for name in self.classifiers:
+            self.detected[name] = bool(self.aggregator.aggregate(self.chunk_results[name]))
+        return dict(self.detected)
+
+    def all_detected(self) -> bool:
+        return all(self.detected.values())
+
+    def results(self) -> dict[str, bool]:
+        return dict(self.detected)
+
+    def raw_results(self) -> dict[str, dict[int, YesNoUnsureEnum]]:
+        return {name: dict(results) for name, results in self.chunk_results.items()}
@@ -83,3 +83,131 @@ Now, the following is the conversation snippet you will be analyzing:
 
 Once again, the classification task is: {prompt}.
 Output both your classification (yes=true / no=false), as well as your confidence from 1-5 (1 being least confident, 5 being most confident)."""
+
+
+EMO_CLASSIFIER_GROUPED_PROMPT_TEMPLATE = """You are a model for analyzing the emotional content of chatbot conversations.
+You will be presented with a message or conversation snippet from a conversation between a user and a chatbot ("assistant").
+You have {num_classifiers} classification tasks for the same snippet. Each task is answered independently of the others.
+
+The classification tasks are:
+
+{classifier_definitions}
+
+Also, generally:
+- If the user is asking for help with writing a fictional story, the story itself should not be considered in your classification.
+- Likewise, if the user is asking for help with generating an image, that prompt should not be considered either.
+- It is possible that the message or conversation snippet in question has no emotional content. In this case, you should classify it as "no".
+- If the message is extremely short, you may classify it as "no" if you believe there is not enough information to make a classification.
+
+The conversation will be presented in something like the following format:
+
+[USER]: (user's message)
+[ASSISTANT]: (chatbot's message)
+[*USER*]: (user's message)
+
+The classification should only apply to the last message in question, which will be marked with the [*USER*] or [*ASSISTANT*] tag.
+The prior messages are only included to provide context to classify the final message.
+
+Now, the following is the conversation snippet you will be analyzing:
+
+<snippet>
+{snippet_string}
+</snippet>
+
+For each classification task, keyed by its title, output your classification (yes, no, unsure)."""
+
+
+EMO_CLASSIFIER_GROUPED_DEFINITION_TEMPLATE = """### {classifier_name}
+{prompt}"""
+
+
+EMO_CLASSIFIER_CONVERSATION_PROMPT_TEMPLATE = """You are a model for analyzing the emotional content of chatbot conversations.
+You will be presented with a full conversation between a user and a chatbot ("assistant"), with every message numbered.
+Your classification task is entitled '{classifier_name}'. Specifically, we want to know: {prompt}
+
+Also, generally:
+- If the user is asking for help with writing a fictional story, the story itself should not be considered in your classification.
+- Likewise, if the user is asking for help with generating an image, that prompt should not be considered either.
+- It is possible that a message in question has no emotional content. In this case, you should classify it as "no".
+- If a message is extremely short, you may classify it as "no" if you believe there is not enough information to make a classification.
+
+The conversation will be presented in the following format:
+
+[0] [USER]: (user's message)
+[1] [ASSISTANT]: (chatbot's message)
+[2] [USER]: (user's message)
+
+You will classify {target_description} separately, each time only considering that message (and its exchange, if stated) as the one in question.
+The earlier messages are only included to provide context, and later messages should be ignored for that classification.
+
+Now, the following is the conversation you will be analyzing:
+
+<conversation>
+{conversation_string}
+</conversation>
+
+Once again, the classification task is: {prompt_short}
+For each of the message numbers {indices}, output your classification (yes, no, unsure), keyed by the message number."""
+
+
+# Appended to a per-chunk prompt in logprob mode, so that the first output token is the answer
+SINGLE_TOKEN_ANSWER_SUFFIX = """
+Answer with a single word: yes, no, or unsure."""
+
+
+# Prefix-stable layout: the instructions below and the definitions of every classifier in the
+# set are identical for every classifier and chunk, so they form a shared prompt prefix long
+# enough for provider-side prompt caching (at least 1024 tokens for OpenAI). The target
+# classifier is only named after the definitions, and the snippet comes last, followed only
+# by the short reminder of the task.
+EMO_CLASSIFIER_STATIC_INSTRUCTIONS = """You are a model for analyzing the emotional content of chatbot conversations.
+You will be presented with a classification task, and with a message or conversation snippet from a conversation between a user and a chatbot ("assistant") to classify.
+
+Generally:
+- If the user is asking for help with writing a fictional story, the story itself should not be considered in your classification.
+- Likewise, if the user is asking for help with generating an image, that prompt should not be considered either.
+- It is possible that the message or conversation snippet in question has no emotional content. In this case, you should classify it as "no".
+- If the message is extremely short, you may classify it as "no" if you believe there is not enough information to make a classification.
+
+The conversation will be presented in something like the following format:
+
+[USER]: (user's message)
+[ASSISTANT]: (chatbot's message)
+[*USER*]: (user's message)
+
+The classification should only apply to the last message in question, which will be marked with the [*USER*] or [*ASSISTANT*] tag.
+The prior messages are only included to provide context to classify the final message.
+"""
+
+
+EMO_CLASSIFIER_PREFIX_STABLE_DEFINITIONS_TEMPLATE = EMO_CLASSIFIER_STATIC_INSTRUCTIONS + """
+Your classification task will be one of the following:
+
+{definitions}
+"""
+
+
+EMO_CLASSIFIER_V1_PREFIX_STABLE_PROMPT_TEMPLATE = EMO_CLASSIFIER_PREFIX_STABLE_DEFINITIONS_TEMPLATE + """
+Your classification task is the one entitled '{classifier_name}' above.
+
+Now, the following is the conversation snippet you will be analyzing:
+
+<snippet>
+{snippet_string}
+</snippet>
+
+Once again, the classification task is: {prompt_short}
+Output your classification (yes, no, unsure)."""
+
+
+EMO_CLASSIFIER_V2_PREFIX_STABLE_PROMPT_TEMPLATE = EMO_CLASSIFIER_PREFIX_STABLE_DEFINITIONS_TEMPLATE + """
+Your classification task is the one entitled '{classifier_name}' above, with the criteria listed there.
+
+Now, the following is the conversation snippet you will be analyzing:
+
+<snippet>
+{snippet_string}
+</snippet>
+
+Once again, the classification task is: {prompt}.
+Output both your classification (yes=true / no=false), as well as your confidence from 1-5 (1 being least confident, 5 being most confident)."""
@@ -0,0 +1,170 @@
+"""
+Persistent, content-addressed cache of classification results.
+
+Every classification request is keyed by a hash of the model name, the rendered prompt
+and the response format's JSON schema, so a result is reused exactly when the same
+request would be sent again: re-analyzing a file, or re-running a report after adding
+one new classifier, only pays for the chunks whose classifier definition, conversation
+or model changed. Results are stored in SQLite, with age- and size-based eviction.
+
+New results and last-used times are buffered in memory and written in one transaction
+every flush_every operations (and on eviction and close), so a cache hit does not cost
+a commit. A crash loses at most the buffered results, which are simply requested again.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+
+class ClassificationCache:
+    def __init__(
+        self,
+        path: str,
+        max_entries: int | None = None,
+        max_age_days: float | None = None,
+        flush_every: int = 256,
+    ):
+        """
+        SQLite-backed cache at path. Entries older than max_age_days are dropped, and the
+        least recently used ones once there are more than max_entries. Writes are buffered
+        until flush_every results or hits are pending (see flush).
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.flush_every = flush_every
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Under WAL, NORMAL only syncs at checkpoints; a power loss may drop the last commits
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # Buffered writes: key -> (value JSON, time) for new results, key -> time for hits
+        self.pending_results = {}
+        self.pending_last_used = {}
+        self.evict()
+
+    @staticmethod
+    def key(model: str, prompt: str, response_format: dict) -> str:
+        """Content address of a request: hash of model, rendered prompt and response format schema."""
+        payload = json.dumps([model, prompt, response_format], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> str | None:
+        """Stored value (JSON) of key, including results not flushed yet."""
+        if key in self.pending_results:
+            return self.pending_results[key][0]
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, key: str) -> dict | None:
+        value = self.lookup(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if key in self.pending_results:
+            self.pending_results[key] = (value, time.time())
+        else:
+            self.pending_last_used[key] = time.time()
+            self.flush_if_due()
+        return json.loads(value)
+
+    def peek(self, key: str) -> dict | None:
+        """Look up a result without counting it as a hit or marking it as used (e.g. to export labels)."""
+        value = self.lookup(key)
+        return json.loads(value) if value is not None else None
+
+    def put(self, key: str, value: dict):
+        self.pending_results[key] = (json.dumps(value), time.time())
+        self.pending_last_used.pop(key, None)
+        self.writes += 1
+        self.flush_if_due()
+        if self.max_entries is not None and self.writes % 100 == 0:
+            self.evict()
+
+    def flush_if_due(self):
+        if len(self.pending_results) + len(self.pending_last_used) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered results and last-used times in one transaction."""
+        if not self.pending_results and not self.pending_last_used:
+            return
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO results (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+            [(key, value, now, now) for key, (value, now) in self.pending_results.items()],
+        )
+        self.connection.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?",
+            [(now, key) for key, now in self.pending_last_used.items()],
+        )
+        self.connection.commit()
+        self.pending_results.clear()
+        self.pending_last_used.clear()
+
+    def evict(self) -> int:
+        """Drop expired entries and the least recently used ones over max_entries. Returns the number removed."""
+        self.flush()
+        removed = 0
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.connection.execute("DELETE FROM results WHERE created < ?", (cutoff,)).rowcount
+        if self.max_entries is not None:
+            removed += self.connection.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        self.connection.commit()
+        self.evictions += removed
+        return removed
+
+    def clear(self):
+        self.pending_results.clear()
+        self.pending_last_used.clear()
+        self.connection.execute("DELETE FROM results")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+_cache = None
+
+
+def get_classification_cache() -> ClassificationCache | None:
+    """Return the cache shared by the whole process, or None if caching is off (the default)."""
+    return _cache
+
+
+def set_classification_cache(cache: ClassificationCache | None) -> ClassificationCache | None:
+    """Install the shared cache (None turns caching off). Returns the previous one."""
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
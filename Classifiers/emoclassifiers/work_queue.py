@@ -0,0 +1,161 @@
+"""
+Corpus-wide classification work queue.
+
+Classifying conversation by conversation leaves the API idle at every conversation
+boundary: the last slow chunk of one conversation holds up the first chunks of the next.
+ClassificationQueue instead expands the whole corpus into (conversation, classifier,
+chunk) tasks upfront and runs them through one pool of workers, so the number of requests
+in flight is set only by the model wrapper's concurrency limit (and through it the API
+quota), not by the structure of the corpus. Results are reassembled into the usual
+{conversation_id: {classifier_name: {chunk_id: YesNoUnsureEnum}}} shape.
+"""
+import asyncio
+import functools
+import time
+
+from Classifiers.emoclassifiers.chunking import CHUNKER_DICT
+from Classifiers.emoclassifiers.classification import EmoClassifier, group_classifiers
+from Common.accounting import accounting_tags
+
+
+class ClassificationQueue:
+    def __init__(
+        self,
+        workers: int = 64,
+        grouped: bool = False,
+        aggregator=None,
+        chunk_prior=None,
+        raise_errors: bool = True,
+        on_conversation_done=None,
+    ):
+        """
+        Pool of `workers` coroutines that classify a corpus task by task.
+        With grouped, classifiers that share a chunker are asked in one request per chunk
+        (see classify_conversation_grouped). With an aggregator, each (conversation,
+        classifier) pair is one task that stops once the aggregate is decided (see
+        EmoClassifier.classify_conversation_until, chunks ordered by chunk_prior).
+        A failed task raises, or with raise_errors=False its classifiers are left out of
+        that conversation's results. on_conversation_done(conversation_id, results) is
+        called as soon as every task of a conversation has finished.
+        """
+        self.workers = workers
+        self.grouped = grouped
+        self.aggregator = aggregator
+        self.chunk_prior = chunk_prior
+        self.raise_errors = raise_errors
+        self.on_conversation_done = on_conversation_done
+        self.num_tasks = 0
+        self.num_failed = 0
+
+    def expand(
+        self,
+        conversations: dict[str, list[dict]],
+        classifiers: dict[str, dict[str, EmoClassifier]],
+    ) -> list[tuple]:
+        """
+        All tasks of the corpus as (conversation_id, classifier names, coroutine function,
+        function storing its result) tuples, conversation by conversation.
+        """
+        tasks = []
+        for conversation_id, conversation in conversations.items():
+            to_use = classifiers[conversation_id]
+            if self.grouped:
+                groups, single_call = group_classifiers(to_use)
+            else:
+                groups = []
+                single_call = {name: classifier for name, classifier in to_use.items() if classifier.single_call}
+            for name, classifier in to_use.items():
+                if name in single_call:
+                    tasks.append((conversation_id, [name],
+                                  functools.partial(classifier.classify_conversation_single_call, conversation),
+                                  functools.partial(self.store_conversation, conversation_id, name)))
+                elif self.aggregator is not None and not self.grouped:
+                    tasks.append((conversation_id, [name],
+                                  functools.partial(classifier.classify_conversation_until, conversation,
+                                                    self.aggregator, self.chunk_prior),
+                                  functools.partial(self.store_conversation, conversation_id, name)))
+                elif not self.grouped:
+                    chunker = CHUNKER_DICT[classifier.classifier_definition["chunker"]]
+                    for chunk_id, chunk in chunker.chunk_simple_convo(conversation).items():
+                        tasks.append((conversation_id, [name],
+                                      functools.partial(classifier.model_wrapper.classify_conversation_chunk,
+                                                        classifier_definition=classifier.classifier_definition,
+                                                        chunk=chunk),
+                                      functools.partial(self.store_chunk, conversation_id, name, chunk_id)))
+            for names in groups:
+                first = to_use[names[0]]
+                definitions = {name: to_use[name].classifier_definition for name in names}
+                chunker = CHUNKER_DICT[first.classifier_definition["chunker"]]
+                for chunk_id, chunk in chunker.chunk_simple_convo(conversation).items():
+                    tasks.append((conversation_id, names,
+                                  functools.partial(first.model_wrapper.classify_conversation_chunk_grouped,
+                                                    classifier_definitions=definitions, chunk=chunk),
+                                  functools.partial(self.store_grouped_chunk, conversation_id, chunk_id)))
+        return tasks
+
+    def store_conversation(self, conversation_id: str, name: str, result: dict):
+        self.results[conversation_id][name] = result
+
+    def store_chunk(self, conversation_id: str, name: str, chunk_id: int, result):
+        self.results[conversation_id][name][chunk_id] = result
+
+    def store_grouped_chunk(self, conversation_id: str, chunk_id: int, answers: dict):
+        for name, answer in answers.items():
+            self.results[conversation_id][name][chunk_id] = answer
+
+    async def run(
+        self,
+        conversations: dict[str, list[dict]],
+        classifiers: dict[str, dict[str, EmoClassifier]],
+        tags: dict[str, dict] | None = None,
+    ) -> dict[str, dict[str, dict]]:
+        """
+        Classify every conversation with its classifiers (classifiers maps each
+        conversation id to them). tags optionally holds accounting tags per conversation.
+        Returns {conversation_id: {classifier_name: {chunk_id: YesNoUnsureEnum}}}.
+        """
+        self.results = {
+            conversation_id: {name: {} for name in classifiers[conversation_id]}
+            for conversation_id in conversations
+        }
+        tasks = self.expand(conversations, classifiers)
+        self.num_tasks += len(tasks)
+        remaining = {conversation_id: 0 for conversation_id in conversations}
+        for conversation_id, *_ in tasks:
+            remaining[conversation_id] += 1
+        failed = {conversation_id: set() for conversation_id in conversations}
+        for conversation_id, count in remaining.items():
+            if count == 0 and self.on_conversation_done is not None:
+                self.on_conversation_done(conversation_id, self.results[conversation_id])
+
+        queue = iter(tasks)
+        start = time.perf_counter()
+
+        async def worker():
+            # The iterator is shared: each worker takes the next task as soon as it is free
+            for conversation_id, names, run_task, store in queue:
+                try:
+                    with accounting_tags(**(tags or {}).get(conversation_id, {})):
+                        store(await run_task())
+                except Exception as e:
+                    if self.raise_errors:
+                        raise
+                    self.num_failed += 1
+                    print(f"Error classifying conversation {conversation_id} with {', '.join(names)}: {e}")
+                    failed[conversation_id].update(names)
+                remaining[conversation_id] -= 1
+                if remaining[conversation_id] == 0:
+                    for name in failed[conversation_id]:
+                        self.results[conversation_id].pop(name, None)
+                    if self.on_conversation_done is not None:
+                        self.on_conversation_done(conversation_id, self.results[conversation_id])
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(tasks)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        print(f"Classified {len(tasks)} tasks of {len(conversations)} conversations in "
+              f"{time.perf_counter() - start:.2f} seconds ({self.workers} workers)")
+        return self.results
@@ -6,16 +6,27 @@ import time
 import emoclassifiers.io_utils as io_utils
 import emoclassifiers.classification as classification
 import emoclassifiers.aggregation as aggregation
+from emoclassifiers.calibration import PlattCalibration
 
 
 async def run_classification(
     conversation_list: list[dict],
     classifiers: dict[str, classification.EmoClassifier],
     aggregator: aggregation.Aggregator,
+    grouped: bool = False,
 ) -> list[dict]:
     futures_keys = []
     futures = []
     print(f"Running {len(conversation_list)} conversations with {len(classifiers)} classifiers")
+    if grouped:
+        raw_results_by_conversation = await asyncio.gather(*[
+            classification.classify_conversation_grouped(classifiers, conversation)
+            for conversation in conversation_list
+        ])
+        return [
+            {name: aggregator.aggregate(raw_result) for name, raw_result in raw_results.items()}
+            for raw_results in raw_results_by_conversation
+        ]
     for conversation_id, conversation in enumerate(conversation_list):
         for classifier_name, classifier in classifiers.items():
             futures.append(classifier.classify_conversation(conversation))
@@ -36,13 +47,23 @@ def main():
     parser.add_argument("--input_path", type=str, required=True)
     parser.add_argument("--output_path", type=str, required=True)
     parser.add_argument("--classifier_set", type=str, default="v1")
-    parser.add_argument("--aggregation_mode", type=str, default="any")
+    parser.add_argument("--aggregation_mode", type=str, default="any",
+                        help="One of " + ", ".join(aggregation.AGGREGATOR_DICT) + " (noisy_or with --logprobs)")
+    parser.add_argument("--grouped", action="store_true",
+                        help="Ask all classifiers that share a chunker in one request per chunk")
+    parser.add_argument("--logprobs", action="store_true",
+                        help="Classify chunks with a single-token answer and keep P(yes) from its logprobs")
+    parser.add_argument("--calibration_path", type=str, help="Platt calibration (JSON) applied to P(yes)")
     args = parser.parse_args()
+    if args.logprobs and args.grouped:
+        # Grouped requests answer with labels, not P(yes)
+        parser.error("--logprobs cannot be combined with --grouped")
     conversation_list = io_utils.load_jsonl(args.input_path)
     model_wrapper = classification.ModelWrapper(
         openai_client=openai.AsyncOpenAI(),
         model="gpt-4o-mini-2024-07-18",
-        max_concurrent=20,
+        logprobs=args.logprobs,
+        calibration=PlattCalibration.load(args.calibration_path) if args.calibration_path else None,
     )
     classifiers = classification.load_classifiers(
         classifier_set=args.classifier_set,
@@ -53,6 +74,7 @@ def main():
         conversation_list=conversation_list,
         classifiers=classifiers,
         aggregator=aggregator,
+        grouped=args.grouped,
     ))
     io_utils.save_jsonl(result, args.output_path)
     print(f"Saved results to {args.output_path}")
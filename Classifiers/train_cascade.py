@@ -0,0 +1,106 @@
+"""
+Train the local pre-classifier cascade from cached LLM labels.
+
+Every chunk of the given conversations is rendered to the prompt the LLM would see, and
+its label is looked up in the classification cache (so the conversations should be ones
+that were already analyzed, e.g. with `python main.py --analyze`). For each classifier a
+hashed n-gram logistic regression is trained on those labels, and its thresholds are set
+on a held-out split so that locally labeled chunks agree with the LLM at least
+--target_agreement of the time. The report lists per classifier the held-out agreement
+and the fraction of chunks (LLM calls) the cascade would answer locally. Use the saved
+cascade with `python main.py --cascade PATH`.
+
+Run from the repository root:
+    python -m Classifiers.train_cascade --input_path conversations_output/all_conversations.jsonl \
+        --cache_path conversations_output/classification_cache.sqlite --output_path conversations_output/cascade.npz
+"""
+import argparse
+import json
+
+import Classifiers.emoclassifiers.io_utils as io_utils
+import Classifiers.emoclassifiers.classification as classification
+from Classifiers.benchmark_single_call import load_conversation_list
+from Classifiers.emoclassifiers.cascade import ChunkCascade
+from Classifiers.emoclassifiers.chunking import CHUNKER_DICT
+from Classifiers.emoclassifiers.result_cache import ClassificationCache
+
+
+def collect_labels(
+    conversation_list: list[list[dict]],
+    classifier_definitions: dict[str, dict],
+    cache: ClassificationCache,
+    model: str,
+    prompt_layout: str = "default",
+) -> dict[str, tuple[list, list[bool]]]:
+    """
+    (chunks, LLM label is YES) per classifier name, for the chunks whose label is cached
+    (with prompts in prompt_layout, the layout of the run that cached them).
+    """
+    schema = classification.ResponseFormat.model_json_schema()
+    labels = {}
+    for definition in classifier_definitions.values():
+        chunks, is_yes = labels.setdefault(definition["name"], ([], []))
+        chunker = CHUNKER_DICT[definition["chunker"]]
+        for conversation in conversation_list:
+            for chunk in chunker.chunk_simple_convo(conversation).values():
+                prompt = classification.get_emo_classifiers_prompt(classifier_definition=definition, chunk=chunk,
+                                                                   layout=prompt_layout,
+                                                                   set_definitions=classifier_definitions)
+                cached = cache.peek(ClassificationCache.key(model, prompt, schema))
+                if cached is None:
+                    continue
+                chunks.append(chunk)
+                is_yes.append(classification.ResponseFormat.model_validate(cached).response
+                              == classification.YesNoUnsureEnum.YES)
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, required=True)
+    parser.add_argument("--cache_path", type=str, default="conversations_output/classification_cache.sqlite")
+    parser.add_argument("--output_path", type=str, default="conversations_output/cascade.npz")
+    parser.add_argument("--report_path", type=str, help="Where to save the training report (JSON)")
+    parser.add_argument("--classifier_set", type=str, default="v1")
+    parser.add_argument("--model", type=str, default="gpt-4o-mini-2024-07-18",
+                        help="Model whose cached labels are used")
+    parser.add_argument("--target_agreement", type=float, default=0.98,
+                        help="Held-out agreement with the LLM required of locally labeled chunks")
+    parser.add_argument("--min_examples", type=int, default=200,
+                        help="Classifiers with fewer cached labels are not cascaded")
+    parser.add_argument("--num_features", type=int, default=2 ** 16)
+    parser.add_argument("--prompt_layout", type=str, default="default", choices=classification.PROMPT_LAYOUTS,
+                        help="Prompt layout of the analysis runs whose labels are cached")
+    args = parser.parse_args()
+
+    conversation_list = load_conversation_list(args.input_path)
+    # Only the definitions are needed: no API client is created
+    classifier_definitions = io_utils.load_json(
+        io_utils.get_path(classification.CLASSIFIER_DEFINITION_PATH_DICT[args.classifier_set])
+    )
+    cache = ClassificationCache(args.cache_path)
+    labels = collect_labels(conversation_list, classifier_definitions, cache, args.model, args.prompt_layout)
+    cache.close()
+
+    cascade = ChunkCascade(num_features=args.num_features)
+    for name, (chunks, is_yes) in labels.items():
+        report = cascade.fit_classifier(name, chunks, is_yes, target_agreement=args.target_agreement,
+                                        min_examples=args.min_examples)
+        if report["cascaded"]:
+            print(f"  {name}: {report['examples']} labels, {report['validation_local_fraction']:.0%} of held-out "
+                  f"chunks labeled locally, {report['validation_local_agreement']:.1%} agreement")
+        else:
+            print(f"  {name}: {report['examples']} labels, not cascaded"
+                  f"{' (' + report['reason'] + ')' if 'reason' in report else ''}")
+
+    cascade.save(args.output_path)
+    print(f"Saved cascade for {len(cascade.models)} classifiers to {args.output_path}")
+    if args.report_path:
+        with open(args.report_path, "w") as f:
+            json.dump({"target_agreement": args.target_agreement, "classifiers": cascade.training_report}, f,
+                      indent=2)
+        print(f"Saved training report to {args.report_path}")
+
+
+if __name__ == "__main__":
+    main()
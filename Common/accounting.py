@@ -0,0 +1,273 @@
+"""
+Per-call token, cost and latency accounting for every API call of a run.
+
+Every call made through RateLimiter.call (simulation, classification) and the sync
+simulator in LLMTest.llmtestframework is recorded in a UsageLedger: input, cached and
+output tokens, cost, latency, time spent waiting for the budget or backing off, and the
+number of retries. Calls are tagged with the stage, persona, conversation and classifier
+they belong to. Tags are held in a context variable, so they follow asyncio tasks:
+
+    with accounting_tags(persona="Maya", conversation_id="Maya_1"):
+        ...  # every call made in here, including in tasks started here, carries these tags
+
+The ledger keeps running totals per tag value (not every call), optionally streams each
+call to a JSONL file, and can enforce a hard token or dollar budget for the run.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import time
+
+
+# Dollars per million tokens: (input, cached input, cache write, output)
+PRICES = {
+    ("anthropic", "claude-3-5-sonnet-latest"): (3.00, 0.30, 3.75, 15.00),
+    ("openai", "gpt-4o-mini-2024-07-18"): (0.15, 0.075, 0.15, 0.60),
+}
+# Batch APIs bill half the regular price
+BATCH_DISCOUNT = 0.5
+
+TAG_NAMES = ["stage", "persona", "conversation_id", "classifier"]
+TOKEN_FIELDS = ["input_tokens", "cached_input_tokens", "cache_write_tokens", "output_tokens"]
+
+_tags = contextvars.ContextVar("accounting_tags", default={})
+
+
+@contextlib.contextmanager
+def accounting_tags(**tags):
+    """
+    Tag every call made inside the block (and in tasks created inside it).
+    Tags of enclosing blocks are kept unless overridden.
+    """
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags() -> dict:
+    return dict(_tags.get())
+
+
+class BudgetExceededError(BaseException):
+    """
+    Raised when a call would exceed the run's token or dollar budget.
+    Derives from BaseException so that per-call fallbacks (`except Exception`) do not
+    swallow it and the run actually stops.
+    """
+
+
+def normalize_usage(usage) -> dict:
+    """
+    Token counts of an Anthropic or OpenAI usage object (or dict), with input_tokens
+    excluding cached tokens.
+    """
+    if usage is None:
+        return {field: 0 for field in TOKEN_FIELDS}
+    if isinstance(usage, dict):
+        get = usage.get
+    else:
+        def get(name):
+            return getattr(usage, name, None)
+    if get("prompt_tokens") is not None:
+        # OpenAI: prompt_tokens includes the cached tokens
+        details = get("prompt_tokens_details")
+        cached = (details.get("cached_tokens") if isinstance(details, dict)
+                  else getattr(details, "cached_tokens", None)) or 0
+        return {
+            "input_tokens": get("prompt_tokens") - cached,
+            "cached_input_tokens": cached,
+            "cache_write_tokens": 0,
+            "output_tokens": get("completion_tokens") or 0,
+        }
+    return {
+        "input_tokens": get("input_tokens") or 0,
+        "cached_input_tokens": get("cache_read_input_tokens") or 0,
+        "cache_write_tokens": get("cache_creation_input_tokens") or 0,
+        "output_tokens": get("output_tokens") or 0,
+    }
+
+
+def call_cost(provider: str, model: str, tokens: dict, batch: bool = False) -> float:
+    """
+    Dollar cost of a call according to PRICES (0 for models without a price).
+    """
+    prices = PRICES.get((provider, model))
+    if prices is None:
+        return 0.0
+    cost = sum(tokens[field] * price for field, price in zip(TOKEN_FIELDS, prices)) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+def cached_input_ratio(totals: dict) -> float | None:
+    """
+    Fraction of the input tokens of a totals dict (overall or of one tag value) that were
+    read from the provider's prompt cache, or None if there was no input.
+    """
+    input_tokens = totals["input_tokens"] + totals["cached_input_tokens"]
+    return totals["cached_input_tokens"] / input_tokens if input_tokens else None
+
+
+def empty_totals() -> dict:
+    return {"calls": 0, **{field: 0 for field in TOKEN_FIELDS}, "cost": 0.0,
+            "latency": 0.0, "wait_time": 0.0, "retries": 0}
+
+
+class UsageLedger:
+    def __init__(
+        self,
+        path: str | None = None,
+        token_budget: int | None = None,
+        cost_budget: float | None = None,
+        on_exceeded: str = "cancel",
+    ):
+        """
+        Running totals of all calls, overall and per tag value.
+        path: optional JSONL file every call is appended to.
+        token_budget / cost_budget: hard limits on total tokens / dollars for the run.
+        on_exceeded: "cancel" raises BudgetExceededError on the next call; "pause" holds
+        new calls and asks on stdin whether to extend the budget (cancels if stdin is
+        not interactive).
+        """
+        if on_exceeded not in ("cancel", "pause"):
+            raise ValueError(f"Unknown budget action: {on_exceeded}")
+        self.path = path
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        # Amounts added each time the budget is extended in pause mode
+        self.budget_step = (token_budget, cost_budget)
+        self.on_exceeded = on_exceeded
+        self.totals = empty_totals()
+        self.by_tag = {name: {} for name in TAG_NAMES + ["model"]}
+        self.pause_lock = asyncio.Lock()
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        usage,
+        latency: float = 0.0,
+        wait_time: float = 0.0,
+        retries: int = 0,
+        batch: bool = False,
+        **tags,
+    ) -> dict:
+        """
+        Record one call. Tags default to the ones of the current accounting_tags block.
+        """
+        tags = {**current_tags(), **tags}
+        tokens = normalize_usage(usage)
+        entry = {
+            "timestamp": time.time(),
+            "provider": provider,
+            "model": model,
+            **{name: tags.get(name) for name in TAG_NAMES},
+            **tokens,
+            "cost": call_cost(provider, model, tokens, batch),
+            "latency": latency,
+            "wait_time": wait_time,
+            "retries": retries,
+            "batch": batch,
+        }
+        self.add(entry)
+        if self.path is not None:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def add(self, entry: dict):
+        groups = [self.totals]
+        for name in TAG_NAMES:
+            if entry.get(name) is not None:
+                groups.append(self.by_tag[name].setdefault(entry[name], empty_totals()))
+        groups.append(self.by_tag["model"].setdefault(f"{entry['provider']}/{entry['model']}", empty_totals()))
+        for group in groups:
+            group["calls"] += 1
+            for field in TOKEN_FIELDS + ["cost", "latency", "wait_time", "retries"]:
+                group[field] += entry[field]
+
+    def ingest(self, path: str):
+        """Add the calls of another ledger's JSONL file (e.g. from a worker process) to the totals."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self.add(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+
+    def total_tokens(self) -> int:
+        return sum(self.totals[field] for field in TOKEN_FIELDS)
+
+    def budget_exceeded(self) -> str | None:
+        """Description of the exceeded budget, or None."""
+        if self.token_budget is not None and self.total_tokens() >= self.token_budget:
+            return f"token budget of {self.token_budget} reached ({self.total_tokens()} tokens used)"
+        if self.cost_budget is not None and self.totals["cost"] >= self.cost_budget:
+            return f"cost budget of ${self.cost_budget:.2f} reached (${self.totals['cost']:.4f} spent)"
+        return None
+
+    def check_budget(self):
+        """Raise BudgetExceededError if the budget is used up (for sync callers)."""
+        exceeded = self.budget_exceeded()
+        if exceeded is not None:
+            raise BudgetExceededError(exceeded)
+
+    async def wait_for_budget(self):
+        """
+        Return when a new call may be made. Raises BudgetExceededError when the budget
+        is used up, or in pause mode holds all callers until the budget is extended.
+        """
+        if self.budget_exceeded() is None:
+            return
+        if self.on_exceeded == "cancel" or not sys.stdin.isatty():
+            self.check_budget()
+        async with self.pause_lock:
+            exceeded = self.budget_exceeded()
+            if exceeded is None:
+                return
+            answer = await asyncio.get_running_loop().run_in_executor(
+                None, input, f"Paused: {exceeded}. Extend the budget by the same amount? [y/N] "
+            )
+            if answer.strip().lower() not in ("y", "yes"):
+                raise BudgetExceededError(exceeded)
+            if self.token_budget is not None:
+                self.token_budget += self.budget_step[0]
+            if self.cost_budget is not None:
+                self.cost_budget += self.budget_step[1]
+
+    def summary(self) -> dict:
+        return {
+            "totals": {**self.totals, "total_tokens": self.total_tokens()},
+            "budget": {"tokens": self.token_budget, "cost": self.cost_budget},
+            **{f"by_{name}": groups for name, groups in self.by_tag.items()},
+        }
+
+    def save_summary(self, filename: str) -> str:
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        return filename
+
+
+_ledger = None
+
+
+def get_ledger() -> UsageLedger:
+    """Return the ledger shared by the whole process, creating an unbounded one on first use."""
+    global _ledger
+    if _ledger is None:
+        _ledger = UsageLedger()
+    return _ledger
+
+
+def set_ledger(ledger: UsageLedger | None) -> UsageLedger | None:
+    """Replace the shared ledger. Returns the previous one."""
+    global _ledger
+    previous = _ledger
+    _ledger = ledger
+    return previous
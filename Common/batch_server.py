@@ -0,0 +1,379 @@
+"""
+Local stand-in for the provider batch APIs.
+
+Implements the subset of the Anthropic Message Batches API used by the batched
+simulator, and of the OpenAI Files and Batch APIs used by batch classification, so
+batch runs can be exercised end-to-end without network access or cost. Point an
+Anthropic client at it with `base_url=server.base_url`, and an OpenAI client with
+`base_url=server.base_url + "/v1"`.
+
+Run standalone:
+    python -m Common.batch_server --port 8765
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_message_responder(params: dict) -> str:
+    """
+    Deterministic reply derived from the request, in the simulated user's message format.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"Stand-in reply {digest[:8]}. (Calmness 0.5, Interest 0.4, Contemplation 0.3)"
+
+
+def default_chat_responder(body: dict) -> str:
+    """
+    Deterministic chat completion content derived from the request. For structured
+    outputs, a JSON object that satisfies the (flat, enum-valued) response schema.
+    """
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).digest()
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") != "json_schema":
+        return f"Stand-in reply {digest.hex()[:8]}."
+    schema = response_format["json_schema"]["schema"]
+    definitions = schema.get("$defs", {})
+    content = {}
+    for i, (name, prop) in enumerate(schema.get("properties", {}).items()):
+        if "$ref" in prop:
+            prop = definitions[prop["$ref"].split("/")[-1]]
+        if "enum" in prop:
+            content[name] = prop["enum"][digest[i % len(digest)] % len(prop["enum"])]
+        elif prop.get("type") == "boolean":
+            content[name] = bool(digest[i % len(digest)] % 2)
+        else:
+            content[name] = f"stand-in {digest.hex()[:8]}"
+    return json.dumps(content)
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict:
+    """
+    Fields of a multipart/form-data body: {name: (filename, bytes)}.
+    """
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+
+def utc_timestamp(offset_hours: int = 0) -> str:
+    return (datetime.now(timezone.utc) + timedelta(hours=offset_hours)).isoformat()
+
+
+class FakeBatchServer:
+    def __init__(
+        self,
+        message_responder=default_message_responder,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        polls_until_done: int = 1,
+        chat_responder=default_chat_responder,
+    ):
+        """
+        Stand-in batch server. A batch reports "in_progress" for polls_until_done
+        retrievals before it ends, so polling loops are exercised too.
+        message_responder answers Anthropic message requests; chat_responder answers
+        the chat completion requests of OpenAI batches, and fails a request (it goes to
+        the batch's error file) by returning None.
+        """
+        self.message_responder = message_responder
+        self.chat_responder = chat_responder
+        self.polls_until_done = polls_until_done
+        self.batches = {}
+        self.files = {}
+        self.openai_batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBatchServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Anthropic Message Batches
+
+    def create_message_batch(self, body: dict) -> dict:
+        with self.lock:
+            batch_id = f"msgbatch_{next(self.ids):06d}"
+        results = []
+        for request in body["requests"]:
+            params = request["params"]
+            text = self.message_responder(params)
+            results.append({
+                "custom_id": request["custom_id"],
+                "result": {
+                    "type": "succeeded",
+                    "message": {
+                        "id": f"msg_{batch_id}_{len(results)}",
+                        "type": "message",
+                        "role": "assistant",
+                        "model": params["model"],
+                        "content": [{"type": "text", "text": text}],
+                        "stop_reason": "end_turn",
+                        "stop_sequence": None,
+                        "usage": {
+                            "input_tokens": len(json.dumps(params.get("messages", []))) // 4,
+                            "output_tokens": len(text) // 4,
+                        },
+                    },
+                },
+            })
+        self.batches[batch_id] = {"results": results, "polls": 0, "created_at": utc_timestamp()}
+        return self.message_batch_object(batch_id)
+
+    def message_batch_object(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        ended = batch["polls"] >= self.polls_until_done
+        count = len(batch["results"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": batch["created_at"],
+            "expires_at": utc_timestamp(24),
+            "ended_at": utc_timestamp() if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.base_url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    # OpenAI Files and Batch API
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        with self.lock:
+            file_id = f"file-{next(self.ids):06d}"
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return self.file_object(file_id)
+
+    def file_object(self, file_id: str) -> dict:
+        return {key: value for key, value in self.files[file_id].items() if key != "content"}
+
+    def create_openai_batch(self, body: dict) -> dict:
+        with self.lock:
+            batch_id = f"batch_{next(self.ids):06d}"
+        lines = []
+        errors = []
+        for line in self.files[body["input_file_id"]]["content"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            request_body = request["body"]
+            content = self.chat_responder(request_body)
+            if content is None:
+                errors.append({
+                    "id": f"batch_req_{batch_id}_e{len(errors)}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 500,
+                        "request_id": f"req_{batch_id}_e{len(errors)}",
+                        "body": {"error": {"message": "Stand-in failure", "type": "server_error"}},
+                    },
+                    "error": None,
+                })
+                continue
+            prompt_tokens = len(json.dumps(request_body.get("messages", []))) // 4
+            completion_tokens = max(1, len(content) // 4)
+            lines.append({
+                "id": f"batch_req_{batch_id}_{len(lines)}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": f"req_{batch_id}_{len(lines)}",
+                    "body": {
+                        "id": f"chatcmpl-{batch_id}-{len(lines)}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request_body["model"],
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content, "refusal": None},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    },
+                },
+                "error": None,
+            })
+        output = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        output_file = self.create_file(f"{batch_id}_output.jsonl", "batch_output", output)
+        error_file_id = None
+        if errors:
+            error_output = "".join(json.dumps(line) + "\n" for line in errors).encode("utf-8")
+            error_file_id = self.create_file(f"{batch_id}_errors.jsonl", "batch_output", error_output)["id"]
+        self.openai_batches[batch_id] = {
+            "request": body,
+            "count": len(lines),
+            "failed": len(errors),
+            "output_file_id": output_file["id"],
+            "error_file_id": error_file_id,
+            "polls": 0,
+            "created_at": int(time.time()),
+        }
+        return self.openai_batch_object(batch_id)
+
+    def openai_batch_object(self, batch_id: str) -> dict:
+        batch = self.openai_batches[batch_id]
+        ended = batch["polls"] >= self.polls_until_done
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": batch["request"]["endpoint"],
+            "input_file_id": batch["request"]["input_file_id"],
+            "completion_window": batch["request"]["completion_window"],
+            "status": "completed" if ended else "in_progress",
+            "output_file_id": batch["output_file_id"] if ended else None,
+            "error_file_id": batch["error_file_id"] if ended else None,
+            "created_at": batch["created_at"],
+            "completed_at": int(time.time()) if ended else None,
+            "request_counts": {
+                "total": batch["count"] + batch["failed"],
+                "completed": batch["count"] if ended else 0,
+                "failed": batch["failed"] if ended else 0,
+            },
+            "metadata": batch["request"].get("metadata"),
+        }
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_jsonl(self, lines: list[dict]):
+                body = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/binary")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def not_found(self):
+                self.send_json({"type": "error", "error": {"type": "not_found_error", "message": self.path}}, 404)
+
+            def read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def send_bytes(self, body: bytes):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                if path == "/v1/messages/batches":
+                    self.send_json(server.create_message_batch(json.loads(self.read_body())))
+                elif path == "/v1/files":
+                    fields = parse_multipart(self.headers["Content-Type"], self.read_body())
+                    filename, content = fields["file"]
+                    self.send_json(server.create_file(filename, fields["purpose"][1].decode("utf-8"), content))
+                elif path == "/v1/batches":
+                    body = json.loads(self.read_body())
+                    if body.get("input_file_id") not in server.files:
+                        return self.not_found()
+                    self.send_json(server.create_openai_batch(body))
+                else:
+                    self.not_found()
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if parts[:3] == ["v1", "messages", "batches"] and len(parts) >= 4:
+                    batch_id = parts[3]
+                    if batch_id not in server.batches:
+                        return self.not_found()
+                    if len(parts) == 5 and parts[4] == "results":
+                        return self.send_jsonl(server.batches[batch_id]["results"])
+                    server.batches[batch_id]["polls"] += 1
+                    return self.send_json(server.message_batch_object(batch_id))
+                if parts[:2] == ["v1", "files"] and len(parts) >= 3:
+                    file_id = parts[2]
+                    if file_id not in server.files:
+                        return self.not_found()
+                    if len(parts) == 4 and parts[3] == "content":
+                        return self.send_bytes(server.files[file_id]["content"])
+                    return self.send_json(server.file_object(file_id))
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+                    batch_id = parts[2]
+                    if batch_id not in server.openai_batches:
+                        return self.not_found()
+                    server.openai_batches[batch_id]["polls"] += 1
+                    return self.send_json(server.openai_batch_object(batch_id))
+                self.not_found()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the provider batch APIs")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--polls-until-done", type=int, default=1)
+    args = parser.parse_args()
+    server = FakeBatchServer(host=args.host, port=args.port, polls_until_done=args.polls_until_done)
+    print(f"Stand-in batch server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Record/replay of LLM API traffic at the HTTP transport level.
+
+Both the Anthropic and the OpenAI SDKs accept an `http_client`, so a single httpx
+transport can capture every request and response of the simulator and the classifier.
+Requests are keyed by a content hash of method, path and JSON body (model, parameters
+and messages). Entries are stored as gzip-compressed JSON lines in one file.
+
+In replay mode every call is answered from the store and nothing is sent over the
+network. Identical requests (e.g. the first user message of two conversations with
+the same persona) are recorded as separate entries and replayed in the same order.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+import httpx
+
+
+RECORD = "record"
+REPLAY = "replay"
+
+# The stored body is already decoded, so these no longer describe it
+DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMissError(Exception):
+    """
+    Raised in replay mode when a request has no recorded response.
+    """
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = REPLAY):
+        """
+        On-disk store of recorded responses. In record mode new responses are appended
+        to the file; in replay mode the file is only read.
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.entries = {}
+        self.replay_positions = {}
+        self.hits = 0
+        self.recorded = 0
+        if os.path.exists(path):
+            self.load()
+        elif mode == REPLAY:
+            raise FileNotFoundError(f"Cassette not found: {path}")
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.setdefault(entry["key"], []).append(entry)
+
+    @staticmethod
+    def request_key(method: str, path: str, body: bytes) -> str:
+        """
+        Content hash of a request. JSON bodies are canonicalised so key order does not matter.
+        """
+        try:
+            canonical_body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"))
+        except ValueError:
+            canonical_body = body.decode("utf-8", errors="replace")
+        return hashlib.sha256(f"{method} {path}\n{canonical_body}".encode("utf-8")).hexdigest()
+
+    def next_response(self, key: str) -> httpx.Response:
+        """
+        Return the next recorded response for the key, cycling through the entries
+        if the request occurs more often than it was recorded.
+        """
+        entries = self.entries.get(key)
+        if not entries:
+            raise CassetteMissError(f"No recorded response for request {key[:12]} in {self.path}")
+        position = self.replay_positions.get(key, 0)
+        self.replay_positions[key] = position + 1
+        entry = entries[position % len(entries)]
+        self.hits += 1
+        return httpx.Response(
+            status_code=entry["status"],
+            headers=entry["headers"],
+            content=entry["body"].encode("utf-8", errors="surrogateescape"),
+        )
+
+    def record(self, key: str, url: str, response: httpx.Response, content: bytes):
+        entry = {
+            "key": key,
+            "url": url,
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS},
+            "body": content.decode("utf-8", errors="surrogateescape"),
+        }
+        self.entries.setdefault(key, []).append(entry)
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.recorded += 1
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "entries": sum(len(v) for v in self.entries.values()),
+                "replayed": self.hits, "recorded": self.recorded}
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.AsyncBaseTransport | None = None):
+        """
+        Async httpx transport that records to / replays from a cassette.
+        """
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = Cassette.request_key(request.method, request.url.path, body)
+        if self.cassette.mode == REPLAY:
+            return self.cassette.next_response(key)
+        if self.transport is None:
+            self.transport = httpx.AsyncHTTPTransport()
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        await response.aclose()
+        if response.status_code < 500 and response.status_code != 429:
+            self.cassette.record(key, str(request.url), response, content)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS},
+            content=content,
+        )
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+
+
+class CassetteTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, transport: httpx.BaseTransport | None = None):
+        """
+        Sync httpx transport that records to / replays from a cassette.
+        """
+        self.cassette = cassette
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        key = Cassette.request_key(request.method, request.url.path, body)
+        if self.cassette.mode == REPLAY:
+            return self.cassette.next_response(key)
+        if self.transport is None:
+            self.transport = httpx.HTTPTransport()
+        response = self.transport.handle_request(request)
+        content = response.read()
+        response.close()
+        if response.status_code < 500 and response.status_code != 429:
+            self.cassette.record(key, str(request.url), response, content)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS},
+            content=content,
+        )
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+def async_http_client(cassette: Cassette) -> httpx.AsyncClient:
+    """
+    httpx client to pass as `http_client` to AsyncAnthropic / AsyncOpenAI.
+    """
+    return httpx.AsyncClient(transport=AsyncCassetteTransport(cassette), timeout=httpx.Timeout(600.0))
+
+
+def sync_http_client(cassette: Cassette) -> httpx.Client:
+    """
+    httpx client to pass as `http_client` to Anthropic / OpenAI.
+    """
+    return httpx.Client(transport=CassetteTransport(cassette), timeout=httpx.Timeout(600.0))
@@ -0,0 +1,127 @@
+"""
+Lazily constructed API clients shared by generation and classification.
+
+Nothing here runs at import time: the .env file is read, and the Anthropic and OpenAI
+SDKs are imported, only when a client is first requested. Runs that never call an API
+(CSV conversion, LaTeX output) therefore never touch the SDKs. Clients are cached per
+configuration, so every component of a run shares the same connection pools.
+
+Tests and benchmarks can inject fakes without monkeypatching:
+
+    set_client_factory(ClientFactory(anthropic_client=fake_anthropic, openai_client=fake_openai))
+"""
+import os
+
+
+class ClientFactory:
+    def __init__(
+        self,
+        cassette=None,
+        anthropic_client=None,
+        openai_client=None,
+        anthropic_api_key: str | None = None,
+        openai_api_key: str | None = None,
+    ):
+        """
+        Builds clients on first use. anthropic_client / openai_client, if given, are
+        returned as-is instead of building SDK clients; cassette routes every SDK
+        client through Common.cassette for record/replay.
+        """
+        self.cassette = cassette
+        self.anthropic_api_key = anthropic_api_key
+        self.openai_api_key = openai_api_key
+        self.clients = {}
+        if anthropic_client is not None:
+            self.clients[("anthropic_async", None)] = anthropic_client
+        if openai_client is not None:
+            self.clients[("openai_async", None)] = openai_client
+        self.env_loaded = False
+
+    def load_env(self):
+        """Read API keys from the environment (and the .env file) once."""
+        if not self.env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            self.anthropic_api_key = self.anthropic_api_key or os.getenv("CLAUDE_API_KEY")
+            self.openai_api_key = self.openai_api_key or os.getenv("OPENAI_API_KEY")
+            self.env_loaded = True
+
+    def get(self, kind: str, base_url: str | None, build):
+        key = (kind, base_url)
+        if key not in self.clients:
+            self.load_env()
+            self.clients[key] = build()
+        return self.clients[key]
+
+    def anthropic_async(self, base_url: str | None = None):
+        """
+        Async Anthropic client. SDK retries are off so that 429s reach the rate limiter.
+        base_url points the client at another endpoint, e.g. the local stand-in batch server.
+        """
+        def build():
+            import anthropic
+            if self.cassette is None:
+                return anthropic.AsyncAnthropic(
+                    api_key=self.anthropic_api_key or ("stand-in" if base_url else None),
+                    base_url=base_url,
+                    max_retries=0
+                )
+            from Common.cassette import async_http_client
+            return anthropic.AsyncAnthropic(
+                api_key=self.anthropic_api_key or "replay",
+                base_url=base_url,
+                max_retries=0,
+                http_client=async_http_client(self.cassette)
+            )
+        return self.get("anthropic_async", base_url, build)
+
+    def anthropic_sync(self):
+        """Sync Anthropic client, used by the sequential simulator in LLMTest.llmtestframework."""
+        def build():
+            import anthropic
+            if self.cassette is None:
+                return anthropic.Anthropic(api_key=self.anthropic_api_key)
+            from Common.cassette import sync_http_client
+            return anthropic.Anthropic(
+                api_key=self.anthropic_api_key or "replay",
+                http_client=sync_http_client(self.cassette)
+            )
+        return self.get("anthropic_sync", None, build)
+
+    def openai_async(self, base_url: str | None = None):
+        """Async OpenAI client. SDK retries are off so that 429s reach the rate limiter."""
+        def build():
+            import openai
+            if self.cassette is None:
+                return openai.AsyncOpenAI(
+                    api_key=self.openai_api_key or ("stand-in" if base_url else None),
+                    base_url=base_url,
+                    max_retries=0
+                )
+            from Common.cassette import async_http_client
+            return openai.AsyncOpenAI(
+                api_key=self.openai_api_key or "replay",
+                base_url=base_url,
+                max_retries=0,
+                http_client=async_http_client(self.cassette)
+            )
+        return self.get("openai_async", base_url, build)
+
+
+_client_factory = None
+
+
+def get_client_factory() -> ClientFactory:
+    """Return the factory shared by the whole process, creating a default one on first use."""
+    global _client_factory
+    if _client_factory is None:
+        _client_factory = ClientFactory()
+    return _client_factory
+
+
+def set_client_factory(factory: ClientFactory | None) -> ClientFactory | None:
+    """Replace the shared factory (None resets to a default one on next use). Returns the previous one."""
+    global _client_factory
+    previous = _client_factory
+    _client_factory = factory
+    return previous
@@ -0,0 +1,150 @@
+"""
+Adaptive (AIMD) concurrency limit for API calls.
+
+Instead of a hand-tuned semaphore size, the number of requests in flight is found at
+run time, the way TCP finds a connection's bandwidth: the limit grows by about one
+request per limit's worth of successful calls while latency stays near its baseline, and
+is cut multiplicatively when the API pushes back (429s, overloaded responses, timeouts)
+or latency climbs well above the baseline. At most one cut is made per round trip, so a
+burst of failures from requests that were all sent at the old limit counts once.
+
+RateLimiter keeps one controller per (provider, model) (see RateLimiter.adaptive_concurrency),
+so every component calling the same model shares a single limit.
+"""
+import asyncio
+import collections
+import time
+
+
+class AdaptiveConcurrency:
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_tolerance: float | None = 2.0,
+        smoothing: float = 0.2,
+    ):
+        """
+        Concurrency limit starting at initial_limit and kept within [min_limit, max_limit].
+        Each limit's worth of successes adds `increase`; an overload multiplies the limit by
+        `decrease`. Latency (an exponential average with weight `smoothing`) above
+        latency_tolerance times its baseline is treated as an overload (None disables this).
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = float(min(max(initial_limit, min_limit), max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.latency = None
+        self.baseline_latency = None
+        self.samples = 0
+        self.last_decrease = float("-inf")
+        self.successes = 0
+        self.overloads = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+        self.lowest_limit = self.limit
+        self.peak_queue_depth = 0
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight."""
+        return int(self.window)
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of callers waiting for a slot."""
+        return sum(not waiter.done() for waiter in self.waiters)
+
+    async def acquire(self):
+        if not self.queue_depth and self.in_flight < self.limit:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.in_flight < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def set_window(self, window: float):
+        self.window = min(max(window, self.min_limit), self.max_limit)
+        self.peak_limit = max(self.peak_limit, self.limit)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        self.wake()
+
+    def on_success(self, started: float, latency: float):
+        """
+        Record a successful request sent at `started` (time.perf_counter()) that took
+        `latency` seconds.
+        """
+        self.successes += 1
+        self.samples += 1
+        self.latency = latency if self.latency is None else (
+            self.smoothing * latency + (1 - self.smoothing) * self.latency
+        )
+        if self.baseline_latency is None or self.latency < self.baseline_latency:
+            self.baseline_latency = self.latency
+        else:
+            # Let the baseline follow a lasting change of the API's latency
+            self.baseline_latency += 0.01 * (self.latency - self.baseline_latency)
+        # The average is only trusted once a limit's worth of requests fed it
+        if (self.latency_tolerance is not None and self.samples > self.limit
+                and self.latency > self.latency_tolerance * self.baseline_latency):
+            self.cut(started)
+        elif self.in_flight + self.queue_depth + 1 >= self.limit:
+            # Only grow while the limit is what holds requests back
+            self.set_window(self.window + self.increase / self.window)
+
+    def on_overload(self, started: float):
+        """Record a request sent at `started` that was rejected as overload (429, 529, timeout)."""
+        self.overloads += 1
+        self.cut(started)
+
+    def cut(self, started: float):
+        # Requests sent before the previous cut saw the old limit and are not counted again
+        if started <= self.last_decrease:
+            return
+        self.last_decrease = time.perf_counter()
+        self.decreases += 1
+        # Latencies measured at the old limit say nothing about the new one
+        self.latency = None
+        self.samples = 0
+        self.set_window(self.window * self.decrease)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "peak_limit": self.peak_limit,
+            "lowest_limit": self.lowest_limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+            "latency": self.latency,
+            "baseline_latency": self.baseline_latency,
+        }
@@ -0,0 +1,416 @@
+"""
+Shared request/token rate limiting for the Anthropic and OpenAI clients.
+
+Each (provider, model) pair gets two token buckets that refill continuously: one for
+requests per minute and one for tokens per minute. A call reserves one request and an
+estimated number of tokens up front, and the reservation is reconciled with the actual
+`usage` reported in the response.
+
+With SharedRateLimits the bucket state lives in shared memory, so several worker
+processes draw from one global budget. Models registered with adaptive_concurrency also
+get an AIMD limit on the number of requests in flight (see Common/concurrency.py).
+"""
+import asyncio
+import json
+import multiprocessing
+import random
+import re
+import time
+
+from Common.accounting import UsageLedger, get_ledger
+from Common.concurrency import AdaptiveConcurrency
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+# Errors that mean the API is overloaded, so fewer requests should be in flight
+OVERLOAD_STATUS_CODES = {408, 429, 503, 504, 529}
+OVERLOAD_ERROR_NAMES = {"APITimeoutError"}
+# Anthropic models whose prompt cache reads count toward the input tokens per minute limit;
+# for the other models only uncached input tokens and cache writes count
+CACHE_READS_RATE_LIMITED_MODELS = ("claude-3-haiku", "claude-3-5-haiku", "claude-3-opus", "claude-3-sonnet",
+                                   "claude-3-5-sonnet")
+
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute: float):
+        """
+        A bucket holding up to one minute of budget, refilled continuously.
+        The level may go negative when a reservation turns out to be too small.
+        """
+        self.capacity = float(capacity_per_minute)
+        self.refill_rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` can be consumed (0 if available now).
+        """
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_rate
+
+    def consume(self, amount: float):
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    def __init__(self, limit: "ModelRateLimit", reserved_tokens: int):
+        """
+        Budget reserved for a single in-flight request.
+        """
+        self.limit = limit
+        self.reserved_tokens = reserved_tokens
+        self.reconciled = False
+
+    def reconcile(self, actual_tokens: int | None):
+        """
+        Replace the estimate with the actual token count. If the count is unknown,
+        the estimate is kept.
+        """
+        if self.reconciled:
+            return
+        self.reconciled = True
+        if actual_tokens is None:
+            return
+        self.limit.refund(self.reserved_tokens - actual_tokens)
+
+    def cancel(self):
+        """
+        Return the reserved tokens, e.g. when the request was rejected with a 429.
+        The request itself still counts against the RPM budget.
+        """
+        self.reconcile(0)
+
+
+class ModelRateLimit:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        """
+        RPM and TPM budget for one (provider, model) pair.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, estimated_tokens: int) -> Reservation:
+        """
+        Wait until one request and `estimated_tokens` tokens are available and reserve them.
+        Waiters are served in arrival order.
+        """
+        estimated_tokens = int(min(estimated_tokens, self.tokens.capacity))
+        async with self.lock:
+            while True:
+                wait = self.try_reserve(estimated_tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        return Reservation(self, estimated_tokens)
+
+    def try_reserve(self, estimated_tokens: int) -> float:
+        """
+        Reserve one request and `estimated_tokens` tokens if they are available now.
+        Returns 0 on success, otherwise the number of seconds to wait.
+        """
+        now = time.monotonic()
+        wait = max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(estimated_tokens, now),
+        )
+        if wait <= 0:
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+        return wait
+
+    def refund(self, tokens: float):
+        self.tokens.refund(tokens)
+
+    def block_for(self, seconds: float):
+        """
+        Pause all callers of this model, e.g. after a 429 with a retry-after hint.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class SharedTokenBucket(TokenBucket):
+    def __init__(self, capacity_per_minute: float, state, offset: int):
+        """
+        TokenBucket whose level and last refill time are stored in a shared array
+        at state[offset] and state[offset + 1].
+        """
+        # The level itself is initialised once, by SharedRateLimits
+        self.state = state
+        self.offset = offset
+        self.capacity = float(capacity_per_minute)
+        self.refill_rate = self.capacity / 60.0
+
+    @property
+    def level(self) -> float:
+        return self.state[self.offset]
+
+    @level.setter
+    def level(self, value: float):
+        self.state[self.offset] = value
+
+    @property
+    def updated(self) -> float:
+        return self.state[self.offset + 1]
+
+    @updated.setter
+    def updated(self, value: float):
+        self.state[self.offset + 1] = value
+
+
+class SharedModelRateLimit(ModelRateLimit):
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, state, process_lock):
+        """
+        ModelRateLimit whose buckets and 429 pause live in shared memory. Every change
+        to the shared state is made under process_lock.
+        """
+        self.state = state
+        self.process_lock = process_lock
+        self.requests = SharedTokenBucket(requests_per_minute, state, 0)
+        self.tokens = SharedTokenBucket(tokens_per_minute, state, 2)
+        self.lock = asyncio.Lock()
+
+    @property
+    def blocked_until(self) -> float:
+        return self.state[4]
+
+    @blocked_until.setter
+    def blocked_until(self, value: float):
+        self.state[4] = value
+
+    def try_reserve(self, estimated_tokens: int) -> float:
+        with self.process_lock:
+            return super().try_reserve(estimated_tokens)
+
+    def refund(self, tokens: float):
+        with self.process_lock:
+            super().refund(tokens)
+
+    def block_for(self, seconds: float):
+        with self.process_lock:
+            super().block_for(seconds)
+
+
+class SharedRateLimits:
+    def __init__(self, limits: dict[tuple[str, str], tuple[float, float]], context=None):
+        """
+        Cross-process budget for a set of (provider, model) -> (rpm, tpm) limits.
+        Create it in the parent process with the multiprocessing context used to start
+        the workers, and pass it to them as a Process argument; each worker then builds
+        its RateLimiter with shared_limits=...
+        Time is measured with time.monotonic(), which all processes of a host share.
+        """
+        context = context or multiprocessing.get_context()
+        self.limits = dict(limits)
+        self.process_lock = context.Lock()
+        # Per model: requests level, requests updated, tokens level, tokens updated, blocked until
+        self.states = {}
+        now = time.monotonic()
+        for key, (rpm, tpm) in self.limits.items():
+            self.states[key] = context.Array('d', [float(rpm), now, float(tpm), now, 0.0], lock=False)
+
+    def model_limit(self, provider: str, model: str) -> SharedModelRateLimit | None:
+        if (provider, model) not in self.limits:
+            return None
+        rpm, tpm = self.limits[(provider, model)]
+        return SharedModelRateLimit(rpm, tpm, self.states[(provider, model)], self.process_lock)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: dict[tuple[str, str], tuple[float, float]] | None = None,
+        default_limit: tuple[float, float] | None = None,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        shared_limits: SharedRateLimits | None = None,
+        ledger: UsageLedger | None = None,
+    ):
+        """
+        Registry of rate limits keyed by (provider, model), with values
+        (requests_per_minute, tokens_per_minute). Models without an entry use
+        default_limit, or are not limited if default_limit is None.
+        Models in shared_limits use the cross-process budget instead of a local one.
+        Every successful call is recorded in ledger (by default the process-wide one
+        from Common.accounting), which also enforces the run's token/dollar budget.
+        """
+        self.shared_limits = shared_limits
+        self.ledger = ledger
+        self.limits = {}
+        for (provider, model), (rpm, tpm) in (limits or {}).items():
+            self.configure(provider, model, rpm, tpm)
+        self.default_limit = default_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_hits = 0
+        self.concurrency = {}
+
+    def configure(self, provider: str, model: str, requests_per_minute: float, tokens_per_minute: float):
+        shared_limit = self.shared_limits.model_limit(provider, model) if self.shared_limits is not None else None
+        self.limits[(provider, model)] = shared_limit or ModelRateLimit(requests_per_minute, tokens_per_minute)
+
+    def get_limit(self, provider: str, model: str) -> ModelRateLimit | None:
+        if (provider, model) not in self.limits and self.default_limit is not None:
+            self.configure(provider, model, *self.default_limit)
+        return self.limits.get((provider, model))
+
+    def adaptive_concurrency(self, provider: str, model: str, **options) -> AdaptiveConcurrency:
+        """
+        Limit the requests in flight to (provider, model) with an AIMD controller, created
+        with options (see AdaptiveConcurrency) on first use and shared by later callers.
+        """
+        if (provider, model) not in self.concurrency:
+            self.concurrency[(provider, model)] = AdaptiveConcurrency(**options)
+        return self.concurrency[(provider, model)]
+
+    def concurrency_stats(self) -> dict[str, dict]:
+        return {f"{provider}/{model}": controller.stats()
+                for (provider, model), controller in self.concurrency.items()}
+
+    async def call(self, provider: str, model: str, estimated_tokens: int, func, /, *args, **kwargs):
+        """
+        Call an async API function within the budget of (provider, model).
+        Retryable errors (429s, overloaded, timeouts) are retried with backoff; a 429
+        pauses every caller of the same model for the retry-after period. With an
+        adaptive concurrency limit, each attempt holds one of its slots and reports its
+        latency or overload to it.
+        The call is recorded in the ledger with its latency, waiting time and retries.
+        """
+        ledger = self.ledger or get_ledger()
+        limit = self.get_limit(provider, model)
+        concurrency = self.concurrency.get((provider, model))
+        retries = 0
+        start = time.perf_counter()
+        while True:
+            await ledger.wait_for_budget()
+            if concurrency is not None:
+                await concurrency.acquire()
+            reservation = None
+            call_start = time.perf_counter()
+            try:
+                if limit is not None:
+                    reservation = await limit.acquire(estimated_tokens)
+                call_start = time.perf_counter()
+                response = await func(*args, **kwargs)
+            except Exception as e:
+                if concurrency is not None:
+                    concurrency.release()
+                    if is_overload_error(e):
+                        concurrency.on_overload(call_start)
+                if reservation is not None:
+                    reservation.cancel()
+                if not is_retryable_error(e) or retries >= self.max_retries:
+                    raise
+                retry_after = get_retry_after(e)
+                if retry_after is None:
+                    retry_after = min(self.max_delay, self.base_delay * (2 ** retries))
+                retry_after += random.uniform(0, min(1.0, retry_after / 2))
+                if get_status_code(e) == 429:
+                    self.rate_limit_hits += 1
+                    if limit is not None:
+                        limit.block_for(retry_after)
+                retries += 1
+                print(f"{provider}/{model}: {e.__class__.__name__}, retrying in {retry_after:.2f} seconds "
+                      f"(attempt {retries}/{self.max_retries})")
+                await asyncio.sleep(retry_after)
+                continue
+            except BaseException:
+                if concurrency is not None:
+                    concurrency.release()
+                raise
+            if concurrency is not None:
+                concurrency.release()
+                concurrency.on_success(call_start, time.perf_counter() - call_start)
+            if reservation is not None:
+                reservation.reconcile(get_usage_tokens(response, model))
+            # Waiting covers the budget, the rate limit, failed attempts and backoff
+            ledger.record(provider, model, getattr(response, "usage", None),
+                          latency=time.perf_counter() - call_start, wait_time=call_start - start, retries=retries)
+            return response
+
+
+def estimate_tokens(*payloads, max_output_tokens: int = 0) -> int:
+    """
+    Rough token estimate (about 4 characters per token) for prompts and messages,
+    plus the requested output budget.
+    """
+    chars = 0
+    for payload in payloads:
+        chars += len(payload) if isinstance(payload, str) else len(json.dumps(payload))
+    return chars // 4 + max_output_tokens
+
+
+def get_usage_tokens(response, model: str | None = None) -> int | None:
+    """
+    Tokens of a response that count toward the tokens per minute limit of model, for both
+    Anthropic and OpenAI usage objects. OpenAI counts every prompt token, cached or not.
+    Anthropic counts uncached input tokens and cache writes, and cache reads only for the
+    models in CACHE_READS_RATE_LIMITED_MODELS.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    if getattr(usage, "total_tokens", None) is not None:
+        return usage.total_tokens
+    input_tokens = getattr(usage, "input_tokens", None)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if input_tokens is None or output_tokens is None:
+        return None
+    tokens = input_tokens + output_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+    if model is not None and model.startswith(CACHE_READS_RATE_LIMITED_MODELS):
+        tokens += getattr(usage, "cache_read_input_tokens", None) or 0
+    return tokens
+
+
+def get_status_code(error: Exception) -> int | None:
+    return getattr(error, "status_code", None)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    return (
+        get_status_code(error) in RETRYABLE_STATUS_CODES
+        or error.__class__.__name__ in RETRYABLE_ERROR_NAMES
+    )
+
+
+def is_overload_error(error: Exception) -> bool:
+    return (
+        get_status_code(error) in OVERLOAD_STATUS_CODES
+        or error.__class__.__name__ in OVERLOAD_ERROR_NAMES
+    )
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """
+    Extract a retry delay in seconds from the response headers or the error message.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    match = re.search(r"try again in (\d+(?:\.\d+)?)(ms|s)", str(error).lower())
+    if match:
+        value = float(match.group(1))
+        return value / 1000.0 if match.group(2) == "ms" else value
+    return None
@@ -0,0 +1,111 @@
+"""
+Adaptive allocation of conversations to personas for validation sweeps.
+
+Instead of a fixed number of conversations per persona, the next conversation goes to
+the persona whose target-validation PASS rate is the least certain: the one with the
+widest Wilson score interval. A persona is done once the half-width of its interval is
+at most the precision target (or it reaches the maximum number of conversations), so
+personas with a stable PASS rate stop early and the noisy ones get the extra samples.
+"""
+import math
+
+
+def wilson_interval(passes, total, z=1.96):
+    """Wilson score interval (low, high) for passes out of total; (0, 1) if total is 0."""
+    if total == 0:
+        return 0.0, 1.0
+    rate = passes / total
+    denominator = 1 + z * z / total
+    center = (rate + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class AdaptivePersonaScheduler:
+    def __init__(self, personas, precision=0.1, min_per_persona=3, max_per_persona=30, z=1.96):
+        """
+        Scheduler over the personas with target classifiers (the others have no PASS rate).
+        precision is the target half-width of each persona's interval; z sets the
+        confidence level (1.96 for 95%).
+        """
+        self.personas = {persona["name"]: persona for persona in personas if persona.get("target_classifiers")}
+        self.precision = precision
+        self.min_per_persona = min_per_persona
+        self.max_per_persona = max_per_persona
+        self.z = z
+        self.passes = {name: 0 for name in self.personas}
+        self.totals = {name: 0 for name in self.personas}
+        self.in_flight = {name: 0 for name in self.personas}
+        self.started = {name: 0 for name in self.personas}
+
+    def interval(self, name):
+        return wilson_interval(self.passes[name], self.totals[name], self.z)
+
+    def half_width(self, name, extra=0):
+        """
+        Half-width of the interval, assuming `extra` more results at the current PASS rate
+        (used to spread in-flight conversations over the personas).
+        """
+        total = self.totals[name] + extra
+        if total == 0:
+            return 0.5
+        rate = self.passes[name] / self.totals[name] if self.totals[name] else 0.5
+        low, high = wilson_interval(rate * total, total, self.z)
+        return (high - low) / 2
+
+    def is_done(self, name):
+        if self.totals[name] < self.min_per_persona:
+            return False
+        return self.half_width(name) <= self.precision or self.totals[name] >= self.max_per_persona
+
+    def next_persona(self):
+        """
+        Start the next conversation: returns (persona, conversation number), or None if
+        no persona needs more conversations right now. Personas below min_per_persona go
+        first, then the one with the widest interval counting in-flight conversations.
+        """
+        candidates = [
+            name for name in self.personas
+            if self.started[name] < self.max_per_persona and
+            (self.started[name] < self.min_per_persona or
+             self.half_width(name, self.in_flight[name]) > self.precision)
+        ]
+        if not candidates:
+            return None
+        name = max(candidates, key=lambda candidate: (
+            self.started[candidate] < self.min_per_persona,
+            self.half_width(candidate, self.in_flight[candidate]),
+            -self.started[candidate],
+        ))
+        self.in_flight[name] += 1
+        self.started[name] += 1
+        return self.personas[name], self.started[name]
+
+    def record(self, name, status):
+        """Record the target-validation status (PASS/FAIL) of a finished conversation."""
+        self.in_flight[name] -= 1
+        if status not in ("PASS", "FAIL"):
+            return
+        self.totals[name] += 1
+        self.passes[name] += status == "PASS"
+
+    def cancel(self, name):
+        """Give up a started conversation without a result (e.g. after an error)."""
+        self.in_flight[name] -= 1
+
+    def all_done(self):
+        return all(self.is_done(name) for name in self.personas)
+
+    def report(self):
+        report = {}
+        for name in self.personas:
+            low, high = self.interval(name)
+            report[name] = {
+                "conversations": self.totals[name],
+                "passes": self.passes[name],
+                "pass_rate": self.passes[name] / self.totals[name] if self.totals[name] else None,
+                "interval": [low, high],
+                "half_width": (high - low) / 2,
+                "done": self.is_done(name),
+            }
+        return report
@@ -0,0 +1,285 @@
+"""
+Asynchronous conversation simulation on top of AsyncAnthropic.
+
+Many conversations run concurrently (bounded by max_concurrent), while the turns
+inside a single conversation are still generated strictly one after another.
+
+With prompt_caching enabled, the static system prompts (Lindra's prompt and the persona
+description) are sent as cacheable prefix blocks and the history as an append-only
+message list, so every turn re-reads the shared prefix from the provider's cache.
+
+With stream_metrics enabled, Lindra's responses are streamed and each assistant message
+carries its time-to-first-token, total latency, output tokens/sec and stop reason.
+"""
+import asyncio
+import statistics
+import time
+
+from Common.accounting import accounting_tags
+from Common.clients import get_client_factory
+from Common.rate_limiting import RateLimiter, estimate_tokens
+from LLMTest.assistant import ASSISTANT_PROMPT
+from LLMTest.llmtestframework import build_user_prompt, build_assistant_messages, build_cached_user_request, \
+    build_cached_assistant_request, SIMULATION_MODEL
+
+USAGE_FIELDS = ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+
+
+class ConversationSimulator:
+    def __init__(
+        self,
+        client=None,
+        model=SIMULATION_MODEL,
+        max_concurrent=8,
+        rate_limiter=None,
+        prompt_caching=False,
+        stream_metrics=False,
+    ):
+        """
+        Simulates Lindra conversations with the async Anthropic client
+        (by default the one from the shared Common.clients factory).
+        max_concurrent bounds the number of conversations in flight at once;
+        rate_limiter (shared with other components) enforces the RPM/TPM budget and retries.
+        prompt_caching sends static prefixes as cacheable blocks (see module docstring).
+        stream_metrics streams Lindra's responses and records latency metrics per turn.
+        """
+        if client is None:
+            client = get_client_factory().anthropic_async()
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self.client = client
+        self.model = model
+        self.rate_limiter = rate_limiter
+        self.prompt_caching = prompt_caching
+        self.stream_metrics = stream_metrics
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        # Token usage per stage ("user_sim", "assistant"), including cache reads and writes
+        self.usage_totals = {}
+        # Latency metrics of every streamed assistant turn
+        self.turn_metrics = []
+
+    async def create_message(self, stage, estimated_tokens, **params):
+        """Call messages.create within the shared rate limit budget and record its usage."""
+        with accounting_tags(stage=stage):
+            message = await self.rate_limiter.call(
+                "anthropic", self.model, estimated_tokens,
+                self.client.messages.create, model=self.model, **params,
+            )
+        self.record_usage(stage, message.usage)
+        return message
+
+    def record_usage(self, stage, usage):
+        totals = self.usage_totals.setdefault(stage, {field: 0 for field in USAGE_FIELDS + ["requests"]})
+        totals["requests"] += 1
+        for field in USAGE_FIELDS:
+            totals[field] += getattr(usage, field, None) or 0
+
+    def cache_report(self):
+        """
+        Summarise token usage per stage, with the share of input tokens read from the cache.
+        """
+        report = {}
+        for stage, totals in self.usage_totals.items():
+            total_input = (totals["input_tokens"] + totals["cache_read_input_tokens"]
+                           + totals["cache_creation_input_tokens"])
+            report[stage] = dict(totals)
+            report[stage]["cache_hit_ratio"] = totals["cache_read_input_tokens"] / total_input if total_input else 0.0
+        return report
+
+    def user_message_params(self, persona, conversation_history, message_index):
+        """Request parameters (without model) for the next simulated user message."""
+        if self.prompt_caching:
+            system, messages = build_cached_user_request(persona, conversation_history)
+            params = {"system": system, "messages": messages}
+        else:
+            prompt = build_user_prompt(persona, conversation_history, message_index)
+            params = {"messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}]}
+        return {"max_tokens": 1000, "temperature": 1, **params}
+
+    def assistant_params(self, conversation_history, lindra_prompt=""):
+        """Request parameters (without model) for Lindra's next response."""
+        if self.prompt_caching:
+            system, messages = build_cached_assistant_request(conversation_history, lindra_prompt)
+            params = {"messages": messages}
+            if system:
+                params["system"] = system
+        else:
+            params = {"system": lindra_prompt, "messages": build_assistant_messages(conversation_history)}
+        return {"max_tokens": 1600, **params}
+
+    async def get_simulated_user_message(self, persona, conversation_history, message_index):
+        """Generate a message from the simulated user."""
+        params = self.user_message_params(persona, conversation_history, message_index)
+        try:
+            message = await self.create_message(
+                "user_sim", estimate_tokens(params["messages"], params.get("system", ""),
+                                            max_output_tokens=params["max_tokens"]),
+                **params,
+            )
+            return message.content[0].text.strip()
+        except Exception as e:
+            print(f"Error generating user message: {e}")
+            # Fallback to a simple message if API fails
+            return "Problem"
+
+    async def stream_message(self, stage, estimated_tokens, **params):
+        """
+        Stream a message within the shared rate limit budget.
+        Returns the final message and its latency metrics.
+        """
+        metrics = {}
+
+        async def stream(**stream_params):
+            start = time.perf_counter()
+            first_token = None
+            async with self.client.messages.stream(**stream_params) as response_stream:
+                async for _ in response_stream.text_stream:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                message = await response_stream.get_final_message()
+            end = time.perf_counter()
+            if first_token is None:
+                first_token = end
+            generation_time = end - first_token
+            metrics.update({
+                "time_to_first_token": first_token - start,
+                "total_latency": end - start,
+                "output_tokens": message.usage.output_tokens,
+                "output_tokens_per_second": (message.usage.output_tokens / generation_time
+                                             if generation_time > 0 else None),
+                "stop_reason": message.stop_reason,
+            })
+            return message
+
+        with accounting_tags(stage=stage):
+            message = await self.rate_limiter.call(
+                "anthropic", self.model, estimated_tokens, stream, model=self.model, **params,
+            )
+        self.record_usage(stage, message.usage)
+        self.turn_metrics.append(metrics)
+        return message, metrics
+
+    async def get_assistant_message(self, conversation_history, lindra_prompt=""):
+        """
+        Get Lindra's next message as a conversation entry. In stream_metrics mode the
+        entry also holds the latency metrics of the turn under "metrics".
+        """
+        params = self.assistant_params(conversation_history, lindra_prompt)
+        estimated_tokens = estimate_tokens(params["messages"], params.get("system", ""),
+                                           max_output_tokens=params["max_tokens"])
+        try:
+            if self.stream_metrics:
+                message, metrics = await self.stream_message("assistant", estimated_tokens, **params)
+                return {"role": "assistant", "content": message.content[0].text, "metrics": metrics}
+            message = await self.create_message("assistant", estimated_tokens, **params)
+            return {"role": "assistant", "content": message.content[0].text}
+        except Exception as e:
+            print(f"Error getting assistant response: {e}")
+            return {"role": "assistant", "content": "Error getting response"}
+
+    async def get_assistant_response(self, conversation_history, lindra_prompt=""):
+        """Get a response from Lindra."""
+        message = await self.get_assistant_message(conversation_history, lindra_prompt)
+        return message["content"]
+
+    def latency_report(self):
+        """
+        Summarise the streamed assistant turns: mean/median/p95 time-to-first-token and
+        total latency in seconds, mean output tokens/sec and stop reason counts.
+        """
+        if not self.turn_metrics:
+            return {}
+
+        def summarise(values):
+            values = sorted(values)
+            return {
+                "mean": statistics.mean(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            }
+
+        tokens_per_second = [m["output_tokens_per_second"] for m in self.turn_metrics
+                             if m["output_tokens_per_second"] is not None]
+        stop_reasons = {}
+        for m in self.turn_metrics:
+            stop_reasons[m["stop_reason"]] = stop_reasons.get(m["stop_reason"], 0) + 1
+        return {
+            "turns": len(self.turn_metrics),
+            "time_to_first_token": summarise([m["time_to_first_token"] for m in self.turn_metrics]),
+            "total_latency": summarise([m["total_latency"] for m in self.turn_metrics]),
+            "output_tokens_per_second": statistics.mean(tokens_per_second) if tokens_per_second else None,
+            "stop_reasons": stop_reasons,
+        }
+
+    async def simulate_conversation(self, persona, num_messages=10, lindra_prompt=ASSISTANT_PROMPT,
+                                    conversation=None, on_turn=None, stop_condition=None):
+        """
+        Simulate a single conversation. Turns are produced in order.
+
+        A partial conversation can be passed to continue it from its last turn.
+        on_turn(conversation) is called after every new message.
+        stop_condition is an optional async callable(conversation) -> bool, awaited after
+        every assistant response; the conversation ends early when it returns True.
+        """
+        async with self.semaphore:
+            conversation = list(conversation or [])
+
+            # The conversation alternates user/assistant, starting with the user
+            # and ending after the num_messages-th assistant response
+            while len(conversation) < 2 * num_messages:
+                if len(conversation) % 2 == 0:
+                    message_index = len(conversation) // 2
+                    user_message = await self.get_simulated_user_message(persona, conversation, message_index)
+                    conversation.append({"role": "user", "content": user_message})
+                else:
+                    conversation.append(await self.get_assistant_message(conversation, lindra_prompt))
+                if on_turn is not None:
+                    on_turn(conversation)
+                if conversation[-1]["role"] == "assistant" and stop_condition is not None \
+                        and await stop_condition(conversation):
+                    break
+
+            return conversation
+
+    async def simulate_conversations(self, jobs, num_messages=10, lindra_prompt=ASSISTANT_PROMPT,
+                                     on_complete=None, on_turn=None, resume_from=None, keep_results=True,
+                                     stop_condition=None):
+        """
+        Simulate many conversations concurrently.
+
+        Args:
+            jobs: List of (conversation_id, persona) pairs
+            num_messages: Number of assistant messages in each conversation
+            lindra_prompt: System prompt for Lindra
+            on_complete: Optional callback(conversation_id, persona, conversation), called as
+                         soon as each conversation finishes
+            on_turn: Optional callback(conversation_id, conversation), called after every message
+            resume_from: Optional dictionary of partial conversations keyed by conversation_id
+            keep_results: If False, finished conversations are dropped once on_complete has
+                          handled them, so memory does not grow with the number of jobs
+            stop_condition: Optional async callable(conversation_id, persona, conversation) -> bool,
+                            awaited after every assistant response to end a conversation early
+
+        Returns:
+            Dictionary of conversations keyed by conversation_id, in the order of jobs
+            (values are None with keep_results=False)
+        """
+        resume_from = resume_from or {}
+
+        async def run_job(conversation_id, persona):
+            with accounting_tags(persona=persona["name"], conversation_id=conversation_id):
+                conversation = await self.simulate_conversation(
+                    persona, num_messages, lindra_prompt,
+                    conversation=resume_from.get(conversation_id),
+                    on_turn=(lambda conv: on_turn(conversation_id, conv)) if on_turn is not None else None,
+                    stop_condition=(lambda conv: stop_condition(conversation_id, persona, conv))
+                    if stop_condition is not None else None,
+                )
+            if on_complete is not None:
+                on_complete(conversation_id, persona, conversation)
+            return conversation if keep_results else None
+
+        conversations = await asyncio.gather(*[
+            run_job(conversation_id, persona) for conversation_id, persona in jobs
+        ])
+        return {conversation_id: conversation for (conversation_id, _), conversation in zip(jobs, conversations)}
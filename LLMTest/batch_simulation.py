@@ -0,0 +1,145 @@
+"""
+Turn-synchronous conversation simulation through the Anthropic Message Batches API.
+
+All conversations advance one turn at a time: every pending simulated-user call of
+the turn is submitted as one batch job, then every pending Lindra call as another.
+Latency per conversation is high, but throughput and cost suit large offline sweeps.
+"""
+import asyncio
+import re
+
+from Common.accounting import accounting_tags, get_ledger
+from LLMTest.assistant import ASSISTANT_PROMPT
+from LLMTest.async_simulation import ConversationSimulator
+
+# Upper bound on requests per batch job imposed by the API
+MAX_BATCH_REQUESTS = 100000
+
+
+def make_custom_id(conversation_id, stage, message_index):
+    """Batch custom ids may only contain letters, digits, '_' and '-' (max 64 characters)."""
+    safe_id = re.sub(r"[^a-zA-Z0-9_-]", "-", str(conversation_id))
+    suffix = f"-{stage}{message_index}"
+    return safe_id[:64 - len(suffix)] + suffix
+
+
+class BatchConversationSimulator(ConversationSimulator):
+    def __init__(self, client=None, poll_interval=30, **kwargs):
+        """
+        Simulates conversations with one batch job per turn and role.
+        Accepts the same options as ConversationSimulator; poll_interval is the number
+        of seconds between batch status checks.
+        """
+        super().__init__(client=client, **kwargs)
+        self.poll_interval = poll_interval
+        self.batches_submitted = 0
+
+    async def run_batch(self, stage, requests, request_tags=None):
+        """
+        Submit {custom_id: params} as batch jobs, wait for them to end and return
+        {custom_id: text}. Failed requests are missing from the result.
+        Usage is recorded in the ledger at batch prices, with the accounting tags in
+        request_tags[custom_id] (e.g. persona and conversation_id).
+        """
+        request_tags = request_tags or {}
+        texts = {}
+        items = list(requests.items())
+        for start in range(0, len(items), MAX_BATCH_REQUESTS):
+            await get_ledger().wait_for_budget()
+            batch = await self.client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": {"model": self.model, **params}}
+                for custom_id, params in items[start:start + MAX_BATCH_REQUESTS]
+            ])
+            self.batches_submitted += 1
+            print(f"  Submitted {stage} batch {batch.id} with {len(items[start:start + MAX_BATCH_REQUESTS])} requests")
+
+            while batch.processing_status != "ended":
+                await asyncio.sleep(self.poll_interval)
+                batch = await self.client.messages.batches.retrieve(batch.id)
+
+            async for entry in await self.client.messages.batches.results(batch.id):
+                if entry.result.type == "succeeded":
+                    self.record_usage(stage, entry.result.message.usage)
+                    with accounting_tags(stage=stage, **request_tags.get(entry.custom_id, {})):
+                        get_ledger().record("anthropic", self.model, entry.result.message.usage, batch=True)
+                    texts[entry.custom_id] = entry.result.message.content[0].text
+                else:
+                    print(f"  Batch request {entry.custom_id} {entry.result.type}")
+        return texts
+
+    async def simulate_conversations(self, jobs, num_messages=10, lindra_prompt=ASSISTANT_PROMPT,
+                                     on_complete=None, on_turn=None, resume_from=None, keep_results=True,
+                                     stop_condition=None):
+        """
+        Simulate all conversations turn by turn through the batch API.
+        Takes the same arguments and returns the same result as
+        ConversationSimulator.simulate_conversations.
+        """
+        resume_from = resume_from or {}
+        personas_by_id = dict(jobs)
+        conversations = {
+            conversation_id: list(resume_from.get(conversation_id) or [])
+            for conversation_id, _ in jobs
+        }
+        finished = set()
+        # Conversations ended early by stop_condition
+        stopped = set()
+
+        def request_tags(requests):
+            return {custom_id: {"persona": personas_by_id[conversation_id]["name"], "conversation_id": conversation_id}
+                    for custom_id, (conversation_id, _) in requests.items()}
+
+        def is_done(conversation_id):
+            return conversation_id in stopped or len(conversations[conversation_id]) >= 2 * num_messages
+
+        while len(finished) < len(conversations):
+            # Simulated user messages for every conversation waiting on the user...
+            user_requests = {}
+            for conversation_id, conversation in conversations.items():
+                if not is_done(conversation_id) and len(conversation) % 2 == 0:
+                    message_index = len(conversation) // 2
+                    custom_id = make_custom_id(conversation_id, "u", message_index)
+                    user_requests[custom_id] = (conversation_id, self.user_message_params(
+                        personas_by_id[conversation_id], conversation, message_index))
+            if user_requests:
+                texts = await self.run_batch("user_sim", {k: v[1] for k, v in user_requests.items()},
+                                             request_tags(user_requests))
+                for custom_id, (conversation_id, _) in user_requests.items():
+                    # Same fallback as the sequential simulator if a request failed
+                    text = texts[custom_id].strip() if custom_id in texts else "Problem"
+                    conversations[conversation_id].append({"role": "user", "content": text})
+                    if on_turn is not None:
+                        on_turn(conversation_id, conversations[conversation_id])
+
+            # ...then Lindra's responses for every conversation waiting on the assistant
+            assistant_requests = {}
+            for conversation_id, conversation in conversations.items():
+                if not is_done(conversation_id) and len(conversation) % 2 == 1:
+                    custom_id = make_custom_id(conversation_id, "a", len(conversation) // 2)
+                    assistant_requests[custom_id] = (conversation_id, self.assistant_params(
+                        conversation, lindra_prompt))
+            if assistant_requests:
+                texts = await self.run_batch("assistant", {k: v[1] for k, v in assistant_requests.items()},
+                                             request_tags(assistant_requests))
+                for custom_id, (conversation_id, _) in assistant_requests.items():
+                    text = texts.get(custom_id, "Error getting response")
+                    conversations[conversation_id].append({"role": "assistant", "content": text})
+                    if on_turn is not None:
+                        on_turn(conversation_id, conversations[conversation_id])
+
+                if stop_condition is not None:
+                    answered = [conversation_id for conversation_id, _ in assistant_requests.values()]
+                    decisions = await asyncio.gather(*[
+                        stop_condition(conversation_id, personas_by_id[conversation_id], conversations[conversation_id])
+                        for conversation_id in answered
+                    ])
+                    stopped.update(conversation_id for conversation_id, stop in zip(answered, decisions) if stop)
+
+            for conversation_id, conversation in conversations.items():
+                if conversation_id not in finished and is_done(conversation_id):
+                    finished.add(conversation_id)
+                    if on_complete is not None:
+                        on_complete(conversation_id, personas_by_id[conversation_id], conversation)
+
+        return {conversation_id: conversations[conversation_id] if keep_results else None
+                for conversation_id, _ in jobs}
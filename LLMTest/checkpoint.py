@@ -0,0 +1,81 @@
+"""
+Journal and per-turn checkpoints for resumable conversation generation.
+
+Finished conversations are appended to a JSONL journal (a ConversationSink) as soon
+as they complete.
+Conversations still in progress are checkpointed after every turn, so an interrupted
+run can skip finished conversations and continue partial ones from their last turn.
+"""
+import json
+import os
+
+from LLMTest.output_sink import ConversationSink, truncate_partial_line
+
+
+class GenerationJournal:
+    def __init__(self, folder, name):
+        """
+        Journal stored at <folder>/<name>.journal.jsonl, with per-conversation
+        checkpoints in <folder>/<name>_checkpoints/.
+        """
+        self.journal_path = os.path.join(folder, f"{name}.journal.jsonl")
+        self.checkpoint_folder = os.path.join(folder, f"{name}_checkpoints")
+        self.sink = ConversationSink(self.journal_path)
+        os.makedirs(self.checkpoint_folder, exist_ok=True)
+
+    def reset(self):
+        """Start a fresh run: drop the journal and all checkpoints."""
+        self.sink.clear()
+        for filename in os.listdir(self.checkpoint_folder):
+            os.remove(os.path.join(self.checkpoint_folder, filename))
+
+    def open_for_resume(self):
+        """
+        Prepare the journal for a resumed run and return the ids of its finished
+        conversations. A partial last line left by a crash mid-write is truncated, so the
+        next finished conversation is not appended onto it (which would corrupt both).
+        """
+        removed = truncate_partial_line(self.journal_path)
+        if removed:
+            print(f"Dropped an incomplete line ({removed} bytes) from {self.journal_path}")
+        return self.completed_ids()
+
+    def load_completed(self):
+        """
+        Load finished conversations from the journal, keyed by persona_conv_id.
+        A truncated last line (from a crash mid-write) is ignored.
+        """
+        return {record["persona_conv_id"]: record for record in self.sink}
+
+    def completed_ids(self):
+        """Ids of the finished conversations, without keeping the conversations in memory."""
+        return {record["persona_conv_id"] for record in self.sink}
+
+    def append(self, persona_conv_id, record):
+        """Append a finished conversation to the journal and remove its checkpoint."""
+        self.sink.append({"conversation_id": persona_conv_id, "persona_conv_id": persona_conv_id, **record})
+        self.clear_checkpoint(persona_conv_id)
+
+    def checkpoint_path(self, persona_conv_id):
+        return os.path.join(self.checkpoint_folder, f"{persona_conv_id}.json")
+
+    def save_checkpoint(self, persona_conv_id, conversation):
+        """Atomically save the partial conversation after a turn."""
+        path = self.checkpoint_path(persona_conv_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"persona_conv_id": persona_conv_id, "conversation": conversation}, f)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, persona_conv_id):
+        """Return the partial conversation for persona_conv_id, or None if there is none."""
+        path = self.checkpoint_path(persona_conv_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)["conversation"]
+
+    def clear_checkpoint(self, persona_conv_id):
+        path = self.checkpoint_path(persona_conv_id)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,124 @@
+"""
+Conversation tree sampling: generate a shared prefix once and fork several
+continuations at chosen turns.
+
+Every node is one message with a pointer to its parent. Any root-to-leaf path is a
+standard conversation, so a tree with forks at F turns and k branches per fork gives
+k ** F conversations while the shared opening turns are paid for only once. Forks
+share their prefix, which also makes them hit the provider's prompt cache.
+"""
+import asyncio
+import json
+
+from Common.accounting import accounting_tags
+from LLMTest.assistant import ASSISTANT_PROMPT
+
+
+class ConversationTree:
+    def __init__(self, tree_id, persona):
+        """
+        Tree of messages for one persona. Roots are first user messages
+        (several if the tree forks at turn 0).
+        """
+        self.tree_id = tree_id
+        self.persona = persona
+        self.nodes = {}
+
+    def add_node(self, parent_id, message):
+        """Add a message under parent_id (None for the root) and return its node id."""
+        node_id = f"{self.tree_id}-n{len(self.nodes)}"
+        self.nodes[node_id] = {"id": node_id, "parent_id": parent_id, **message}
+        return node_id
+
+    def path(self, node_id):
+        """Messages from the root to node_id."""
+        messages = []
+        while node_id is not None:
+            node = self.nodes[node_id]
+            messages.append({k: v for k, v in node.items() if k not in ("id", "parent_id")})
+            node_id = node["parent_id"]
+        return messages[::-1]
+
+    def leaves(self):
+        """Node ids without children, in creation order."""
+        parents = {node["parent_id"] for node in self.nodes.values()}
+        return [node_id for node_id in self.nodes if node_id not in parents]
+
+    def flatten(self):
+        """All root-to-leaf conversations, keyed by leaf node id."""
+        return {leaf_id: self.path(leaf_id) for leaf_id in self.leaves()}
+
+    def to_dict(self):
+        return {"tree_id": self.tree_id, "persona": self.persona, "nodes": list(self.nodes.values())}
+
+    @classmethod
+    def from_dict(cls, data):
+        tree = cls(data["tree_id"], data["persona"])
+        tree.nodes = {node["id"]: node for node in data["nodes"]}
+        return tree
+
+
+def save_trees_to_jsonl(trees, filename):
+    """Save conversation trees to a JSONL file, one tree per line."""
+    with open(filename, 'w', encoding='utf-8') as f:
+        for tree in trees:
+            f.write(json.dumps(tree.to_dict()) + '\n')
+
+
+def append_tree_to_jsonl(tree, filename):
+    """Append one conversation tree to a JSONL file (readable with load_trees_from_jsonl)."""
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(tree.to_dict()) + '\n')
+
+
+def load_trees_from_jsonl(filename):
+    """Load conversation trees saved with save_trees_to_jsonl or append_tree_to_jsonl."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [ConversationTree.from_dict(json.loads(line)) for line in f]
+
+
+async def grow_conversation_tree(simulator, tree_id, persona, num_messages=10, fork_turns=(1,), branches=2,
+                                 lindra_prompt=ASSISTANT_PROMPT):
+    """
+    Generate a conversation tree with a ConversationSimulator.
+
+    Args:
+        simulator: ConversationSimulator used for the API calls
+        tree_id: Identifier of the tree (prefix of its node ids)
+        persona: Persona dictionary for the simulated user
+        num_messages: Number of assistant messages on every root-to-leaf path
+        fork_turns: Turn indices (0-based user messages) at which to fork; at a fork,
+                    `branches` different user messages continue the same prefix
+        branches: Number of continuations per fork
+
+    Returns:
+        ConversationTree with branches ** F leaves, F being the number of fork turns below num_messages
+    """
+    tree = ConversationTree(tree_id, persona)
+    fork_turns = set(fork_turns)
+
+    async def grow(node_id, conversation):
+        while len(conversation) < 2 * num_messages:
+            if len(conversation) % 2 == 0:
+                message_index = len(conversation) // 2
+                if message_index in fork_turns:
+                    # Sample the continuations concurrently and grow each branch on its own
+                    user_messages = await asyncio.gather(*[
+                        simulator.get_simulated_user_message(persona, conversation, message_index)
+                        for _ in range(branches)
+                    ])
+                    await asyncio.gather(*[
+                        grow(tree.add_node(node_id, message), conversation + [message])
+                        for message in [{"role": "user", "content": text} for text in user_messages]
+                    ])
+                    return
+                user_message = await simulator.get_simulated_user_message(persona, conversation, message_index)
+                message = {"role": "user", "content": user_message}
+            else:
+                message = await simulator.get_assistant_message(conversation, lindra_prompt)
+            node_id = tree.add_node(node_id, message)
+            conversation = conversation + [message]
+
+    with accounting_tags(persona=persona["name"], conversation_id=tree_id):
+        await grow(None, [])
+    return tree
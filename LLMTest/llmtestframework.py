@@ -1,6 +1,9 @@
 from LLMTest.assistant import ASSISTANT_PROMPT
 from LLMTest.personas import *
-from LLMTest.user import USER_PROMPT_TEMPLATE
+from LLMTest.user import USER_PROMPT_TEMPLATE, USER_CACHED_CONVERSATION_INSTRUCTIONS
+from LLMTest.output_sink import ConversationSink
+from Common.clients import get_client_factory
+from Common.accounting import get_ledger
 
 import json
 import random
@@ -11,24 +14,14 @@ import time
 import sys
 import csv
 import os
-from dotenv import load_dotenv
-import anthropic
+import uuid
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Retrieve API key securely
-CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
+# API clients are created on first use by Common.clients (which also reads the .env file)
 NUM_MESSAGES = 6
+SIMULATION_MODEL = "claude-3-5-sonnet-latest"
 OUTPUT_FILE = "simulated_conversations.jsonl"
 OUTPUT_FOLDER = "personas_conversations"
 
-# Create output folder if it doesn't exist
-if not os.path.exists(OUTPUT_FOLDER):
-    os.makedirs(OUTPUT_FOLDER)
-
-client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-
 
 def retry_with_backoff(func):
     def wrapper(*args, **kwargs):
@@ -36,8 +29,9 @@ def retry_with_backoff(func):
         for attempt in range(retries):
             try:
                 return func(*args, **kwargs)
-            except (anthropic.RateLimitError, anthropic.APIError) as e:
-                if attempt == retries - 1:
+            except Exception as e:
+                import anthropic
+                if not isinstance(e, (anthropic.RateLimitError, anthropic.APIError)) or attempt == retries - 1:
                     raise
                 wait_time = 2 ** attempt  # Exponential backoff
                 print(f"Retry attempt {attempt + 1}. Waiting {wait_time} seconds.")
@@ -46,9 +40,15 @@ def retry_with_backoff(func):
     return wrapper
 
 
-@retry_with_backoff
-def get_simulated_user_message(persona, conversation_history, message_index):
-    """Generate a message from the simulated user using Claude API."""
+def strip_emotion_expressions(content):
+    """Strip the trailing emotion expressions from a simulated user message."""
+    if "(" in content and content.endswith(")"):
+        content = content[:content.rfind("(")].strip()
+    return content
+
+
+def build_user_prompt(persona, conversation_history, message_index):
+    """Build the prompt for the simulated user from the persona and the conversation so far."""
 
     # Create prompt with conversation context
     prompt = USER_PROMPT_TEMPLATE.format(**persona)
@@ -61,9 +61,7 @@ def get_simulated_user_message(persona, conversation_history, message_index):
                 prompt += f"Lindra: {message['content']}\n"
             else:
                 # Strip the emotion expressions when showing the conversation history
-                user_content = message["content"]
-                if "(" in user_content and user_content.endswith(")"):
-                    user_content = user_content[:user_content.rfind("(")].strip()
+                user_content = strip_emotion_expressions(message["content"])
                 prompt += f"You: {user_content}\n"
 
     # Add instruction for the next message if it's the first one
@@ -72,15 +70,78 @@ def get_simulated_user_message(persona, conversation_history, message_index):
     else:
         prompt += "\nRespond to Lindra's last message."
 
+    return prompt
+
+
+def build_assistant_messages(conversation_history):
+    """Format the conversation history as a message list for the assistant API call."""
+    messages = []
+    for message in conversation_history:
+        messages.append({
+            "role": message["role"],
+            "content": [{"type": "text", "text": message["content"]}]
+        })
+    return messages
+
+
+def build_cached_user_request(persona, conversation_history):
+    """
+    Build the (system, messages) pair for the simulated user in prompt caching mode.
+
+    The persona prompt is a cacheable system block and the transcript is an append-only
+    message list: Lindra's messages are user turns and the simulated user's own messages
+    are assistant turns. The last block carries a cache breakpoint, so the next turn
+    reads everything up to it from the prefix cache.
+    """
+    system = [{
+        "type": "text",
+        "text": USER_PROMPT_TEMPLATE.format(**persona) + USER_CACHED_CONVERSATION_INSTRUCTIONS,
+        "cache_control": {"type": "ephemeral"},
+    }]
+    messages = [{"role": "user", "content": [{"type": "text", "text": "(Lindra has joined the conversation.)"}]}]
+    for message in conversation_history:
+        if message["role"] == "assistant":
+            messages.append({"role": "user", "content": [{"type": "text", "text": message["content"]}]})
+        else:
+            content = strip_emotion_expressions(message["content"])
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": content}]})
+    messages[-1]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+    return system, messages
+
+
+def build_cached_assistant_request(conversation_history, lindra_prompt):
+    """
+    Build the (system, messages) pair for Lindra in prompt caching mode, with cache
+    breakpoints after the system prompt and after the latest message.
+    """
+    # Empty text blocks are rejected by the API, so an empty prompt means no system block
+    system = [{"type": "text", "text": lindra_prompt, "cache_control": {"type": "ephemeral"}}] if lindra_prompt.strip() else []
+    messages = build_assistant_messages(conversation_history)
+    if messages:
+        messages[-1]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+    return system, messages
+
+
+@retry_with_backoff
+def get_simulated_user_message(persona, conversation_history, message_index, client=None):
+    """Generate a message from the simulated user using Claude API."""
+    client = client or get_client_factory().anthropic_sync()
+
+    prompt = build_user_prompt(persona, conversation_history, message_index)
+
     try:
+        get_ledger().check_budget()
+        start = time.perf_counter()
         message = client.messages.create(
-            model="claude-3-5-sonnet-latest",
+            model=SIMULATION_MODEL,
             max_tokens=1000,
             temperature=1,
             messages=[
                 {"role": "user", "content": [{"type": "text", "text": prompt}]}
             ]
         )
+        get_ledger().record("anthropic", SIMULATION_MODEL, message.usage, latency=time.perf_counter() - start,
+                            stage="user_sim", persona=persona["name"])
         user_message = message.content[0].text.strip()
 
         return user_message
@@ -91,47 +152,48 @@ def get_simulated_user_message(persona, conversation_history, message_index):
 
 
 @retry_with_backoff
-def get_assistant_response(conversation_history, lindra_prompt=""):
+def get_assistant_response(conversation_history, lindra_prompt="", client=None):
     """Get a response from Lindra using Claude API."""
+    client = client or get_client_factory().anthropic_sync()
 
     # Format messages for the API call
-    messages = []
-    for message in conversation_history:
-        messages.append({
-            "role": message["role"],
-            "content": [{"type": "text", "text": message["content"]}]
-        })
+    messages = build_assistant_messages(conversation_history)
 
     try:
+        get_ledger().check_budget()
+        start = time.perf_counter()
         message = client.messages.create(
-            model="claude-3-5-sonnet-latest",
+            model=SIMULATION_MODEL,
             system=lindra_prompt,
             max_tokens=1600,
             messages=messages
         )
+        get_ledger().record("anthropic", SIMULATION_MODEL, message.usage, latency=time.perf_counter() - start,
+                            stage="assistant")
         return message.content[0].text
     except Exception as e:
         print(f"Error getting assistant response: {e}")
         return "Error getting response"
 
 
-def simulate_conversation(persona, num_messages=10, lindra_prompt=""):
+def simulate_conversation(persona, num_messages=10, lindra_prompt="", client=None):
     """Simulate a conversation between Lindra and a user with the given persona."""
+    client = client or get_client_factory().anthropic_sync()
     conversation = []
 
     # First user message
-    user_message = get_simulated_user_message(persona, conversation, 0)
+    user_message = get_simulated_user_message(persona, conversation, 0, client)
     conversation.append({"role": "user", "content": user_message})
 
     # Simulate the conversation for the specified number of messages
     for i in range(num_messages):
         # Get assistant response
-        assistant_response = get_assistant_response(conversation, ASSISTANT_PROMPT)
+        assistant_response = get_assistant_response(conversation, ASSISTANT_PROMPT, client)
         conversation.append({"role": "assistant", "content": assistant_response})
 
         # Get next user message
         if i < num_messages - 1:  # Only get next user message if not the last iteration
-            user_message = get_simulated_user_message(persona, conversation, i + 1)
+            user_message = get_simulated_user_message(persona, conversation, i + 1, client)
             conversation.append({"role": "user", "content": user_message})
 
         # Add a small delay to avoid rate limiting
@@ -140,9 +202,16 @@ def simulate_conversation(persona, num_messages=10, lindra_prompt=""):
     return conversation
 
 
-def save_conversation_to_csv(persona, conversation, folder):
+def conversation_filename(persona, folder, conversation_id, extension):
+    """File name for a conversation; conversation_id keeps conversations with the same persona apart."""
+    if conversation_id is None:
+        conversation_id = uuid.uuid4().hex[:8]
+    return os.path.join(folder, f"{persona['name']}_{persona['specific_focus'].replace(' ', '_')}_{conversation_id}.{extension}")
+
+
+def save_conversation_to_csv(persona, conversation, folder, conversation_id=None):
     """Save a conversation to a CSV file."""
-    filename = os.path.join(folder, f"{persona['name']}_{persona['specific_focus'].replace(' ', '_')}.csv")
+    filename = conversation_filename(persona, folder, conversation_id, "csv")
 
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
         fieldnames = ['turn', 'role', 'content']
@@ -159,9 +228,9 @@ def save_conversation_to_csv(persona, conversation, folder):
     return filename
 
 
-def save_conversation_to_json(persona, conversation, folder):
+def save_conversation_to_json(persona, conversation, folder, conversation_id=None):
     """Save a conversation to a single-line JSON file."""
-    filename = os.path.join(folder, f"{persona['name']}_{persona['specific_focus'].replace(' ', '_')}.json")
+    filename = conversation_filename(persona, folder, conversation_id, "json")
 
     # Create a dictionary with persona info and conversation
     data = {
@@ -185,7 +254,12 @@ def save_all_conversations_to_jsonl(all_conversations, filename):
 
 
 def main():
-    all_conversations = {}
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+    # Each finished conversation is appended to the combined JSONL file right away
+    all_conversations_file = os.path.join(OUTPUT_FOLDER, "all_conversations.jsonl")
+    sink = ConversationSink(all_conversations_file)
+    sink.clear()
 
     # Simulate conversations for each selected persona
     for i, persona in enumerate(personas):
@@ -195,24 +269,21 @@ def main():
         conversation = simulate_conversation(persona, NUM_MESSAGES, ASSISTANT_PROMPT)
 
         # Save individual conversation to CSV
-        csv_filename = save_conversation_to_csv(persona, conversation, OUTPUT_FOLDER)
+        csv_filename = save_conversation_to_csv(persona, conversation, OUTPUT_FOLDER, i + 1)
         print(f"Saved CSV to {csv_filename}")
 
         # Save individual conversation to JSON (single line)
-        json_filename = save_conversation_to_json(persona, conversation, OUTPUT_FOLDER)
+        json_filename = save_conversation_to_json(persona, conversation, OUTPUT_FOLDER, i + 1)
         print(f"Saved JSON to {json_filename}")
 
-        # Add to all conversations dictionary
-        all_conversations[persona['name']] = {
+        sink.append({
+            "conversation_id": f"{persona['name']}_{i + 1}",
             "persona": persona,
             "conversation": conversation
-        }
+        })
 
         print(f"Completed conversation with {persona['name']}")
 
-    # Save all conversations to JSONL file (one JSON object per line)
-    all_conversations_file = os.path.join(OUTPUT_FOLDER, "all_conversations.jsonl")
-    save_all_conversations_to_jsonl(all_conversations, all_conversations_file)
     print(f"All conversations saved to {all_conversations_file}")
 
 
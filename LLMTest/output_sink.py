@@ -0,0 +1,233 @@
+"""
+Append-only output sink for generated conversations.
+
+Every finished conversation is appended to one JSONL stream as soon as it completes,
+with a unique conversation_id, and flushed and fsynced so a crash loses nothing.
+Other formats (per-conversation JSON and CSV, combined CSV, combined JSONL) are
+produced on demand by streaming over that file, so memory stays flat regardless of
+the size of the run.
+"""
+import csv
+import json
+import os
+import uuid
+from collections.abc import Mapping
+
+
+class ConversationSink:
+    def __init__(self, path):
+        """
+        Sink writing to the JSONL file at path (created on first append).
+        """
+        self.path = path
+        # Whether a partial last line left by an earlier crash has been dropped yet
+        self.tail_checked = False
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def append(self, record):
+        """
+        Append one conversation record and make it durable.
+        A conversation_id is assigned if the record does not have one yet.
+        Before the first append, a partial last line (from a crash mid-write) is
+        truncated, so the record starts on a line of its own.
+        Returns the conversation_id.
+        """
+        if not record.get("conversation_id"):
+            record = {"conversation_id": uuid.uuid4().hex, **record}
+        if not self.tail_checked:
+            truncate_partial_line(self.path)
+            self.tail_checked = True
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return record["conversation_id"]
+
+    def __iter__(self):
+        """
+        Iterate over the records in the stream. A truncated last line (from a crash
+        mid-write) is skipped.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping incomplete line in {self.path}")
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def export_json(self, folder):
+        """Write every conversation to its own single-line JSON file. Returns the file names."""
+        os.makedirs(folder, exist_ok=True)
+        filenames = []
+        for record in self:
+            filename = os.path.join(folder, f"{conversation_filename_base(record)}.json")
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(record, f)
+            filenames.append(filename)
+        return filenames
+
+    def export_csv(self, folder):
+        """Write every conversation to its own CSV file (turn, role, content). Returns the file names."""
+        os.makedirs(folder, exist_ok=True)
+        filenames = []
+        for record in self:
+            filename = os.path.join(folder, f"{conversation_filename_base(record)}.csv")
+            with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=['turn', 'role', 'content'])
+                writer.writeheader()
+                for i, message in enumerate(record["conversation"]):
+                    writer.writerow({'turn': i + 1, 'role': message['role'], 'content': message['content']})
+            filenames.append(filename)
+        return filenames
+
+    def export_combined_csv(self, filename):
+        """Write all conversations to one CSV file with one row per message."""
+        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=['conversation_id', 'persona', 'turn', 'role', 'content'])
+            writer.writeheader()
+            for record in self:
+                for i, message in enumerate(record["conversation"]):
+                    writer.writerow({
+                        'conversation_id': record["conversation_id"],
+                        'persona': record.get("persona", {}).get("name", ""),
+                        'turn': i + 1,
+                        'role': message['role'],
+                        'content': message['content']
+                    })
+        return filename
+
+    def index(self, key="conversation_id"):
+        """Map record[key] to the byte offset of its line, without loading the conversations."""
+        offsets = {}
+        if not os.path.exists(self.path):
+            return offsets
+        with open(self.path, 'rb') as f:
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                try:
+                    offsets[json.loads(line)[key]] = offset
+                except json.JSONDecodeError:
+                    pass
+                offset = f.tell()
+        return offsets
+
+    def read_at(self, offset):
+        """Read the record whose line starts at offset (see index)."""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def export_jsonl(self, filename):
+        """
+        Write the records of the stream to another JSONL file (e.g. the combined
+        all_conversations file). Incomplete lines are left out, and an empty file is
+        written if the stream does not exist yet.
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            for record in self:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return filename
+
+
+class ConversationIndex(Mapping):
+    def __init__(self, sink, key="conversation_id", order=None):
+        """
+        Read-only mapping of record[key] to the records of a sink. Only the byte offset
+        of each record is held in memory; a record is read from the stream each time it
+        is accessed, so iterating over a large run never loads all conversations at once.
+        order (a list of keys) restricts the mapping to those keys, in that order;
+        otherwise keys are in stream order.
+        """
+        self.sink = sink
+        self.offsets = sink.index(key)
+        if order is not None:
+            self.offsets = {k: self.offsets[k] for k in order if k in self.offsets}
+
+    def __getitem__(self, k):
+        return self.sink.read_at(self.offsets[k])
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def truncate_partial_line(path):
+    """
+    Drop a partial last line (from a crash mid-write) from the JSONL file at path, so the
+    next append starts on a line of its own. Returns the number of bytes removed.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        keep = 0
+        # Scan backwards for the last newline
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline != -1:
+                keep = position - step + newline + 1
+                break
+            position -= step
+        if keep < end:
+            f.truncate(keep)
+            f.flush()
+            os.fsync(f.fileno())
+    return end - keep
+
+
+def conversation_filename_base(record):
+    """
+    File name (without extension) for a conversation: persona name, focus and a suffix
+    that is unique within the run (conversation number, or the conversation id).
+    """
+    persona = record.get("persona", {})
+    suffix = record.get("conversation_number", record["conversation_id"])
+    focus = persona.get("specific_focus", "conversation").replace(' ', '_').replace('/', '_')
+    return f"{persona.get('name', 'unknown')}_{focus}_{suffix}"
+
+
+def merge_sinks(sinks, filename, conversation_ids):
+    """
+    Merge the streams of several sinks (e.g. one per worker process) into one JSONL file,
+    ordered by conversation_ids so the result does not depend on completion order.
+    Only one conversation is held in memory at a time. Returns the merged sink.
+    """
+    locations = {}
+    for sink in sinks:
+        for conversation_id, offset in sink.index().items():
+            locations[conversation_id] = (sink.path, offset)
+
+    handles = {}
+    try:
+        with open(filename, 'wb') as out:
+            for conversation_id in conversation_ids:
+                if conversation_id not in locations:
+                    continue
+                path, offset = locations[conversation_id]
+                if path not in handles:
+                    handles[path] = open(path, 'rb')
+                handles[path].seek(offset)
+                line = handles[path].readline()
+                # The last line of a stream may lack its newline
+                out.write(line if line.endswith(b'\n') else line + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return ConversationSink(filename)
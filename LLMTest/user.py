@@ -52,3 +52,11 @@ You enter conversation mode. In this mode, act as a human conversation partner.
 - Is this response under 25 words?
 </enter_conversation_mode>
 """
+
+# Appended to the persona prompt when the transcript is sent as structured messages (prompt caching mode)
+USER_CACHED_CONVERSATION_INSTRUCTIONS = """
+
+<conversation_format>
+The conversation follows as messages: Lindra's messages are the user turns and your own previous messages are the assistant turns. Your first message comes right after Lindra joins. Always reply with your next message to Lindra's last message, in character.
+</conversation_format>
+"""
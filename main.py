@@ -37,9 +37,9 @@ import os
 import asyncio
 import json
 import argparse
+import multiprocessing
 import time
 import csv
-from dotenv import load_dotenv
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
@@ -48,24 +48,112 @@ from datetime import datetime
 import seaborn as sns
 
 # Import LLM-Test modules
-from LLMTest.llmtestframework import simulate_conversation, save_conversation_to_json, save_all_conversations_to_jsonl, \
-    save_conversation_to_csv
+from LLMTest.llmtestframework import simulate_conversation
+from LLMTest.async_simulation import ConversationSimulator
+from LLMTest.batch_simulation import BatchConversationSimulator
+from LLMTest.checkpoint import GenerationJournal
+from LLMTest.output_sink import ConversationIndex, ConversationSink, merge_sinks
+from LLMTest.conversation_tree import grow_conversation_tree, append_tree_to_jsonl
 from LLMTest.personas import personas
+from LLMTest.adaptive_sampling import AdaptivePersonaScheduler
 from LLMTest.assistant import ASSISTANT_PROMPT
+from Common.rate_limiting import RateLimiter, SharedRateLimits
+from Common.clients import ClientFactory, get_client_factory, set_client_factory
+from Common.accounting import (
+    UsageLedger, BudgetExceededError, accounting_tags, cached_input_ratio, get_ledger, set_ledger
+)
+import Common.cassette as cassette
 
 # Import Classifier modules
 import Classifiers.emoclassifiers.io_utils as io_utils
 import Classifiers.emoclassifiers.classification as classification
 import Classifiers.emoclassifiers.aggregation as aggregation
-
-# Load environment variables
-load_dotenv()
+import Classifiers.emoclassifiers.batch_classification as classification_batch
+from Classifiers.emoclassifiers.calibration import PlattCalibration
+from Classifiers.emoclassifiers.cascade import ChunkCascade, get_cascade, set_cascade
+from Classifiers.emoclassifiers.chunk_priority import CHUNK_ORDERS, ChunkPrior
+from Classifiers.emoclassifiers.online import OnlineTargetMonitor
+from Classifiers.emoclassifiers.work_queue import ClassificationQueue
+from Classifiers.emoclassifiers.result_cache import (
+    ClassificationCache, get_classification_cache, set_classification_cache
+)
 
 # Global settings
 OUTPUT_FOLDER = "conversations_output"  # Directory where all output files will be saved
 NUM_MESSAGES = 6  # Default number of messages in each conversation
 CLASSIFIER_SET = "v1"  # Default classifier set version
 
+# Requests/min and tokens/min budgets per (provider, model), shared by generation and classification.
+# Set these to your account's quota; models not listed here are only retried, not throttled.
+RATE_LIMITS = {
+    ("anthropic", "claude-3-5-sonnet-latest"): (50, 40000),
+    ("openai", "gpt-4o-mini-2024-07-18"): (500, 200000),
+}
+_rate_limiter = None
+
+# Optional record/replay cassette for all API traffic (see Common/cassette.py)
+CASSETTE = None
+
+# Ask all classifiers that share a chunker in one request per chunk (--grouped-classification)
+GROUPED_CLASSIFICATION = False
+
+# Classifiers that label a whole conversation in one request instead of one per chunk
+# ("all" or a list of names, --single-call-classifiers)
+SINGLE_CALL_CLASSIFIERS = None
+
+# Stop classifying a conversation once the "any" aggregate is decided (--short-circuit),
+# trying chunks in the order given by CHUNK_PRIOR (--chunk-order)
+SHORT_CIRCUIT = False
+CHUNK_PRIOR = None
+
+# Classify chunks with a single-token answer and keep P(yes) from its logprobs (--logprobs),
+# optionally calibrated (--logprob-calibration); conversations also get a noisy-OR score
+LOGPROBS = False
+LOGPROB_CALIBRATION = None
+
+# Layout of the per-chunk classifier prompts (--prompt-layout, see classification.PROMPT_LAYOUTS);
+# "prefix_stable" puts the shared instructions and the definitions of the whole classifier set first, so
+# that provider-side prompt caching (from 1024 tokens for OpenAI) can reuse them
+PROMPT_LAYOUT = "default"
+
+
+def get_rate_limiter():
+    """Return the rate limiter shared by all API calls of this run"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(RATE_LIMITS)
+    return _rate_limiter
+
+
+def report_usage():
+    """
+    Print the token, cost and latency totals of this run and save them to the output folder
+
+    Returns:
+        Path of the usage summary file, or None if no API calls were made
+    """
+    ledger = get_ledger()
+    if ledger.totals["calls"] == 0:
+        return None
+    totals = ledger.totals
+    print(f"API usage: {totals['calls']} calls, {ledger.total_tokens()} tokens "
+          f"({totals['input_tokens']} input, {totals['cached_input_tokens']} cached, "
+          f"{totals['cache_write_tokens']} cache-write, {totals['output_tokens']} output), "
+          f"${totals['cost']:.4f}, {totals['retries']} retries")
+    ratios = {stage: cached_input_ratio(group) for stage, group in ledger.by_tag["stage"].items()}
+    ratios = {stage: ratio for stage, ratio in ratios.items() if ratio is not None}
+    if ratios:
+        print("  Cached input tokens: " + ", ".join(f"{stage} {ratio:.0%}" for stage, ratio in ratios.items()))
+    for tag in ["stage", "classifier", "persona"]:
+        groups = sorted(ledger.by_tag[tag].items(), key=lambda item: item[1]["cost"], reverse=True)
+        if groups:
+            print(f"  By {tag}: " + ", ".join(f"{name} ${group['cost']:.4f} ({group['calls']} calls)"
+                                               for name, group in groups[:5]))
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    summary_file = ledger.save_summary(os.path.join(OUTPUT_FOLDER, f"usage_summary_{timestamp}.json"))
+    print(f"Usage summary saved to {summary_file}")
+    return summary_file
+
 
 def ensure_output_dir():
     """Create output directory if it doesn't exist"""
@@ -95,13 +183,70 @@ async def analyze_conversation(conversation: List[Dict], model_wrapper, classifi
     return results
 
 
+def select_classifiers(persona, all_classifiers, conversation_source="generated"):
+    """
+    Classifiers to run on a conversation of the given persona
+
+    Generated conversations use only the persona's target classifiers (all classifiers if
+    it has none); Hume conversations use all available classifiers.
+    """
+    if conversation_source == "generated" and persona.get("target_classifiers"):
+        return {name: all_classifiers[name] for name in persona["target_classifiers"]
+                if name in all_classifiers}
+    return all_classifiers
+
+
+def report_classification_savings(model_wrapper, all_classifiers):
+    """Print the classification calls saved by request coalescing and short-circuiting"""
+    if model_wrapper.coalesced_calls:
+        print(f"Coalesced {model_wrapper.coalesced_calls} identical in-flight classification requests")
+    short_circuited = sum(classifier.short_circuited_chunks for classifier in all_classifiers.values())
+    if short_circuited:
+        print(f"Skipped {short_circuited} chunk classifications of already decided conversations")
+    if get_cascade() is not None:
+        report = get_cascade().report()
+        calls_saved = sum(entry["calls_saved"] for entry in report.values())
+        audited = sum(entry["audited"] for entry in report.values())
+        agreed = sum(entry["audit_agreed"] for entry in report.values())
+        print(f"Cascade labeled {calls_saved} chunks locally"
+              f"{f', {agreed}/{audited} audited chunks agreed with the LLM' if audited else ''}")
+
+
+async def classify_with(classifiers_to_use, conversation, aggregator, precomputed=None):
+    """
+    Aggregated result of each classifier on a conversation
+
+    Results in precomputed (e.g. from online classification during generation) are
+    reused instead of classifying again. With GROUPED_CLASSIFICATION, classifiers that
+    share a chunker are asked in one request per chunk; with SHORT_CIRCUIT, a classifier
+    stops as soon as its aggregate can no longer change.
+    """
+    precomputed = precomputed or {}
+    results = {}
+    if GROUPED_CLASSIFICATION:
+        remaining = {name: classifier for name, classifier in classifiers_to_use.items() if name not in precomputed}
+        raw_results = await classification.classify_conversation_grouped(remaining, conversation)
+    for classifier_name, classifier in classifiers_to_use.items():
+        if classifier_name in precomputed:
+            results[classifier_name] = precomputed[classifier_name]
+            continue
+        if GROUPED_CLASSIFICATION:
+            raw_result = raw_results[classifier_name]
+        elif SHORT_CIRCUIT:
+            raw_result = await classifier.classify_conversation_until(conversation, aggregator, CHUNK_PRIOR)
+        else:
+            raw_result = await classifier.classify_conversation(conversation)
+        results[classifier_name] = aggregator.aggregate(raw_result)
+    return results
+
+
 async def run_classifier_analysis(conversations_data: Dict[str, Any], conversation_source="generated"):
     """
     Run classifier analysis on a set of conversations
 
     This function:
     1. Initializes the classifier models
-    2. Analyzes each conversation with appropriate classifiers
+    2. Classifies all conversations with their classifiers through one work queue
     3. Saves the results to a JSON file
 
     Args:
@@ -118,45 +263,54 @@ async def run_classifier_analysis(conversations_data: Dict[str, Any], conversati
     # Initialize model wrapper and load classifiers
     model_wrapper = classification.ModelWrapper(
         model="gpt-4o-mini-2024-07-18",  # Using GPT-4o mini for classification
-        max_concurrent=4  # Limit concurrent API calls
+        openai_client=get_client_factory().openai_async(),
+        rate_limiter=get_rate_limiter(),
+        logprobs=LOGPROBS,
+        calibration=LOGPROB_CALIBRATION,
+        prompt_layout=PROMPT_LAYOUT,
     )
 
     # Load the classifier definitions from the specified set
     all_classifiers = classification.load_classifiers(
         classifier_set=CLASSIFIER_SET,
         model_wrapper=model_wrapper,
+        single_call=SINGLE_CALL_CLASSIFIERS,
     )
 
     # Use the "any" aggregator (returns True if any chunk is classified as Yes)
     aggregator = aggregation.AGGREGATOR_DICT["any"]
+    noisy_or = aggregation.AGGREGATOR_DICT["noisy_or"]
+
+    # Determine which classifiers to use for each conversation. Results already computed during
+    # generation (early stopping, adaptive sweeps) are reused as-is; they come from the same
+    # classifiers and the same "any" aggregation
+    classifiers_by_conv = {}
+    precomputed_by_conv = {}
+    for persona_name, data in conversations_data.items():
+        classifiers_by_conv[persona_name] = select_classifiers(data["persona"], all_classifiers, conversation_source)
+        precomputed_by_conv[persona_name] = (data.get("classification_results") or
+                                             data.get("online_classification", {}).get("classification_results", {}))
+
+    # Classify the whole corpus through one work queue, so the API is never idle between conversations
+    queue = ClassificationQueue(grouped=GROUPED_CLASSIFICATION, aggregator=aggregator if SHORT_CIRCUIT else None,
+                                chunk_prior=CHUNK_PRIOR)
+    raw_results = await queue.run(
+        {persona_name: data["conversation"] for persona_name, data in conversations_data.items()},
+        {persona_name: {name: classifier for name, classifier in classifiers_to_use.items()
+                        if name not in precomputed_by_conv[persona_name]}
+         for persona_name, classifiers_to_use in classifiers_by_conv.items()},
+        tags={persona_name: {"persona": data["persona"].get("name"), "conversation_id": persona_name}
+              for persona_name, data in conversations_data.items()},
+    )
 
-    # Process each conversation
     analysis_results = {}
     for persona_name, data in conversations_data.items():
-        conversation = data["conversation"]
         persona = data["persona"]
-        print(f"Analyzing conversation with {persona_name}...")
-
-        # Determine which classifiers to use based on the conversation source
-        if conversation_source == "generated":
-            # For generated conversations, only use target classifiers if defined
-            if "target_classifiers" in persona and persona["target_classifiers"]:
-                classifier_names = persona["target_classifiers"]
-                classifiers_to_use = {name: all_classifiers[name] for name in classifier_names
-                                      if name in all_classifiers}
-            else:
-                # If no target classifiers defined, use all classifiers
-                classifiers_to_use = all_classifiers
-        else:
-            # For Hume conversations, use all available classifiers
-            classifiers_to_use = all_classifiers
-
-        # Run analysis with selected classifiers
-        results = {}
-        for classifier_name, classifier in classifiers_to_use.items():
-            raw_result = await classifier.classify_conversation(conversation)
-            result = aggregator.aggregate(raw_result)
-            results[classifier_name] = result
+        precomputed = precomputed_by_conv[persona_name]
+        results = {
+            name: precomputed[name] if name in precomputed else aggregator.aggregate(raw_results[persona_name][name])
+            for name in classifiers_by_conv[persona_name]
+        }
 
         # Check if persona has target classifiers defined
         target_validation = evaluate_target_classifiers(persona, results)
@@ -167,8 +321,12 @@ async def run_classifier_analysis(conversations_data: Dict[str, Any], conversati
             "target_validation": target_validation,
             "conversation_source": conversation_source
         }
+        if LOGPROBS:
+            analysis_results[persona_name]["classification_scores"] = {
+                name: noisy_or.aggregate(raw_result) for name, raw_result in raw_results[persona_name].items()
+            }
 
-        print(analysis_results)
+    print(analysis_results)
 
     # Save results with timestamp to avoid overwriting
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -177,6 +335,7 @@ async def run_classifier_analysis(conversations_data: Dict[str, Any], conversati
         json.dump(analysis_results, f, indent=2)
 
     print(f"Classification results saved to {results_file}")
+    report_classification_savings(model_wrapper, all_classifiers)
     return analysis_results
 
 
@@ -199,171 +358,50 @@ async def run_classifier_analysis_with_rate_limits(conversations_data: Dict[str,
     Returns:
         Dictionary of analysis results by conversation ID
     """
-    import time
-    import random
-    import asyncio
-    from datetime import datetime
-    import os
-    import json
-
     print(f"Running classifier analysis for {conversation_source} conversations with rate limiting...")
 
-    # Create a RateLimitManager
-    class RateLimitManager:
-        def __init__(self, max_retries=8, base_delay=1.0, max_delay=60.0):
-            self.max_retries = max_retries
-            self.base_delay = base_delay
-            self.max_delay = max_delay
-            self.last_request_time = 0
-            self.request_count = 0
-
-        async def execute(self, func, *args, **kwargs):
-            retries = 0
-            while True:
-                try:
-                    return await func(*args, **kwargs)
-                except Exception as e:
-                    # Check if this is a rate limit error
-                    is_rate_limit = False
-                    retry_after = None
-
-                    # Check for OpenAI rate limit error
-                    error_name = e.__class__.__name__
-                    if error_name == "RateLimitError" or "rate_limit" in str(e).lower():
-                        is_rate_limit = True
-
-                        # Try to extract retry time
-                        import re
-                        match = re.search(r"try again in (\d+)ms", str(e).lower())
-                        if match:
-                            retry_after = int(match.group(1)) / 1000.0  # Convert ms to seconds
-
-                    # If not a rate limit error, re-raise
-                    if not is_rate_limit:
-                        raise
-
-                    # If max retries reached, raise
-                    if retries >= self.max_retries:
-                        print(f"Max retries ({self.max_retries}) exceeded. Rate limit error: {e}")
-                        raise
-
-                    # Calculate backoff time
-                    if retry_after is not None:
-                        backoff = retry_after + random.uniform(0.1, 1.0)  # Add jitter
-                    else:
-                        # Exponential backoff with jitter
-                        backoff = min(self.max_delay, self.base_delay * (2 ** retries))
-                        backoff += random.uniform(0, backoff / 2)  # Add jitter
-
-                    retries += 1
-                    print(
-                        f"Rate limit hit. Retrying in {backoff:.2f} seconds... (Attempt {retries}/{self.max_retries})")
-                    await asyncio.sleep(backoff)
-
-    # Initialize model wrapper and load classifiers
+    # Initialize model wrapper and load classifiers. Requests go through the shared
+    # rate limiter, which throttles to the RPM/TPM budget and retries 429s.
     model_wrapper = classification.ModelWrapper(
         model="gpt-4o-mini-2024-07-18",  # Using GPT-4o mini for classification
-        max_concurrent=5  # Reduced from 4 to be more conservative
+        openai_client=get_client_factory().openai_async(),
+        rate_limiter=get_rate_limiter(),
+        logprobs=LOGPROBS,
+        calibration=LOGPROB_CALIBRATION,
+        prompt_layout=PROMPT_LAYOUT,
     )
 
     # model="gpt-4.1-mini",
     # model = "gpt-4o-mini-2024-07-18",  # Using GPT-4o mini for classification
 
-    # Create a rate limiter
-    rate_limiter = RateLimitManager()
-
-    # Add rate limiting to the model wrapper
-    original_classify = model_wrapper.classify_conversation_chunk
-
-    async def rate_limited_classify(*args, **kwargs):
-        return await rate_limiter.execute(original_classify, *args, **kwargs)
-
-    # Patch the method with our rate-limited version
-    model_wrapper.classify_conversation_chunk = rate_limited_classify
-
     # Load the classifier definitions from the specified set
     all_classifiers = classification.load_classifiers(
         classifier_set=CLASSIFIER_SET,
         model_wrapper=model_wrapper,
+        single_call=SINGLE_CALL_CLASSIFIERS,
     )
 
     # Use the "any" aggregator (returns True if any chunk is classified as Yes)
     aggregator = aggregation.AGGREGATOR_DICT["any"]
+    noisy_or = aggregation.AGGREGATOR_DICT["noisy_or"]
+
+    # Determine which classifiers to use for each conversation
+    classifiers_by_conv = {conv_id: select_classifiers(data["persona"], all_classifiers, conversation_source)
+                           for conv_id, data in conversations_data.items()}
 
-    # Process each conversation with rate limiting
     analysis_results = {}
     processed_count = 0
     total_count = len(conversations_data)
     start_time = time.time()
 
-    for conv_id, data in conversations_data.items():
-        conversation = data["conversation"]
+    def conversation_done(conv_id, raw_results):
+        nonlocal processed_count
+        data = conversations_data[conv_id]
         persona = data["persona"]
-
-        # Calculate progress and ETA
         processed_count += 1
-        elapsed_time = time.time() - start_time
-        avg_time_per_item = elapsed_time / processed_count if processed_count > 0 else 0
-        remaining_items = total_count - processed_count
-        eta_seconds = avg_time_per_item * remaining_items
 
-        # Format ETA as minutes and seconds
-        eta_minutes = int(eta_seconds // 60)
-        eta_seconds_remainder = int(eta_seconds % 60)
-
-        print(
-            f"Analyzing conversation {processed_count}/{total_count} with ID '{conv_id}'... (ETA: {eta_minutes}m {eta_seconds_remainder}s)")
-
-        # Determine which classifiers to use based on the conversation source
-        if conversation_source == "generated":
-            # For generated conversations, only use target classifiers if defined
-            if "target_classifiers" in persona and persona["target_classifiers"]:
-                classifier_names = persona["target_classifiers"]
-                classifiers_to_use = {name: all_classifiers[name] for name in classifier_names
-                                      if name in all_classifiers}
-            else:
-                # If no target classifiers defined, use all classifiers
-                classifiers_to_use = all_classifiers
-        else:
-            # For Hume conversations, use all available classifiers
-            classifiers_to_use = all_classifiers
-
-        print(all_classifiers)
-
-        # Run analysis with selected classifiers, with rate limiting
-        results = {}
-
-        # Process classifiers with rate limiting
-        classifier_tasks = []
-
-        # Create a semaphore to limit concurrent classifier tasks
-        # This adds an additional limit to prevent rate limit issues
-        sem = asyncio.Semaphore(2)  # Allow at most 2 concurrent classifier tasks
-
-        for classifier_name, classifier in classifiers_to_use.items():
-            # Add a rate-limited wrapper for classify_conversation
-            async def process_classifier(name, cls):
-                async with sem:  # Acquire semaphore to limit concurrency
-                    try:
-                        # Add small random delay between classifier calls to avoid burst requests
-                        await asyncio.sleep(random.uniform(0.5, 1.5))
-                        raw_result = await cls.classify_conversation(conversation)
-                        result = aggregator.aggregate(raw_result)
-                        return name, result
-                    except Exception as e:
-                        print(f"Error processing classifier {name}: {e}")
-                        return name, None
-
-            # Add task to the list
-            classifier_tasks.append(process_classifier(classifier_name, classifier))
-
-        # Wait for all classifiers to complete
-        classifier_results = await asyncio.gather(*classifier_tasks)
-
-        # Process results
-        for name, result in classifier_results:
-            if result is not None:
-                results[name] = result
+        # Classifiers that failed are missing from raw_results
+        results = {name: aggregator.aggregate(raw_result) for name, raw_result in raw_results.items()}
 
         # Check if persona has target classifiers defined
         target_validation = evaluate_target_classifiers(persona, results)
@@ -375,11 +413,22 @@ async def run_classifier_analysis_with_rate_limits(conversations_data: Dict[str,
             "target_validation": target_validation,
             "conversation_source": conversation_source
         }
+        if LOGPROBS:
+            # Graded counterpart of the "any" result: P(at least one chunk is YES)
+            analysis_results[conv_id]["classification_scores"] = {
+                name: noisy_or.aggregate(raw_result) for name, raw_result in raw_results.items()
+            }
 
         if "chat_id" in data:
             analysis_results[conv_id]["chat_id"] = data["chat_id"]
 
-        print(analysis_results)
+        # Calculate progress and ETA
+        elapsed_time = time.time() - start_time
+        avg_time_per_item = elapsed_time / processed_count
+        eta_seconds = avg_time_per_item * (total_count - processed_count)
+        print(f"Analyzed conversation {processed_count}/{total_count} with ID '{conv_id}' "
+              f"(ETA: {int(eta_seconds // 60)}m {int(eta_seconds % 60)}s, concurrency limit "
+              f"{model_wrapper.concurrency.limit}, {model_wrapper.concurrency.queue_depth} queued)")
 
         # Save intermediate results after every 5 conversations
         if processed_count % 5 == 0 or processed_count == total_count:
@@ -391,6 +440,20 @@ async def run_classifier_analysis_with_rate_limits(conversations_data: Dict[str,
                 json.dump(analysis_results, f, indent=2)
             print(f"Saved intermediate results after {processed_count}/{total_count} conversations")
 
+    # All (conversation, classifier, chunk) tasks go through one work queue, so throughput is
+    # bounded by the adaptive concurrency limit of the shared rate limiter rather than by the
+    # conversations; a failing classifier is left out of its conversation's results
+    queue = ClassificationQueue(grouped=GROUPED_CLASSIFICATION, aggregator=aggregator if SHORT_CIRCUIT else None,
+                                chunk_prior=CHUNK_PRIOR, raise_errors=False, on_conversation_done=conversation_done)
+    await queue.run(
+        {conv_id: data["conversation"] for conv_id, data in conversations_data.items()},
+        classifiers_by_conv,
+        tags={conv_id: {"persona": data["persona"].get("name"), "conversation_id": conv_id}
+              for conv_id, data in conversations_data.items()},
+    )
+    # Keep the order of the input file
+    analysis_results = {conv_id: analysis_results[conv_id] for conv_id in conversations_data}
+
     # Save final results with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     results_file = os.path.join(OUTPUT_FOLDER, f"classification_results_{conversation_source}_{timestamp}.json")
@@ -398,6 +461,7 @@ async def run_classifier_analysis_with_rate_limits(conversations_data: Dict[str,
         json.dump(analysis_results, f, indent=2)
 
     print(f"Classification results saved to {results_file}")
+    report_classification_savings(model_wrapper, all_classifiers)
 
     # Calculate and display statistics
     total_time = time.time() - start_time
@@ -407,6 +471,75 @@ async def run_classifier_analysis_with_rate_limits(conversations_data: Dict[str,
 
     return analysis_results
 
+async def run_classifier_analysis_batch(conversations_data: Dict[str, Any], conversation_source="generated",
+                                        batch_base_url=None, poll_interval=30):
+    """
+    Run classifier analysis on a set of conversations through the OpenAI Batch API
+
+    Every (conversation, classifier, chunk) task is written to a request JSONL file and
+    submitted as batch jobs (see Classifiers/emoclassifiers/batch_classification.py);
+    the results are joined back by custom_id and aggregated as in the other analyses.
+    Suited to corpus-scale files: no hand-splitting to stay under the rate limits, and
+    batch pricing.
+
+    Args:
+        conversations_data: Dictionary of conversations with persona information
+        conversation_source: Source of conversations - "generated" or "hume"
+        batch_base_url: Optional API base URL, e.g. a local stand-in batch server
+        poll_interval: Seconds between batch status checks
+
+    Returns:
+        Dictionary of analysis results by conversation ID
+    """
+    print(f"Running batch classifier analysis for {conversation_source} conversations...")
+    start_time = time.time()
+
+    all_classifiers = classification.load_classifiers(
+        classifier_set=CLASSIFIER_SET,
+        model_wrapper=classification.ModelWrapper(model="gpt-4o-mini-2024-07-18",
+                                                  openai_client=get_client_factory().openai_async(),
+                                                  prompt_layout=PROMPT_LAYOUT),
+    )
+    aggregator = aggregation.AGGREGATOR_DICT["any"]
+    batch_classifier = classification_batch.BatchClassifier(
+        openai_client=get_client_factory().openai_async(f"{batch_base_url.rstrip('/')}/v1" if batch_base_url else None),
+        model="gpt-4o-mini-2024-07-18",
+        poll_interval=poll_interval,
+        output_folder=OUTPUT_FOLDER,
+        prompt_layout=PROMPT_LAYOUT,
+    )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    raw_results = await batch_classifier.classify_conversations(
+        {conv_id: data["conversation"] for conv_id, data in conversations_data.items()},
+        {conv_id: select_classifiers(data["persona"], all_classifiers, conversation_source)
+         for conv_id, data in conversations_data.items()},
+        name=f"classification_batch_{conversation_source}_{timestamp}",
+    )
+
+    analysis_results = {}
+    for conv_id, data in conversations_data.items():
+        persona = data["persona"]
+        results = {name: aggregator.aggregate(raw_result) for name, raw_result in raw_results[conv_id].items()}
+        analysis_results[conv_id] = {
+            "persona": persona,
+            "classification_results": results,
+            "target_validation": evaluate_target_classifiers(persona, results),
+            "conversation_source": conversation_source
+        }
+        if "chat_id" in data:
+            analysis_results[conv_id]["chat_id"] = data["chat_id"]
+
+    results_file = os.path.join(OUTPUT_FOLDER, f"classification_results_{conversation_source}_{timestamp}.json")
+    with open(results_file, 'w', encoding='utf-8') as f:
+        json.dump(analysis_results, f, indent=2)
+
+    print(f"Classification results saved to {results_file}")
+    print(f"Batch analysis of {len(analysis_results)} conversations completed in {time.time() - start_time:.2f} "
+          f"seconds ({batch_classifier.batches_submitted} batch jobs)")
+    return analysis_results
+
+
 def evaluate_target_classifiers(persona, classifier_results):
     """
     Evaluate if a conversation meets all target classifiers for a persona
@@ -511,18 +644,58 @@ def convert_json_to_csv(json_file_path, output_folder=None):
     return csv_path
 
 
-def generate_conversations(conversations_per_persona=3):
+def export_conversations(sink, export_formats=("json", "csv"), combined_name=None):
+    """
+    Produce the requested output formats from a conversation stream
+
+    Args:
+        sink: ConversationSink holding the finished conversations
+        export_formats: Any of "json" and "csv" (one file per conversation in the output
+                        folder) and "combined_csv" (one CSV with a row per message)
+        combined_name: Path of the combined JSONL file the combined CSV is named after
+                       (defaults to the sink's own file)
+    """
+    for export_format in export_formats:
+        if export_format == "json":
+            filenames = sink.export_json(OUTPUT_FOLDER)
+            print(f"Saved {len(filenames)} conversations as JSON to {OUTPUT_FOLDER}")
+        elif export_format == "csv":
+            filenames = sink.export_csv(OUTPUT_FOLDER)
+            print(f"Saved {len(filenames)} conversations as CSV to {OUTPUT_FOLDER}")
+        elif export_format == "combined_csv":
+            filename = sink.export_combined_csv(os.path.splitext(combined_name or sink.path)[0] + ".csv")
+            print(f"All conversations saved to {filename}")
+        else:
+            print(f"Unknown export format: {export_format}")
+
+
+def load_conversations(sink, conversation_ids=None):
+    """
+    The conversations of a stream keyed by persona_conv_id, optionally in the order of conversation_ids
+
+    Returns a read-only mapping that keeps only file offsets in memory and reads each
+    conversation from the stream when it is accessed (see ConversationIndex). Note that
+    run_classifier_analysis still hands every conversation to the classification queue
+    at once, so analysing a run needs memory for all of its conversations.
+    """
+    return ConversationIndex(sink, key="persona_conv_id", order=conversation_ids)
+
+
+def generate_conversations(conversations_per_persona=3, export_formats=("json", "csv")):
     """
     Generate conversations between Lindra and all defined personas
 
     This function:
     1. Creates multiple simulated conversations for each persona in the personas list
-    2. Saves individual conversations as JSON files
-    3. Saves individual conversations as CSV files
-    4. Creates a combined JSONL file with all conversations
+    2. Appends each conversation to a combined JSONL file as soon as it is finished
+    3. Exports individual conversations (JSON and CSV files by default) from that file
+
+    This is the sequential library path: it is not journaled and cannot be resumed.
+    The --generate CLI uses generate_conversations_async instead (see --resume).
 
     Args:
         conversations_per_persona: Number of conversations to generate for each persona
+        export_formats: Formats to produce from the combined JSONL file (see export_conversations)
 
     Usage:
         # Generate conversations with default settings (3 per persona)
@@ -540,7 +713,10 @@ def generate_conversations(conversations_per_persona=3):
     print(f"Generating {conversations_per_persona} conversations per persona...")
     ensure_output_dir()
 
-    all_conversations = {}
+    all_conversations_file = os.path.join(OUTPUT_FOLDER,
+                                          f"all_conversations_{conversations_per_persona}_per_persona.jsonl")
+    sink = ConversationSink(all_conversations_file)
+    sink.clear()
 
     # Simulate conversations for each persona
     for i, persona in enumerate(personas):
@@ -551,57 +727,591 @@ def generate_conversations(conversations_per_persona=3):
         for conv_num in range(1, conversations_per_persona + 1):
             print(f"  Generating conversation {conv_num}/{conversations_per_persona}...")
 
-            # Generate conversation
-            conversation = simulate_conversation(persona, NUM_MESSAGES, ASSISTANT_PROMPT)
-
             # Create unique identifier for this persona-conversation
             persona_conv_id = f"{persona['name']}_{conv_num}"
 
-            # Create filename base with unique identifier
-            filename_base = f"{persona['name']}_{persona['specific_focus'].replace(' ', '_')}_{conv_num}"
-
-            # Save individual conversation to JSON
-            json_filename = os.path.join(OUTPUT_FOLDER, f"{filename_base}.json")
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "persona": persona,
-                    "conversation": conversation,
-                    "conversation_number": conv_num
-                }, f)
-            print(f"    Saved to {json_filename}")
-
-            # Save individual conversation to CSV
-            csv_filename = os.path.join(OUTPUT_FOLDER, f"{filename_base}.csv")
-            with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['turn', 'role', 'content']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                writer.writeheader()
-                for j, message in enumerate(conversation):
-                    writer.writerow({
-                        'turn': j + 1,
-                        'role': message['role'],
-                        'content': message['content']
-                    })
-            print(f"    Saved to CSV: {csv_filename}")
-
-            # Add to all conversations dictionary
-            all_conversations[persona_conv_id] = {
+            # Generate conversation
+            with accounting_tags(persona=persona['name'], conversation_id=persona_conv_id):
+                conversation = simulate_conversation(persona, NUM_MESSAGES, ASSISTANT_PROMPT)
+
+            # Append to the combined JSONL file
+            sink.append({
+                "conversation_id": persona_conv_id,
+                "persona_conv_id": persona_conv_id,
                 "persona": persona,
                 "conversation": conversation,
                 "conversation_number": conv_num
-            }
+            })
 
             # Add a small delay between conversations
             time.sleep(1)
 
-    # Save all conversations to JSONL file
+    print(f"All conversations saved to {all_conversations_file}")
+    export_conversations(sink, export_formats)
+
+    return load_conversations(sink)
+
+
+def make_target_stop_condition(min_turns=2):
+    """
+    Build the early-stopping condition used by generate_conversations_async
+
+    From turn min_turns on, every new exchange is classified right after Lindra's response
+    with the persona's target classifiers, using their usual chunkers and the "any"
+    aggregator. Only chunks that are new since the previous exchange are sent to the
+    model, and a target is no longer checked once it has been detected. The conversation
+    stops as soon as all targets PASS; NUM_MESSAGES remains the maximum number of turns.
+    Personas with no (or unknown) target classifiers always run to the maximum.
+
+    Args:
+        min_turns: Minimum number of assistant messages before a conversation may stop
+
+    Returns:
+        The async stop condition and the dictionary of OnlineTargetMonitor by persona_conv_id
+    """
+    model_wrapper = classification.ModelWrapper(
+        model="gpt-4o-mini-2024-07-18",
+        openai_client=get_client_factory().openai_async(),
+        rate_limiter=get_rate_limiter(),
+        prompt_layout=PROMPT_LAYOUT,
+    )
+    all_classifiers = classification.load_classifiers(
+        classifier_set=CLASSIFIER_SET,
+        model_wrapper=model_wrapper,
+    )
+    monitors = {}
+
+    async def stop_condition(persona_conv_id, persona, conversation):
+        if len(conversation) // 2 < min_turns:
+            return False
+        target_classifiers = persona.get("target_classifiers") or []
+        if not target_classifiers or any(name not in all_classifiers for name in target_classifiers):
+            return False
+        if persona_conv_id not in monitors:
+            monitors[persona_conv_id] = OnlineTargetMonitor(
+                {name: all_classifiers[name] for name in target_classifiers},
+                aggregation.AGGREGATOR_DICT["any"]
+            )
+        monitor = monitors[persona_conv_id]
+        await monitor.update(conversation)
+        return monitor.all_detected()
+
+    return stop_condition, monitors
+
+
+def generation_jobs(conversations_per_persona):
+    """
+    One job per (persona, conversation number) pair, in a fixed order
+
+    Returns:
+        List of (persona_conv_id, persona) pairs and a dictionary of conversation numbers by persona_conv_id
+    """
+    all_jobs = []
+    conversation_numbers = {}
+    for persona in personas:
+        for conv_num in range(1, conversations_per_persona + 1):
+            persona_conv_id = f"{persona['name']}_{conv_num}"
+            all_jobs.append((persona_conv_id, persona))
+            conversation_numbers[persona_conv_id] = conv_num
+    return all_jobs, conversation_numbers
+
+
+def generation_journal_name(conversations_per_persona, shard_index=0, num_shards=1):
+    """Name of the journal of a generation run, or of one shard of a multi-process run"""
+    name = f"generation_{conversations_per_persona}_per_persona"
+    if num_shards > 1:
+        name += f"_shard{shard_index + 1}of{num_shards}"
+    return name
+
+
+async def generate_conversations_async(conversations_per_persona=3, max_concurrent=8, prompt_caching=False,
+                                       resume=False, batch=False, batch_base_url=None, batch_poll_interval=30,
+                                       stream_metrics=False, export_formats=("json", "csv"),
+                                       early_stopping=False, min_turns=2, shard_index=0, num_shards=1):
+    """
+    Generate conversations between Lindra and all defined personas concurrently
+
+    Same outputs as generate_conversations, but every (persona, conversation) pair is
+    simulated in parallel on the async Anthropic client. Only the turn order inside
+    each conversation is sequential.
+
+    Each finished conversation is appended to a journal right away (and dropped from
+    memory), and conversations in progress are checkpointed after every turn. With
+    resume=True, conversations already in the journal are skipped and partial ones
+    continue from their last turn. The combined JSONL file and the other formats are
+    produced from the journal at the end.
+
+    Args:
+        conversations_per_persona: Number of conversations to generate for each persona
+        max_concurrent: Maximum number of conversations simulated at the same time
+        prompt_caching: Send the system prompt and persona description as cacheable prefix
+                        blocks and report cache-read/cache-write token counts
+        resume: Continue the previous run with the same conversations_per_persona
+        batch: Advance all conversations one turn at a time through the Message Batches API
+               (one batch job per turn and role) instead of concurrent individual calls
+        batch_base_url: Optional API base URL for batch mode, e.g. a local stand-in server
+        batch_poll_interval: Seconds between batch status checks
+        stream_metrics: Stream Lindra's responses and store time-to-first-token, total latency,
+                        output tokens/sec and stop reason with every assistant message
+        export_formats: Formats to produce from the journal (see export_conversations)
+        early_stopping: Classify every new exchange with the persona's target classifiers and end
+                        the conversation once all of them PASS (see make_target_stop_condition);
+                        the results are stored with the conversation and reused by the analysis
+        min_turns: Minimum number of assistant messages before a conversation may stop early
+        shard_index: Index of this shard in a multi-process run (see generate_conversations_parallel)
+        num_shards: Number of shards; with more than one, only every num_shards-th job starting at
+                    shard_index is generated, and the combined outputs are left to the parent process
+
+    Returns:
+        Dictionary containing all generated conversations, keyed by persona_conv_id
+        (None for one shard of a multi-process run)
+    """
+    shard_label = f"[shard {shard_index + 1}/{num_shards}] " if num_shards > 1 else ""
+    print(f"{shard_label}Generating {conversations_per_persona} conversations per persona "
+          f"({max_concurrent} concurrent)...")
+    ensure_output_dir()
+
+    journal = GenerationJournal(OUTPUT_FOLDER,
+                                generation_journal_name(conversations_per_persona, shard_index, num_shards))
+    if resume:
+        completed = journal.open_for_resume()
+        print(f"Resuming: {len(completed)} conversations already completed")
+    else:
+        journal.reset()
+        completed = set()
+
+    if batch:
+        simulator = BatchConversationSimulator(
+            client=get_client_factory().anthropic_async(batch_base_url),
+            poll_interval=batch_poll_interval,
+            prompt_caching=prompt_caching
+        )
+    else:
+        simulator = ConversationSimulator(
+            client=get_client_factory().anthropic_async(),
+            max_concurrent=max_concurrent,
+            rate_limiter=get_rate_limiter(),
+            prompt_caching=prompt_caching,
+            stream_metrics=stream_metrics
+        )
+
+    # One job per (persona, conversation number) pair; a shard takes a disjoint slice of them
+    all_jobs, conversation_numbers = generation_jobs(conversations_per_persona)
+    all_jobs = all_jobs[shard_index::num_shards]
+
+    # Skip finished conversations and pick up partial ones from their checkpoints
+    jobs = [(persona_conv_id, persona) for persona_conv_id, persona in all_jobs
+            if persona_conv_id not in completed]
+    resume_from = {}
+    if resume:
+        for persona_conv_id, _ in jobs:
+            partial = journal.load_checkpoint(persona_conv_id)
+            if partial:
+                resume_from[persona_conv_id] = partial
+        if resume_from:
+            print(f"Resuming: continuing {len(resume_from)} partial conversations")
+
+    def on_turn(persona_conv_id, conversation):
+        journal.save_checkpoint(persona_conv_id, conversation)
+
+    stop_condition, monitors = make_target_stop_condition(min_turns) if early_stopping else (None, {})
+    early_stopping_stats = {"stopped_early": 0, "turns": 0, "classified_chunks": 0}
+
+    def on_complete(persona_conv_id, persona, conversation):
+        print(f"  Completed {persona_conv_id}")
+        record = {
+            "persona": persona,
+            "conversation": conversation,
+            "conversation_number": conversation_numbers[persona_conv_id]
+        }
+        monitor = monitors.pop(persona_conv_id, None)
+        if monitor is not None:
+            stopped_early = len(conversation) < 2 * NUM_MESSAGES
+            record["online_classification"] = {
+                "turns": len(conversation) // 2,
+                "stopped_early": stopped_early,
+                "classified_chunks": monitor.num_classified_chunks,
+                "classification_results": monitor.results()
+            }
+            early_stopping_stats["stopped_early"] += stopped_early
+            early_stopping_stats["classified_chunks"] += monitor.num_classified_chunks
+        early_stopping_stats["turns"] += len(conversation) // 2
+        journal.append(persona_conv_id, record)
+
+    start_time = time.time()
+    await simulator.simulate_conversations(
+        jobs, NUM_MESSAGES, ASSISTANT_PROMPT,
+        on_complete=on_complete, on_turn=on_turn, resume_from=resume_from, keep_results=False,
+        stop_condition=stop_condition
+    )
+    print(f"{shard_label}Generated {len(jobs)} conversations in {time.time() - start_time:.2f} seconds")
+    if early_stopping and jobs:
+        print(f"  {shard_label}Early stopping: {early_stopping_stats['stopped_early']}/{len(jobs)} conversations "
+              f"stopped before {NUM_MESSAGES} turns, {early_stopping_stats['turns']}/{len(jobs) * NUM_MESSAGES} "
+              f"turns generated, {early_stopping_stats['classified_chunks']} chunks classified online")
+
+    # Report token usage, including prompt cache reads and writes
+    for stage, usage in simulator.cache_report().items():
+        print(f"  {shard_label}{stage}: {usage['requests']} requests, {usage['input_tokens']} uncached input tokens, "
+              f"{usage['cache_read_input_tokens']} cache-read, {usage['cache_creation_input_tokens']} cache-write, "
+              f"{usage['output_tokens']} output tokens (cache hit ratio {usage['cache_hit_ratio']:.1%})")
+
+    # Report Lindra's per-turn latency for this prompt version
+    latency = simulator.latency_report()
+    if latency:
+        print(f"  Lindra latency over {latency['turns']} turns: "
+              f"TTFT mean {latency['time_to_first_token']['mean']:.2f}s / p95 {latency['time_to_first_token']['p95']:.2f}s, "
+              f"total mean {latency['total_latency']['mean']:.2f}s / p95 {latency['total_latency']['p95']:.2f}s, "
+              f"{latency['output_tokens_per_second'] or 0:.1f} output tokens/s")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        shard_suffix = f"_shard{shard_index + 1}of{num_shards}" if num_shards > 1 else ""
+        latency_file = os.path.join(OUTPUT_FOLDER, f"latency_report_{timestamp}{shard_suffix}.json")
+        with open(latency_file, 'w', encoding='utf-8') as f:
+            json.dump(latency, f, indent=2)
+        print(f"  Latency report saved to {latency_file}")
+
+    if num_shards > 1:
+        return None
+
+    # Combined JSONL file and the other formats, streamed from the journal
     all_conversations_file = os.path.join(OUTPUT_FOLDER,
                                           f"all_conversations_{conversations_per_persona}_per_persona.jsonl")
-    save_all_conversations_to_jsonl(all_conversations, all_conversations_file)
+    journal.sink.export_jsonl(all_conversations_file)
     print(f"All conversations saved to {all_conversations_file}")
+    export_conversations(journal.sink, export_formats, all_conversations_file)
 
-    return all_conversations
+    return load_conversations(journal.sink, [persona_conv_id for persona_conv_id, _ in all_jobs])
+
+
+def run_generation_shard(shard_index, num_shards, conversations_per_persona, options, shared_limits,
+                         settings, cassette_path=None):
+    """
+    Entry point of one worker process of generate_conversations_parallel
+
+    Module globals (settings: num_messages, output_folder, classifier_set, prompt_layout, classification_cache,
+    cascade) are set
+    explicitly because worker processes start with a fresh interpreter. All workers
+    draw from the same cross-process rate budget; each one records its calls in its own
+    usage ledger (settings["ledger"]), which the parent process merges.
+    """
+    global NUM_MESSAGES, OUTPUT_FOLDER, CLASSIFIER_SET, PROMPT_LAYOUT, _rate_limiter
+    NUM_MESSAGES = settings["num_messages"]
+    OUTPUT_FOLDER = settings["output_folder"]
+    CLASSIFIER_SET = settings["classifier_set"]
+    PROMPT_LAYOUT = settings["prompt_layout"]
+    if settings["classification_cache"] is not None:
+        set_classification_cache(ClassificationCache(**settings["classification_cache"]))
+    if settings["cascade"] is not None:
+        set_cascade(ChunkCascade.load(**settings["cascade"]))
+    set_ledger(UsageLedger(**settings["ledger"]))
+    _rate_limiter = RateLimiter(RATE_LIMITS, shared_limits=shared_limits)
+    if cassette_path:
+        set_client_factory(ClientFactory(cassette=cassette.Cassette(cassette_path, mode=cassette.REPLAY)))
+    try:
+        asyncio.run(generate_conversations_async(
+            conversations_per_persona, shard_index=shard_index, num_shards=num_shards, **options
+        ))
+    finally:
+        # Write the classification results the cache still buffers
+        if get_classification_cache() is not None:
+            get_classification_cache().close()
+
+
+def generate_conversations_parallel(conversations_per_persona=3, workers=2, max_concurrent=8, prompt_caching=False,
+                                    resume=False, stream_metrics=False, export_formats=("json", "csv"),
+                                    early_stopping=False, min_turns=2):
+    """
+    Generate conversations in several worker processes
+
+    Each worker takes a disjoint shard of the (persona, conversation number) pairs and runs
+    generate_conversations_async on it with its own journal, so shards resume independently.
+    All workers share one RPM/TPM budget (RATE_LIMITS) through shared memory, and each gets
+    an equal share of the run's token/dollar budget (cancelling on overrun). Once they
+    finish, the shard journals are merged into the combined JSONL file in the same fixed
+    order as a single-process run, and the other formats are produced from it.
+
+    Args:
+        conversations_per_persona: Number of conversations to generate for each persona
+        workers: Number of worker processes
+        max_concurrent: Maximum number of conversations simulated at the same time per worker
+        prompt_caching, resume, stream_metrics, early_stopping, min_turns: As for generate_conversations_async
+        export_formats: Formats to produce from the merged JSONL file (see export_conversations)
+
+    Returns:
+        Dictionary containing all generated conversations, keyed by persona_conv_id
+    """
+    if CASSETTE is not None and CASSETTE.mode != cassette.REPLAY:
+        raise ValueError("Recording a cassette is only supported with a single worker")
+    print(f"Generating {conversations_per_persona} conversations per persona in {workers} worker processes...")
+    ensure_output_dir()
+
+    # Workers start with a fresh interpreter rather than a fork of the running event loop
+    context = multiprocessing.get_context("spawn")
+    shared_limits = SharedRateLimits(RATE_LIMITS, context=context)
+    options = {"max_concurrent": max_concurrent, "prompt_caching": prompt_caching, "resume": resume,
+               "stream_metrics": stream_metrics, "export_formats": (),
+               "early_stopping": early_stopping, "min_turns": min_turns}
+    cache = get_classification_cache()
+    settings = {"num_messages": NUM_MESSAGES, "output_folder": OUTPUT_FOLDER, "classifier_set": CLASSIFIER_SET,
+                "prompt_layout": PROMPT_LAYOUT,
+                "classification_cache": {"path": cache.path, "max_entries": cache.max_entries,
+                                         "max_age_days": cache.max_age_days} if cache is not None else None,
+                "cascade": {"path": get_cascade().path, "audit_rate": get_cascade().audit_rate}
+                if get_cascade() is not None else None}
+    # Each worker gets an equal share of the token/dollar budget and its own call log
+    ledger = get_ledger()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ledger_settings = [
+        {
+            "path": os.path.join(OUTPUT_FOLDER, f"usage_calls_{timestamp}_shard{shard_index + 1}of{workers}.jsonl"),
+            "token_budget": ledger.token_budget // workers if ledger.token_budget is not None else None,
+            "cost_budget": ledger.cost_budget / workers if ledger.cost_budget is not None else None,
+            "on_exceeded": "cancel"
+        }
+        for shard_index in range(workers)
+    ]
+    start_time = time.time()
+    processes = [
+        context.Process(
+            target=run_generation_shard,
+            args=(shard_index, workers, conversations_per_persona, options, shared_limits,
+                  {**settings, "ledger": ledger_settings[shard_index]}, CASSETTE.path if CASSETTE is not None else None),
+            name=f"generation-shard-{shard_index + 1}"
+        )
+        for shard_index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    for shard_ledger in ledger_settings:
+        ledger.ingest(shard_ledger["path"])
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Generation workers failed: {', '.join(failed)}; rerun with --resume to continue")
+    print(f"Generated all shards in {time.time() - start_time:.2f} seconds")
+
+    # Merge the shard journals in the fixed job order
+    all_jobs, _ = generation_jobs(conversations_per_persona)
+    shard_sinks = [
+        GenerationJournal(OUTPUT_FOLDER, generation_journal_name(conversations_per_persona, shard_index, workers)).sink
+        for shard_index in range(workers)
+    ]
+    all_conversations_file = os.path.join(OUTPUT_FOLDER,
+                                          f"all_conversations_{conversations_per_persona}_per_persona.jsonl")
+    sink = merge_sinks(shard_sinks, all_conversations_file, [persona_conv_id for persona_conv_id, _ in all_jobs])
+    print(f"All conversations saved to {all_conversations_file}")
+    export_conversations(sink, export_formats)
+
+    return load_conversations(sink)
+
+
+async def generate_conversations_adaptive(precision=0.1, min_per_persona=3, max_per_persona=30, max_concurrent=8,
+                                          prompt_caching=False, stream_metrics=False, export_formats=("json", "csv"),
+                                          early_stopping=False, min_turns=2):
+    """
+    Validation sweep that allocates conversations to personas adaptively
+
+    Rather than a fixed number of conversations per persona, each conversation is
+    classified with the persona's target classifiers as soon as it finishes, and its
+    target validation (evaluate_target_classifiers) updates a Wilson interval on the
+    persona's PASS rate. Every free slot goes to the persona whose interval is widest
+    (see LLMTest/adaptive_sampling.py), and the sweep ends once every persona's interval
+    half-width is at most `precision` or it has max_per_persona conversations. Personas
+    without target classifiers have no PASS rate and are not generated.
+
+    Args:
+        precision: Target half-width of each persona's 95% interval on its PASS rate
+        min_per_persona: Conversations per persona before its interval is trusted
+        max_per_persona: Maximum number of conversations per persona
+        max_concurrent: Maximum number of conversations in flight at the same time
+        prompt_caching: Send static prefixes as cacheable blocks
+        stream_metrics: Record latency metrics for Lindra's turns
+        export_formats: Formats to produce from the combined JSONL file (see export_conversations)
+        early_stopping: Stop conversations once their targets PASS; the online results are reused
+        min_turns: Minimum number of assistant messages before a conversation may stop early
+
+    Returns:
+        Dictionary containing all generated conversations, keyed by persona_conv_id, with
+        their classification results (reused by run_classifier_analysis)
+    """
+    print(f"Adaptive validation sweep: interval half-width {precision}, "
+          f"{min_per_persona}-{max_per_persona} conversations per persona ({max_concurrent} concurrent)...")
+    ensure_output_dir()
+
+    scheduler = AdaptivePersonaScheduler(personas, precision, min_per_persona, max_per_persona)
+    simulator = ConversationSimulator(
+        client=get_client_factory().anthropic_async(),
+        max_concurrent=max_concurrent,
+        rate_limiter=get_rate_limiter(),
+        prompt_caching=prompt_caching,
+        stream_metrics=stream_metrics
+    )
+    model_wrapper = classification.ModelWrapper(
+        model="gpt-4o-mini-2024-07-18",
+        openai_client=get_client_factory().openai_async(),
+        rate_limiter=get_rate_limiter(),
+        prompt_layout=PROMPT_LAYOUT,
+    )
+    all_classifiers = classification.load_classifiers(
+        classifier_set=CLASSIFIER_SET,
+        model_wrapper=model_wrapper,
+        single_call=SINGLE_CALL_CLASSIFIERS,
+    )
+    aggregator = aggregation.AGGREGATOR_DICT["any"]
+    stop_condition, monitors = make_target_stop_condition(min_turns) if early_stopping else (None, {})
+
+    all_conversations_file = os.path.join(OUTPUT_FOLDER, "all_conversations_adaptive.jsonl")
+    sink = ConversationSink(all_conversations_file)
+    sink.clear()
+
+    async def run_one(persona, conv_num):
+        persona_conv_id = f"{persona['name']}_{conv_num}"
+        conversations = await simulator.simulate_conversations(
+            [(persona_conv_id, persona)], NUM_MESSAGES, ASSISTANT_PROMPT, stop_condition=stop_condition
+        )
+        conversation = conversations[persona_conv_id]
+        monitor = monitors.pop(persona_conv_id, None)
+        with accounting_tags(persona=persona["name"], conversation_id=persona_conv_id):
+            results = await classify_with(select_classifiers(persona, all_classifiers), conversation, aggregator,
+                                          monitor.results() if monitor is not None else None)
+        target_validation = evaluate_target_classifiers(persona, results)
+        scheduler.record(persona["name"], target_validation["status"])
+        low, high = scheduler.interval(persona["name"])
+        print(f"  Completed {persona_conv_id}: {target_validation['status']} "
+              f"(PASS rate interval [{low:.2f}, {high:.2f}])")
+        sink.append({
+            "conversation_id": persona_conv_id,
+            "persona_conv_id": persona_conv_id,
+            "persona": persona,
+            "conversation": conversation,
+            "conversation_number": conv_num,
+            "classification_results": results,
+            "target_validation": target_validation
+        })
+
+    # Keep max_concurrent conversations in flight; each free slot goes to the widest interval
+    start_time = time.time()
+    in_flight = {}
+    while True:
+        while len(in_flight) < max_concurrent:
+            job = scheduler.next_persona()
+            if job is None:
+                break
+            persona, conv_num = job
+            in_flight[asyncio.create_task(run_one(persona, conv_num))] = persona["name"]
+        if not in_flight:
+            break
+        finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            name = in_flight.pop(task)
+            if task.exception() is not None:
+                scheduler.cancel(name)
+                for other in in_flight:
+                    other.cancel()
+                raise task.exception()
+    report = scheduler.report()
+    total = sum(entry["conversations"] for entry in report.values())
+    print(f"Generated {total} conversations in {time.time() - start_time:.2f} seconds")
+    for name, entry in report.items():
+        print(f"  {name}: {entry['passes']}/{entry['conversations']} PASS, interval "
+              f"[{entry['interval'][0]:.2f}, {entry['interval'][1]:.2f}]"
+              f"{'' if entry['done'] else ' (maximum reached before the precision target)'}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_file = os.path.join(OUTPUT_FOLDER, f"adaptive_sampling_report_{timestamp}.json")
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump({"precision": precision, "min_per_persona": min_per_persona,
+                   "max_per_persona": max_per_persona, "personas": report}, f, indent=2)
+    print(f"Adaptive sampling report saved to {report_file}")
+    report_classification_savings(model_wrapper, all_classifiers)
+
+    print(f"All conversations saved to {all_conversations_file}")
+    export_conversations(sink, export_formats)
+
+    return load_conversations(sink)
+
+
+async def generate_conversation_trees(trees_per_persona=1, fork_turns=(1,), branches=2, max_concurrent=8,
+                                      prompt_caching=False, stream_metrics=False, export_formats=("json", "csv")):
+    """
+    Generate conversations for all personas as conversation trees
+
+    Each tree generates its opening turns once and forks `branches` continuations at each
+    turn in fork_turns, so it yields branches ** len(fork_turns) conversations. Each tree is
+    saved with parent pointers as soon as it completes, and every root-to-leaf path is
+    appended to the combined JSONL file as a standard conversation, numbered per persona.
+
+    Args:
+        trees_per_persona: Number of trees to generate for each persona
+        fork_turns: Turn indices (0-based user messages) at which to fork
+        branches: Number of continuations per fork
+        max_concurrent: Maximum number of trees generated at the same time
+        prompt_caching: Send static prefixes as cacheable blocks (forks share the prefix)
+        stream_metrics: Record latency metrics for Lindra's turns
+        export_formats: Formats to produce from the combined JSONL file (see export_conversations)
+
+    Returns:
+        Dictionary containing all flattened conversations, keyed by persona_conv_id
+    """
+    fork_turns = sorted({turn for turn in fork_turns if 0 <= turn < NUM_MESSAGES})
+    leaves_per_tree = branches ** len(fork_turns)
+    print(f"Generating {trees_per_persona} conversation trees per persona "
+          f"(forks at turns {fork_turns}, {branches} branches, "
+          f"{leaves_per_tree} conversations per tree)...")
+    ensure_output_dir()
+
+    simulator = ConversationSimulator(
+        client=get_client_factory().anthropic_async(),
+        max_concurrent=max_concurrent,
+        rate_limiter=get_rate_limiter(),
+        prompt_caching=prompt_caching,
+        stream_metrics=stream_metrics
+    )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    trees_file = os.path.join(OUTPUT_FOLDER, f"conversation_trees_{timestamp}.jsonl")
+    all_conversations_file = os.path.join(OUTPUT_FOLDER, f"all_conversations_trees_{timestamp}.jsonl")
+    sink = ConversationSink(all_conversations_file)
+    conversation_ids = []
+
+    async def grow(persona, tree_num):
+        async with simulator.semaphore:
+            tree = await grow_conversation_tree(
+                simulator, f"{persona['name']}-t{tree_num}", persona, NUM_MESSAGES,
+                fork_turns=fork_turns, branches=branches, lindra_prompt=ASSISTANT_PROMPT
+            )
+        print(f"  Completed tree {tree.tree_id} with {len(tree.leaves())} conversations")
+        # Save the tree and flatten every root-to-leaf path into a standard conversation as soon as
+        # the tree is complete, so finished trees are not held in memory until the end of the run.
+        # Numbers follow the tree number, so they do not depend on completion order
+        append_tree_to_jsonl(tree, trees_file)
+        for leaf_num, (leaf_id, conversation) in enumerate(tree.flatten().items()):
+            conv_num = (tree_num - 1) * leaves_per_tree + leaf_num + 1
+            persona_conv_id = f"{persona['name']}_{conv_num}"
+            sink.append({
+                "conversation_id": persona_conv_id,
+                "persona_conv_id": persona_conv_id,
+                "persona": persona,
+                "conversation": conversation,
+                "conversation_number": conv_num,
+                "tree_id": tree.tree_id,
+                "leaf_id": leaf_id
+            })
+            conversation_ids.append(persona_conv_id)
+
+    start_time = time.time()
+    jobs = [(persona, tree_num) for persona in personas for tree_num in range(1, trees_per_persona + 1)]
+    await asyncio.gather(*[grow(persona, tree_num) for persona, tree_num in jobs])
+    print(f"Generated {len(jobs)} trees in {time.time() - start_time:.2f} seconds")
+    print(f"Conversation trees saved to {trees_file}")
+    print(f"All {len(conversation_ids)} conversations saved to {all_conversations_file}")
+    export_conversations(sink, export_formats)
+
+    # In persona and tree order, as if the trees had completed one after another
+    order = [f"{persona['name']}_{conv_num}" for persona in personas
+             for conv_num in range(1, trees_per_persona * leaves_per_tree + 1)]
+    return load_conversations(sink, order)
 
 
 # Modifications for visualize_results_hume function
@@ -1176,7 +1886,8 @@ def visualize_results(analysis_results):
 
 # Modifications for analyze_existing_conversations function
 
-async def analyze_existing_conversations(file_path, conversation_source="hume"):
+async def analyze_existing_conversations(file_path, conversation_source="hume", batch=False, batch_base_url=None,
+                                         batch_poll_interval=30):
     """
     Analyze existing conversations from a file
 
@@ -1188,6 +1899,9 @@ async def analyze_existing_conversations(file_path, conversation_source="hume"):
     Args:
         file_path: Path to the file containing conversations to analyze
         conversation_source: Source of conversations - "generated" or "hume"
+        batch: Classify through the OpenAI Batch API (see run_classifier_analysis_batch)
+        batch_base_url: Optional API base URL for batch mode, e.g. a local stand-in server
+        batch_poll_interval: Seconds between batch status checks
     """
     print(f"Analyzing existing conversations from {file_path} as {conversation_source} conversations...")
 
@@ -1303,7 +2017,11 @@ async def analyze_existing_conversations(file_path, conversation_source="hume"):
                 data["chat_id"] = id
 
     # Run analysis with the specified conversation source
-    analysis_results = await run_classifier_analysis_with_rate_limits(conversations_data, conversation_source)
+    if batch:
+        analysis_results = await run_classifier_analysis_batch(conversations_data, conversation_source,
+                                                               batch_base_url, batch_poll_interval)
+    else:
+        analysis_results = await run_classifier_analysis_with_rate_limits(conversations_data, conversation_source)
 
     print(analysis_results)
 
@@ -1551,6 +2269,59 @@ async def main():
         --latex-pseudocode: Generate LaTeX pseudocode for the thesis
         --conversation-source TYPE: Specify the source of conversations (generated or hume)
         --conversations-per-persona NUM: Number of conversations to generate for each persona (default: 3)
+        --concurrency NUM: Number of conversations simulated in parallel (default: 8, 1 = sequential)
+        --workers NUM: Number of worker processes for --generate, each with a shard of the
+                       conversations and --concurrency conversations in flight (default: 1)
+        --prompt-caching: Cache the static system prompt and persona prefixes during simulation
+        --resume: Continue an interrupted --generate run, skipping finished conversations
+        --cassette PATH: Record all API requests/responses to PATH, or replay them from it
+        --cassette-mode MODE: "record" (call the APIs and store responses) or "replay" (no network)
+        --batch-simulation: Generate turn by turn through the Message Batches API (batch pricing)
+        --batch: With --analyze, classify every chunk through the OpenAI Batch API (batch pricing,
+                 no per-minute rate limits, so large files need no splitting)
+        --batch-base-url URL: Send batch jobs to another endpoint, e.g. python -m Common.batch_server
+        --batch-poll-interval SEC: Seconds between batch status checks (default: 30)
+        --stream-metrics: Stream Lindra's responses and record TTFT, latency and tokens/sec per turn
+        --branching: Generate conversation trees that fork from shared prefixes
+                     (--conversations-per-persona is then the number of trees per persona)
+        --fork-turns LIST: Comma-separated turn indices to fork at in branching mode (default: 1)
+        --branches NUM: Continuations per fork in branching mode (default: 2)
+        --early-stopping: Classify each new exchange during --generate and stop a conversation once
+                          all of its persona's target classifiers PASS (--messages is the maximum)
+        --min-turns NUM: Minimum number of assistant messages before early stopping (default: 2)
+        --grouped-classification: Ask all classifiers that share a chunker in one request per chunk
+        --single-call-classifiers LIST: Comma-separated classifiers (or "all") that send the whole
+                                        conversation once and label every chunk in one request
+        --short-circuit: Stop classifying a conversation with a classifier once one chunk is YES ("any"
+                         aggregation cannot change any more), cancelling its remaining chunk calls
+        --chunk-order ORDER: Order in which chunks are tried with --short-circuit: "forward", "reverse"
+                             (latest first) or "learned" (per-classifier YES rate by position, default)
+        --cascade PATH: Label the chunks a local pre-classifier (python -m Classifiers.train_cascade) is
+                        confident about without an LLM call
+        --cascade-audit-rate RATE: Fraction of locally labeled chunks still sent to the LLM to measure agreement
+        --logprobs: With --analyze, classify each chunk with a single-token answer and read P(yes) from its
+                    logprobs; results also get a noisy-OR "classification_scores" entry per classifier
+                    (not with --batch, --short-circuit, --grouped-classification or --single-call-classifiers)
+        --logprob-calibration PATH: Platt calibration of P(yes) (JSON from python -m Classifiers.benchmark_logprobs)
+        --prompt-layout LAYOUT: Layout of the classifier prompts: "default", or "prefix_stable" (shared instructions
+                                and all classifier definitions of the set first, then the target classifier's
+                                name, then the chunk) for provider-side prompt caching
+        --classification-cache PATH: SQLite cache of classification results
+                                     (default: classification_cache.sqlite in the output folder)
+        --no-classification-cache: Bypass the classification cache for this run
+        --cache-max-entries NUM: Keep at most NUM cached results (least recently used are evicted)
+        --cache-max-age-days DAYS: Evict cached results older than DAYS
+        --adaptive: Validation sweep that gives each next conversation to the persona whose
+                    target-validation PASS rate has the widest confidence interval
+        --precision WIDTH: Interval half-width at which a persona is done in --adaptive mode (default: 0.1)
+        --min-per-persona NUM: Conversations per persona before its interval is used (default: 3)
+        --max-per-persona NUM: Maximum conversations per persona in --adaptive mode (default: 30)
+        --token-budget NUM: Hard limit on the total tokens of the run (all API calls)
+        --cost-budget USD: Hard limit on the total cost of the run in dollars (see PRICES in Common/accounting.py)
+        --budget-action ACTION: "cancel" (stop the run; continue later with --resume) or "pause"
+                                (ask whether to extend the budget) when a budget is reached
+        --export-formats LIST: Formats produced from the conversation stream after --generate
+                               (json, csv, combined_csv; default: json,csv)
 
     Examples:
         # Generate new conversations (3 per persona by default)
@@ -1570,6 +2341,72 @@ async def main():
         # Generate longer conversations
         python main.py --generate --messages 10
 
+        # Simulate up to 20 conversations in parallel
+        python main.py --generate --concurrency 20
+
+        # Use prompt caching for the Lindra system prompt and persona prefixes
+        python main.py --generate --prompt-caching
+
+        # Overnight run on 8 cores, sharing one rate budget across the worker processes
+        python main.py --generate --conversations-per-persona 50 --workers 8
+
+        # Analyze, skipping the remaining chunks of a classifier once one chunk is YES
+        python main.py --analyze conversations_output/all_conversations.jsonl --short-circuit
+
+        # Label confident chunks with a local cascade, auditing 5% of them against the LLM
+        python main.py --analyze conversations_output/all_conversations.jsonl --cascade conversations_output/cascade.npz --cascade-audit-rate 0.05
+
+        # Analyze with single-token answers and calibrated per-classifier scores
+        python main.py --analyze conversations_output/all_conversations.jsonl --logprobs --logprob-calibration conversations_output/logprob_calibration.json
+
+        # Analyze with a prompt layout whose shared prefix the provider can cache
+        python main.py --analyze conversations_output/all_conversations.jsonl --prompt-layout prefix_stable
+
+        # Continue an interrupted generation run (same --conversations-per-persona)
+        python main.py --generate --resume
+
+        # Record the API traffic of a full run, then re-run it offline at zero cost
+        python main.py --generate --cassette runs/baseline.cassette.gz --cassette-mode record
+        python main.py --generate --cassette runs/baseline.cassette.gz --cassette-mode replay
+
+        # Large offline sweep through the batch API, one batch job per turn and role
+        python main.py --generate --conversations-per-persona 100 --batch-simulation
+
+        # Same, against the local stand-in batch server (python -m Common.batch_server --port 8765)
+        python main.py --generate --batch-simulation --batch-base-url http://127.0.0.1:8765 --batch-poll-interval 1
+
+        # Classify a whole corpus through the OpenAI Batch API instead of splitting it into parts
+        python main.py --analyze all_conversations_test.jsonl --conversation-source hume --batch
+        python main.py --analyze all_conversations_test.jsonl --batch --batch-base-url http://127.0.0.1:8765
+
+        # Measure Lindra's time-to-first-token and tokens/sec for the current prompt
+        python main.py --generate --stream-metrics
+
+        # One tree per persona, forking 3 ways at turns 1 and 3 (9 conversations per tree)
+        python main.py --generate --branching --conversations-per-persona 1 --fork-turns 1,3 --branches 3
+
+        # Stop each conversation once its target classifiers PASS, between 3 and 10 turns
+        python main.py --generate --early-stopping --min-turns 3 --messages 10
+
+        # Classify with all classifiers in one request per chunk instead of one per classifier and chunk
+        python main.py --analyze all_conversations_test.jsonl --conversation-source hume --grouped-classification
+
+        # Label every message of a conversation in one request for two classifiers (see the agreement
+        # benchmark: python -m Classifiers.benchmark_single_call)
+        python main.py --generate --single-call-classifiers "Fear of Movement,Pain Catastrophizing"
+
+        # Re-classify everything, ignoring (and not filling) the classification cache
+        python main.py --analyze all_conversations_test.jsonl --no-classification-cache
+
+        # Sample personas until every PASS rate is known to +/-0.1 (at most 40 conversations each)
+        python main.py --generate --adaptive --precision 0.1 --max-per-persona 40
+
+        # Stop generation and classification once $5 have been spent
+        python main.py --generate --cost-budget 5
+
+        # Only keep the combined JSONL stream plus one combined CSV
+        python main.py --generate --export-formats combined_csv
+
         # Convert a JSON conversation to CSV
         python main.py --convert-to-csv conversations_output/Maya_Cognitive_restructuring.json
 
@@ -1577,7 +2414,8 @@ async def main():
         python main.py --latex-pseudocode
     """
     # Declare globals at the beginning of the function before using them
-    global NUM_MESSAGES, CLASSIFIER_SET
+    global NUM_MESSAGES, CLASSIFIER_SET, CASSETTE, GROUPED_CLASSIFICATION, SINGLE_CALL_CLASSIFIERS, SHORT_CIRCUIT
+    global CHUNK_PRIOR, LOGPROBS, LOGPROB_CALIBRATION, PROMPT_LAYOUT
 
     parser = argparse.ArgumentParser(description="Lindra Toolkit: Generate and analyze conversations")
     parser.add_argument("--generate", action="store_true", help="Generate new conversations")
@@ -1592,17 +2430,139 @@ async def main():
                         help="Source of conversations - determines classifier usage")
     parser.add_argument("--conversations-per-persona", type=int, default=3,
                         help="Number of conversations to generate for each persona")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Number of conversations simulated in parallel (1 = sequential)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes for --generate, sharing one rate budget")
+    parser.add_argument("--prompt-caching", action="store_true",
+                        help="Cache the static system prompt and persona prefixes during simulation")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted --generate run, skipping finished conversations")
+    parser.add_argument("--cassette", type=str,
+                        help="Cassette file to record API traffic to, or replay it from")
+    parser.add_argument("--cassette-mode", type=str, default="replay", choices=["record", "replay"],
+                        help="Record API calls to the cassette, or answer them from it without network access")
+    parser.add_argument("--batch-simulation", action="store_true",
+                        help="Generate conversations turn by turn through the Message Batches API")
+    parser.add_argument("--batch", action="store_true",
+                        help="With --analyze, classify through the OpenAI Batch API")
+    parser.add_argument("--batch-base-url", type=str,
+                        help="API base URL for batch jobs, e.g. a local stand-in batch server")
+    parser.add_argument("--batch-poll-interval", type=float, default=30,
+                        help="Seconds between batch status checks")
+    parser.add_argument("--stream-metrics", action="store_true",
+                        help="Stream Lindra's responses and record TTFT, latency and tokens/sec per turn")
+    parser.add_argument("--branching", action="store_true",
+                        help="Generate conversation trees that fork continuations from shared prefixes")
+    parser.add_argument("--fork-turns", type=str, default="1",
+                        help="Comma-separated turn indices at which conversation trees fork")
+    parser.add_argument("--branches", type=int, default=2,
+                        help="Number of continuations per fork in branching mode")
+    parser.add_argument("--early-stopping", action="store_true",
+                        help="Classify each new exchange and stop once all target classifiers PASS")
+    parser.add_argument("--min-turns", type=int, default=2,
+                        help="Minimum number of assistant messages before a conversation may stop early")
+    parser.add_argument("--grouped-classification", action="store_true",
+                        help="Ask all classifiers that share a chunker in one request per chunk")
+    parser.add_argument("--single-call-classifiers", type=str,
+                        help="Comma-separated classifiers (or 'all') that label a whole conversation in one request")
+    parser.add_argument("--short-circuit", action="store_true",
+                        help="Cancel a classifier's remaining chunk calls once its 'any' result is YES")
+    parser.add_argument("--chunk-order", type=str, default="learned", choices=CHUNK_ORDERS,
+                        help="Order in which chunks are classified with --short-circuit")
+    parser.add_argument("--cascade", type=str,
+                        help="Local pre-classifier cascade (.npz from Classifiers.train_cascade)")
+    parser.add_argument("--cascade-audit-rate", type=float, default=0.0,
+                        help="Fraction of locally labeled chunks still sent to the LLM to measure agreement")
+    parser.add_argument("--logprobs", action="store_true",
+                        help="With --analyze, classify chunks with a single-token answer and keep P(yes)")
+    parser.add_argument("--logprob-calibration", type=str,
+                        help="Platt calibration (JSON) applied to P(yes) with --logprobs")
+    parser.add_argument("--prompt-layout", type=str, default=PROMPT_LAYOUT, choices=classification.PROMPT_LAYOUTS,
+                        help="Layout of the classifier prompts (prefix_stable starts every prompt with the "
+                             "instructions and the set's definitions, a cacheable prefix)")
+    parser.add_argument("--classification-cache", type=str,
+                        help="SQLite file caching classification results (default: in the output folder)")
+    parser.add_argument("--no-classification-cache", action="store_true",
+                        help="Bypass the classification cache for this run")
+    parser.add_argument("--cache-max-entries", type=int,
+                        help="Maximum number of cached classification results (least recently used are evicted)")
+    parser.add_argument("--cache-max-age-days", type=float,
+                        help="Evict cached classification results older than this many days")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Allocate conversations to the personas with the widest PASS-rate interval")
+    parser.add_argument("--precision", type=float, default=0.1,
+                        help="Target half-width of each persona's PASS-rate interval in --adaptive mode")
+    parser.add_argument("--min-per-persona", type=int, default=3,
+                        help="Conversations per persona before its interval is used in --adaptive mode")
+    parser.add_argument("--max-per-persona", type=int, default=30,
+                        help="Maximum number of conversations per persona in --adaptive mode")
+    parser.add_argument("--token-budget", type=int,
+                        help="Hard limit on the total number of tokens used by the run")
+    parser.add_argument("--cost-budget", type=float,
+                        help="Hard limit on the total cost of the run in dollars")
+    parser.add_argument("--budget-action", type=str, default="cancel", choices=["cancel", "pause"],
+                        help="Cancel the run or pause and ask to extend the budget when it is reached")
+    parser.add_argument("--export-formats", type=str, default="json,csv",
+                        help="Comma-separated formats produced from the conversation stream "
+                             "(json, csv, combined_csv); empty for JSONL only")
 
     args = parser.parse_args()
+    # Scores need P(yes) of every chunk: grouped and single-call requests answer with labels,
+    # short-circuiting leaves chunks out, and batch requests have no logprob mode
+    if args.logprobs:
+        for flag, enabled in [("--batch", args.batch), ("--short-circuit", args.short_circuit),
+                              ("--grouped-classification", args.grouped_classification),
+                              ("--single-call-classifiers", args.single_call_classifiers)]:
+            if enabled:
+                parser.error(f"--logprobs cannot be combined with {flag}")
 
     # Update global settings
     NUM_MESSAGES = args.messages
     CLASSIFIER_SET = args.classifier_set
+    PROMPT_LAYOUT = args.prompt_layout
+    GROUPED_CLASSIFICATION = args.grouped_classification
+    if args.single_call_classifiers:
+        SINGLE_CALL_CLASSIFIERS = ("all" if args.single_call_classifiers.strip() == "all" else
+                                   [name.strip() for name in args.single_call_classifiers.split(",") if name.strip()])
     CONVERSATION_SOURCE = args.conversation_source
     CONVERSATIONS_PER_PERSONA = args.conversations_per_persona
+    export_formats = [fmt.strip() for fmt in args.export_formats.split(",") if fmt.strip()]
+    if args.cassette:
+        CASSETTE = cassette.Cassette(args.cassette, mode=args.cassette_mode)
+        set_client_factory(ClientFactory(cassette=CASSETTE))
+        print(f"Using cassette {args.cassette} in {args.cassette_mode} mode")
 
     ensure_output_dir()
 
+    # The learned chunk order is kept across runs next to the classification cache
+    SHORT_CIRCUIT = args.short_circuit
+    if SHORT_CIRCUIT:
+        CHUNK_PRIOR = ChunkPrior(args.chunk_order, path=os.path.join(OUTPUT_FOLDER, "chunk_priors.json"))
+
+    # Classification results are cached on disk by model, prompt and response format, so
+    # re-running an analysis only pays for what changed
+    if not args.no_classification_cache:
+        set_classification_cache(ClassificationCache(
+            args.classification_cache or os.path.join(OUTPUT_FOLDER, "classification_cache.sqlite"),
+            max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days
+        ))
+
+    LOGPROBS = args.logprobs
+    if args.logprob_calibration:
+        LOGPROB_CALIBRATION = PlattCalibration.load(args.logprob_calibration)
+
+    # Chunks the local cascade is confident about are labeled without an LLM call
+    if args.cascade:
+        set_cascade(ChunkCascade.load(args.cascade, audit_rate=args.cascade_audit_rate))
+
+    # Every API call of the run is recorded (tokens, cost, latency, retries) and checked against the budget
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    set_ledger(UsageLedger(
+        os.path.join(OUTPUT_FOLDER, f"usage_calls_{timestamp}.jsonl"),
+        token_budget=args.token_budget, cost_budget=args.cost_budget, on_exceeded=args.budget_action
+    ))
+
     if args.latex_pseudocode:
         # Generate LaTeX pseudocode
         latex_code = generate_latex_pseudocode()
@@ -1612,7 +2572,35 @@ async def main():
         print(f"LaTeX pseudocode saved to {latex_file}")
     elif args.generate:
         # Generate new conversations with the specified number per persona
-        conversations = generate_conversations(CONVERSATIONS_PER_PERSONA)
+        if args.branching:
+            conversations = await generate_conversation_trees(
+                CONVERSATIONS_PER_PERSONA,
+                fork_turns=[int(turn) for turn in args.fork_turns.split(",") if turn.strip()],
+                branches=args.branches, max_concurrent=args.concurrency,
+                prompt_caching=args.prompt_caching, stream_metrics=args.stream_metrics,
+                export_formats=export_formats
+            )
+        elif args.adaptive:
+            conversations = await generate_conversations_adaptive(
+                args.precision, args.min_per_persona, args.max_per_persona, args.concurrency,
+                prompt_caching=args.prompt_caching, stream_metrics=args.stream_metrics,
+                export_formats=export_formats, early_stopping=args.early_stopping, min_turns=args.min_turns
+            )
+        elif args.workers > 1:
+            if args.batch_simulation:
+                parser.error("--workers cannot be combined with --batch-simulation")
+            conversations = generate_conversations_parallel(
+                CONVERSATIONS_PER_PERSONA, args.workers, args.concurrency, prompt_caching=args.prompt_caching,
+                resume=args.resume, stream_metrics=args.stream_metrics, export_formats=export_formats,
+                early_stopping=args.early_stopping, min_turns=args.min_turns
+            )
+        else:
+            conversations = await generate_conversations_async(
+                CONVERSATIONS_PER_PERSONA, args.concurrency, prompt_caching=args.prompt_caching,
+                resume=args.resume, batch=args.batch_simulation, batch_base_url=args.batch_base_url,
+                batch_poll_interval=args.batch_poll_interval, stream_metrics=args.stream_metrics,
+                export_formats=export_formats, early_stopping=args.early_stopping, min_turns=args.min_turns
+            )
         # Analyze the generated conversations (using target classifiers)
         analysis_results = await run_classifier_analysis(conversations, "generated")
         # Visualize results
@@ -1626,7 +2614,9 @@ async def main():
         print(f"  SKIP/N/A: {visualization_summary['skip_count']}")
     elif args.analyze:
         # Analyze existing conversations with the specified source type
-        await analyze_existing_conversations(args.analyze, CONVERSATION_SOURCE)
+        await analyze_existing_conversations(args.analyze, CONVERSATION_SOURCE, batch=args.batch,
+                                             batch_base_url=args.batch_base_url,
+                                             batch_poll_interval=args.batch_poll_interval)
     elif args.convert_to_csv:
         # Convert JSON conversation to CSV
         convert_json_to_csv(args.convert_to_csv, args.output_folder)
@@ -1641,7 +2631,57 @@ async def main():
         print("    - generated: Use only target classifiers defined in personas")
         print("    - hume: Use all available classifiers")
         print("  --conversations-per-persona NUM: Number of conversations to generate for each persona (default: 3)")
+        print("  --concurrency NUM: Number of conversations simulated in parallel (default: 8)")
+        print("  --workers NUM: Number of worker processes for --generate (default: 1)")
+        print("  --prompt-caching: Cache the system prompt and persona prefixes during simulation")
+        print("  --resume: Continue an interrupted --generate run")
+        print("  --cassette PATH --cassette-mode [record|replay]: Record API traffic or replay it offline")
+        print("  --batch-simulation: Generate conversations turn by turn through the batch API")
+        print("  --batch: With --analyze, classify every chunk through the OpenAI Batch API")
+        print("  --stream-metrics: Record Lindra's time-to-first-token and tokens/sec per turn")
+        print("  --branching --fork-turns LIST --branches NUM: Generate conversation trees from shared prefixes")
+        print("  --early-stopping --min-turns NUM: Stop conversations once their target classifiers PASS")
+        print("  --grouped-classification: Ask all classifiers that share a chunker in one request per chunk")
+        print("  --single-call-classifiers LIST: Classifiers that label a whole conversation in one request")
+        print("  --short-circuit --chunk-order [forward|reverse|learned]: Stop classifying a conversation once "
+              "a chunk is YES")
+        print("  --cascade PATH --cascade-audit-rate RATE: Label confident chunks with a local pre-classifier")
+        print("  --logprobs --logprob-calibration PATH: Single-token answers with (calibrated) P(yes) scores")
+        print("  --prompt-layout [default|prefix_stable]: Classifier prompt layout (prefix_stable for prompt caching)")
+        print("  --classification-cache PATH / --no-classification-cache: Cache classification results on disk, "
+              "or bypass the cache")
+        print("  --cache-max-entries NUM / --cache-max-age-days DAYS: Evict cached classification results")
+        print("  --adaptive --precision WIDTH --min-per-persona NUM --max-per-persona NUM: Sample personas "
+              "until their PASS rates are known to the given precision")
+        print("  --token-budget NUM / --cost-budget USD --budget-action [cancel|pause]: Hard budget for the run")
+        print("  --export-formats LIST: Formats produced from the conversation stream (default: json,csv)")
+
+    report_usage()
+    if CHUNK_PRIOR is not None:
+        CHUNK_PRIOR.save()
+    for model, stats in get_rate_limiter().concurrency_stats().items():
+        print(f"Concurrency {model}: limit {stats['limit']} (range {stats['lowest_limit']}-{stats['peak_limit']}), "
+              f"peak queue depth {stats['peak_queue_depth']}, {stats['overloads']} overloads")
+    if CASSETTE is not None:
+        print(f"Cassette: {CASSETTE.stats()}")
+    if get_classification_cache() is not None:
+        print(f"Classification cache: {get_classification_cache().stats()}")
+    if get_cascade() is not None and get_cascade().counts:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        cascade_file = os.path.join(OUTPUT_FOLDER, f"cascade_report_{timestamp}.json")
+        with open(cascade_file, 'w', encoding='utf-8') as f:
+            json.dump(get_cascade().report(), f, indent=2)
+        print(f"Cascade report saved to {cascade_file}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except BudgetExceededError as e:
+        print(f"Run stopped: {e}. Finished conversations are journaled; "
+              f"continue with --resume and a larger budget.")
+        report_usage()
+    finally:
+        # Write the classification results the cache still buffers
+        if get_classification_cache() is not None:
+            get_classification_cache().close()
@@ -0,0 +1,76 @@
+"""
+Shared fixtures and helpers. Run the tests from the repository root:
+    python -m pytest
+"""
+import itertools
+import json
+
+import anthropic
+import httpx
+import openai
+import pytest
+
+from Common.accounting import UsageLedger, set_ledger
+from Common.batch_server import default_chat_responder
+from Common.clients import ClientFactory, set_client_factory
+
+
+def mock_openai_client(handler, usage=None) -> openai.AsyncOpenAI:
+    """
+    OpenAI client whose chat completions are answered with handler(request_body) as content,
+    and report usage(request_body) as usage if given.
+    """
+    def respond(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": handler(body)}}],
+            "usage": usage(body) if usage else {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105},
+        })
+    return openai.AsyncOpenAI(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(respond)),
+                              max_retries=0)
+
+
+def answer_like_batch_server(requests: list):
+    """Chat responder of the stand-in batch server that also collects the request bodies."""
+    def handler(body):
+        requests.append(body)
+        return default_chat_responder(body)
+    return handler
+
+
+def mock_anthropic_client(handler) -> anthropic.AsyncAnthropic:
+    """Anthropic client whose messages are answered with handler(request_body) as text."""
+    def respond(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        return httpx.Response(200, json={
+            "id": "msg_test", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": handler(body)}],
+            "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": 100, "output_tokens": 10},
+        })
+    return anthropic.AsyncAnthropic(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(respond)),
+                                    max_retries=0)
+
+
+@pytest.fixture
+def ledger():
+    """A fresh process-wide usage ledger for the test."""
+    ledger = UsageLedger()
+    previous = set_ledger(ledger)
+    yield ledger
+    set_ledger(previous)
+
+
+@pytest.fixture
+def mock_anthropic():
+    """Install a client factory whose Anthropic client answers every message with a numbered reply."""
+    counter = itertools.count()
+    client = mock_anthropic_client(lambda body: f"Reply {next(counter)}. (Calmness 0.5)")
+    previous = set_client_factory(ClientFactory(anthropic_client=client))
+    yield client
+    set_client_factory(previous)
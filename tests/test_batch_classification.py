@@ -0,0 +1,153 @@
+"""
+BatchClassifier end to end against the stand-in batch server (Common/batch_server.py).
+
+Run from the repository root:
+    python -m pytest tests/test_batch_classification.py
+"""
+import asyncio
+import json
+
+import openai
+import pytest
+from conftest import mock_openai_client
+
+import Classifiers.emoclassifiers.classification as classification
+from Classifiers.emoclassifiers.batch_classification import BatchClassifier
+from Classifiers.emoclassifiers.result_cache import ClassificationCache, set_classification_cache
+from Common.batch_server import FakeBatchServer, default_chat_responder
+
+CLASSIFIER_NAMES = ["Pain Catastrophizing", "Pain Distress", "Offering Emotional Support"]
+
+
+def make_conversation(text: str) -> list[dict]:
+    return [
+        {"role": "user", "content": f"My back hurts {text}."},
+        {"role": "assistant", "content": "I'm sorry to hear that. What makes it worse?"},
+        {"role": "user", "content": "Sitting for a long time."},
+        {"role": "assistant", "content": "Let's try a short stretching break every hour."},
+    ]
+
+
+def expected_label(batch_classifier: BatchClassifier, task: dict) -> classification.YesNoUnsureEnum:
+    """The label the stand-in server gives a task's request."""
+    body = batch_classifier.request_line(task)["body"]
+    return classification.ResponseFormat.model_validate_json(default_chat_responder(body)).response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "classification_cache.sqlite"))
+    previous = set_classification_cache(cache)
+    yield cache
+    set_classification_cache(previous)
+
+
+def load_classifiers(model_wrapper: classification.ModelWrapper) -> dict[str, classification.EmoClassifier]:
+    classifiers = classification.load_classifiers(classifier_set="v1", model_wrapper=model_wrapper)
+    return {name: classifiers[name] for name in CLASSIFIER_NAMES}
+
+
+def run_classification(server, tmp_path, conversations, realtime_handler=None):
+    model_wrapper = classification.ModelWrapper(
+        openai_client=mock_openai_client(realtime_handler or (lambda body: json.dumps({"response": "yes"}))),
+    )
+    classifiers = load_classifiers(model_wrapper)
+    batch_classifier = BatchClassifier(
+        openai_client=openai.AsyncOpenAI(api_key="test", base_url=server.base_url + "/v1"),
+        poll_interval=0.01,
+        output_folder=str(tmp_path),
+    )
+    classifiers_by_conversation = {conversation_id: classifiers for conversation_id in conversations}
+    results = asyncio.run(batch_classifier.classify_conversations(conversations, classifiers_by_conversation))
+    tasks = batch_classifier.enumerate_tasks(conversations, classifiers_by_conversation)
+    return batch_classifier, results, tasks
+
+
+def submitted_custom_ids(server: FakeBatchServer) -> list[str]:
+    custom_ids = []
+    for batch in server.openai_batches.values():
+        content = server.files[batch["request"]["input_file_id"]]["content"].decode("utf-8")
+        custom_ids.extend(json.loads(line)["custom_id"] for line in content.splitlines() if line.strip())
+    return custom_ids
+
+
+def test_results_are_joined_by_custom_id(tmp_path, cache, ledger):
+    conversations = {"a": make_conversation("today"), "b": make_conversation("since Monday")}
+    with FakeBatchServer(polls_until_done=2) as server:
+        batch_classifier, results, tasks = run_classification(server, tmp_path, conversations)
+
+    assert set(results) == set(conversations)
+    for task in tasks:
+        label = results[task["conversation_id"]][task["classifier_name"]][task["chunk_id"]]
+        assert label == expected_label(batch_classifier, task)
+    assert batch_classifier.batches_submitted == 1
+    assert batch_classifier.resent_tasks == 0
+    # Batch usage is booked under the classifier's definition name
+    assert ledger.by_tag["classifier"]["Immediate Pain Distress"]["calls"] > 0
+    assert "Pain Distress" not in ledger.by_tag["classifier"]
+
+
+def test_duplicate_prompts_are_submitted_once_and_fanned_out(tmp_path, cache, ledger):
+    conversations = {"a": make_conversation("today"), "copy": make_conversation("today"),
+                     "b": make_conversation("since Monday")}
+    with FakeBatchServer() as server:
+        batch_classifier, results, tasks = run_classification(server, tmp_path, conversations)
+        custom_ids = submitted_custom_ids(server)
+
+    unique_prompts = {task["prompt"] for task in tasks}
+    assert len(custom_ids) == len(set(custom_ids)) == len(unique_prompts) < len(tasks)
+    assert results["copy"] == results["a"]
+    for task in tasks:
+        assert results[task["conversation_id"]][task["classifier_name"]][task["chunk_id"]] == \
+            expected_label(batch_classifier, task)
+
+
+def test_results_are_written_to_the_cache(tmp_path, cache, ledger):
+    conversations = {"a": make_conversation("today"), "b": make_conversation("since Monday")}
+    with FakeBatchServer() as server:
+        batch_classifier, results, tasks = run_classification(server, tmp_path, conversations)
+        schema = classification.ResponseFormat.model_json_schema()
+        for task in tasks:
+            cached = cache.peek(ClassificationCache.key(batch_classifier.model, task["prompt"], schema))
+            assert cached == {"response": expected_label(batch_classifier, task).value}
+
+        # A second run is answered from the cache without submitting another batch
+        second_classifier, second_results, _ = run_classification(server, tmp_path, conversations)
+        assert len(server.openai_batches) == 1
+    assert second_classifier.batches_submitted == 0
+    assert second_classifier.cached_tasks == len(tasks)
+    assert second_results == results
+
+
+def test_failed_batch_requests_are_resent_in_real_time(tmp_path, cache, ledger):
+    # Every batch request of one classifier fails
+    marker = "entitled 'Pain Catastrophizing'"
+
+    def chat_responder(body):
+        if marker in body["messages"][0]["content"]:
+            return None
+        return default_chat_responder(body)
+
+    conversations = {"a": make_conversation("today"), "copy": make_conversation("today")}
+    realtime_requests = []
+
+    def realtime_handler(body):
+        realtime_requests.append(body)
+        return json.dumps({"response": "yes"})
+
+    with FakeBatchServer(chat_responder=chat_responder) as server:
+        batch_classifier, results, tasks = run_classification(server, tmp_path, conversations, realtime_handler)
+
+    failed_tasks = [task for task in tasks if marker in task["prompt"]]
+    assert failed_tasks
+    # Each failed prompt is re-sent once, and the answer reaches its duplicates too
+    assert len(realtime_requests) == batch_classifier.resent_tasks == len({task["prompt"] for task in failed_tasks})
+    for task in tasks:
+        label = results[task["conversation_id"]][task["classifier_name"]][task["chunk_id"]]
+        if task in failed_tasks:
+            assert label == classification.YesNoUnsureEnum.YES
+        else:
+            assert label == expected_label(batch_classifier, task)
+    schema = classification.ResponseFormat.model_json_schema()
+    for task in failed_tasks:
+        assert cache.peek(ClassificationCache.key(batch_classifier.model, task["prompt"], schema)) == {"response": "yes"}
@@ -0,0 +1,102 @@
+"""
+BatchConversationSimulator end to end against the stand-in batch server (Common/batch_server.py).
+
+Run from the repository root:
+    python -m pytest tests/test_batch_simulation.py
+"""
+import asyncio
+
+import anthropic
+import pytest
+
+from Common.accounting import UsageLedger, set_ledger
+from Common.batch_server import FakeBatchServer
+from LLMTest.batch_simulation import BatchConversationSimulator, make_custom_id
+from LLMTest.personas import personas
+
+NUM_MESSAGES = 3
+
+
+@pytest.fixture
+def ledger():
+    ledger = UsageLedger()
+    previous = set_ledger(ledger)
+    yield ledger
+    set_ledger(previous)
+
+
+def make_simulator(server: FakeBatchServer) -> BatchConversationSimulator:
+    return BatchConversationSimulator(
+        client=anthropic.AsyncAnthropic(api_key="test", base_url=server.base_url),
+        poll_interval=0.01,
+    )
+
+
+def assert_alternates(conversation: list[dict], num_messages: int = NUM_MESSAGES):
+    assert [message["role"] for message in conversation] == ["user", "assistant"] * num_messages
+    for message in conversation:
+        assert message["content"].startswith("Stand-in reply")
+
+
+def test_conversations_advance_one_batch_per_turn_and_role(ledger):
+    # Ids with characters batch custom ids do not allow
+    jobs = [(f"{persona['name']} #{i}", persona) for i, persona in enumerate(personas[:3])]
+    turns, completed = [], []
+    with FakeBatchServer(polls_until_done=2) as server:
+        simulator = make_simulator(server)
+        conversations = asyncio.run(simulator.simulate_conversations(
+            jobs, NUM_MESSAGES,
+            on_turn=lambda conversation_id, conversation: turns.append((conversation_id, len(conversation))),
+            on_complete=lambda conversation_id, persona, conversation: completed.append(conversation_id),
+        ))
+        submitted = list(server.batches.values())
+
+    assert list(conversations) == [conversation_id for conversation_id, _ in jobs]
+    for conversation in conversations.values():
+        assert_alternates(conversation)
+    # One user and one assistant batch per turn, each holding every conversation's request
+    assert simulator.batches_submitted == len(submitted) == 2 * NUM_MESSAGES
+    assert all(len(batch["results"]) == len(jobs) for batch in submitted)
+    assert sorted(completed) == sorted(conversations)
+    assert len(turns) == 2 * NUM_MESSAGES * len(jobs)
+    # Batch usage is tagged per persona
+    assert set(ledger.by_tag["persona"]) == {persona["name"] for _, persona in jobs}
+    assert ledger.by_tag["stage"]["user_sim"]["calls"] == NUM_MESSAGES * len(jobs)
+
+
+def test_partial_conversations_are_resumed(ledger):
+    jobs = [("fresh", personas[0]), ("partial", personas[1])]
+    with FakeBatchServer() as server:
+        first = asyncio.run(make_simulator(server).simulate_conversations(jobs[1:], 1))
+        conversations = asyncio.run(make_simulator(server).simulate_conversations(
+            jobs, NUM_MESSAGES, resume_from={"partial": first["partial"]}
+        ))
+
+    for conversation in conversations.values():
+        assert_alternates(conversation)
+    assert conversations["partial"][:2] == first["partial"]
+
+
+def test_stop_condition_ends_conversations_early(ledger):
+    jobs = [("stops", personas[0]), ("runs", personas[1])]
+
+    async def stop_condition(conversation_id, persona, conversation):
+        return conversation_id == "stops"
+
+    with FakeBatchServer() as server:
+        conversations = asyncio.run(make_simulator(server).simulate_conversations(
+            jobs, NUM_MESSAGES, stop_condition=stop_condition
+        ))
+
+    assert_alternates(conversations["stops"], num_messages=1)
+    assert_alternates(conversations["runs"])
+
+
+def test_custom_ids_are_valid_and_distinct():
+    long_id = "x" * 100
+    custom_ids = {make_custom_id("Maya Chen/1", "u", 0), make_custom_id("Maya Chen/1", "a", 0),
+                  make_custom_id(long_id, "u", 10), make_custom_id(long_id, "u", 11)}
+    assert len(custom_ids) == 4
+    for custom_id in custom_ids:
+        assert len(custom_id) <= 64
+        assert all(character.isalnum() or character in "_-" for character in custom_id)
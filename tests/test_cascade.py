@@ -0,0 +1,111 @@
+"""
+Cascade audits in every classification path: per chunk, grouped and batch.
+
+Run from the repository root:
+    python -m pytest tests/test_cascade.py
+"""
+import asyncio
+import json
+
+import numpy as np
+import openai
+import pytest
+from conftest import answer_like_batch_server, mock_openai_client
+
+import Classifiers.emoclassifiers.classification as classification
+from Classifiers.emoclassifiers.batch_classification import BatchClassifier
+from Classifiers.emoclassifiers.cascade import ChunkCascade, LogisticModel, set_cascade
+from Common.batch_server import FakeBatchServer
+
+# Batch usage is recorded in the process-wide ledger
+pytestmark = pytest.mark.usefixtures("ledger")
+
+CASCADED = "Pain Catastrophizing"
+CLASSIFIER_NAMES = [CASCADED, "Fear of Movement"]
+CONVERSATION = [
+    {"role": "user", "content": "My back hurts today."},
+    {"role": "assistant", "content": "I'm sorry to hear that. What makes it worse?"},
+    {"role": "user", "content": "Sitting for a long time."},
+    {"role": "assistant", "content": "Let's try a short stretching break every hour."},
+]
+
+
+def make_cascade(audit_rate: float) -> ChunkCascade:
+    """Cascade that labels every chunk of CASCADED as YES."""
+    cascade = ChunkCascade(num_features=16, audit_rate=audit_rate)
+    cascade.models[CASCADED] = LogisticModel(16, weights=np.zeros(16), bias=5.0)
+    cascade.thresholds[CASCADED] = (None, 0.5)
+    return cascade
+
+
+@pytest.fixture
+def classifiers():
+    requests = []
+    model_wrapper = classification.ModelWrapper(openai_client=mock_openai_client(answer_like_batch_server(requests)))
+    loaded = classification.load_classifiers(classifier_set="v1", model_wrapper=model_wrapper)
+    return {name: loaded[name] for name in CLASSIFIER_NAMES}, requests
+
+
+def mentions(requests: list, name: str) -> int:
+    return sum(name in body["messages"][0]["content"] for body in requests)
+
+
+def run_with_cascade(cascade: ChunkCascade, coroutine_factory):
+    previous = set_cascade(cascade)
+    try:
+        return asyncio.run(coroutine_factory())
+    finally:
+        set_cascade(previous)
+
+
+@pytest.mark.parametrize("audit_rate", [0.0, 1.0])
+def test_chunk_path_audits(classifiers, audit_rate):
+    classifiers, requests = classifiers
+    cascade = make_cascade(audit_rate)
+    results = run_with_cascade(cascade, lambda: classifiers[CASCADED].classify_conversation(CONVERSATION))
+
+    counts = cascade.counts[CASCADED]
+    assert counts["local_yes"] == len(results)
+    assert counts["audited"] == mentions(requests, CASCADED) == (len(results) if audit_rate else 0)
+
+
+@pytest.mark.parametrize("audit_rate", [0.0, 1.0])
+def test_grouped_path_audits(classifiers, audit_rate):
+    classifiers, requests = classifiers
+    cascade = make_cascade(audit_rate)
+    results = run_with_cascade(cascade, lambda: classification.classify_conversation_grouped(
+        classifiers, CONVERSATION
+    ))
+
+    chunks = len(results[CASCADED])
+    counts = cascade.counts[CASCADED]
+    assert counts["local_yes"] == chunks
+    # Audited classifiers are asked in the same grouped request as the others
+    assert len(requests) == chunks
+    assert counts["audited"] == mentions(requests, CASCADED) == (chunks if audit_rate else 0)
+    if not audit_rate:
+        assert all(label == classification.YesNoUnsureEnum.YES for label in results[CASCADED].values())
+
+
+@pytest.mark.parametrize("audit_rate", [0.0, 1.0])
+def test_batch_path_audits(classifiers, tmp_path, audit_rate):
+    classifiers, requests = classifiers
+    cascade = make_cascade(audit_rate)
+    with FakeBatchServer() as server:
+        batch_classifier = BatchClassifier(
+            openai_client=openai.AsyncOpenAI(api_key="test", base_url=server.base_url + "/v1"),
+            poll_interval=0.01,
+            output_folder=str(tmp_path),
+        )
+        results = run_with_cascade(cascade, lambda: batch_classifier.classify_conversations(
+            {"a": CONVERSATION}, {"a": classifiers}
+        ))
+        submitted = [json.loads(line)["body"] for batch in server.openai_batches.values()
+                     for line in server.files[batch["request"]["input_file_id"]]["content"].decode().splitlines()]
+
+    chunks = len(results["a"][CASCADED])
+    counts = cascade.counts[CASCADED]
+    assert counts["local_yes"] == chunks
+    assert counts["audited"] == mentions(submitted, CASCADED) == (chunks if audit_rate else 0)
+    assert batch_classifier.local_tasks == (0 if audit_rate else chunks)
+    assert not requests
@@ -0,0 +1,56 @@
+"""
+Resumable generation: a journal left with a partial last line by a crash is repaired on resume.
+
+Run from the repository root:
+    python -m pytest tests/test_checkpoint.py
+"""
+import asyncio
+import json
+
+import main
+from LLMTest.checkpoint import GenerationJournal
+from LLMTest.personas import personas
+
+
+def finished(text: str) -> dict:
+    return {"conversation": [{"role": "user", "content": text}]}
+
+
+def test_resume_truncates_the_partial_last_line(tmp_path):
+    journal = GenerationJournal(str(tmp_path), "generation")
+    journal.append("a", finished("first"))
+    journal.append("b", finished("second"))
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"conversation_id": "c", "persona_conv_id": "c", "conv')
+
+    resumed = GenerationJournal(str(tmp_path), "generation")
+    assert resumed.open_for_resume() == {"a", "b"}
+    resumed.append("c", finished("third"))
+    resumed.append("d", finished("fourth"))
+
+    assert set(resumed.load_completed()) == {"a", "b", "c", "d"}
+    with open(journal.journal_path, encoding="utf-8") as f:
+        assert [json.loads(line)["persona_conv_id"] for line in f] == ["a", "b", "c", "d"]
+
+
+def test_resumed_run_reads_back_every_conversation(tmp_path, monkeypatch, mock_anthropic):
+    monkeypatch.setattr(main, "OUTPUT_FOLDER", str(tmp_path))
+    monkeypatch.setattr(main, "NUM_MESSAGES", 2)
+    monkeypatch.setattr(main, "personas", personas[:2])
+    asyncio.run(main.generate_conversations_async(2, max_concurrent=4, export_formats=()))
+
+    # Crash in the middle of writing the last finished conversation
+    journal = GenerationJournal(str(tmp_path), main.generation_journal_name(2))
+    with open(journal.journal_path, "rb") as f:
+        content = f.read()
+    with open(journal.journal_path, "wb") as f:
+        f.write(content[:-20])
+
+    conversations = asyncio.run(main.generate_conversations_async(2, max_concurrent=4, export_formats=(),
+                                                                  resume=True))
+
+    expected = {f"{persona['name']}_{n}" for persona in personas[:2] for n in range(1, 3)}
+    assert set(conversations) == expected
+    assert set(journal.load_completed()) == expected
+    with open(tmp_path / "all_conversations_2_per_persona.jsonl", encoding="utf-8") as f:
+        assert {json.loads(line)["persona_conv_id"] for line in f} == expected
@@ -0,0 +1,37 @@
+"""
+Grouped classification: one request per chunk for classifiers that share a chunker.
+
+Run from the repository root:
+    python -m pytest tests/test_grouped_classification.py
+"""
+import asyncio
+import json
+
+from conftest import answer_like_batch_server, mock_openai_client
+
+import Classifiers.emoclassifiers.classification as classification
+
+CLASSIFIER_NAMES = ["Pain Catastrophizing", "Pain Distress", "Offering Emotional Support"]
+CONVERSATION = [
+    {"role": "user", "content": "My back hurts today."},
+    {"role": "assistant", "content": "I'm sorry to hear that. What makes it worse?"},
+    {"role": "user", "content": "Sitting for a long time."},
+    {"role": "assistant", "content": "Let's try a short stretching break every hour."},
+]
+
+
+def test_grouped_usage_is_booked_under_the_group(ledger):
+    requests = []
+    model_wrapper = classification.ModelWrapper(openai_client=mock_openai_client(answer_like_batch_server(requests)))
+    loaded = classification.load_classifiers(classifier_set="v1", model_wrapper=model_wrapper)
+    classifiers = {name: loaded[name] for name in CLASSIFIER_NAMES}
+
+    results = asyncio.run(classification.classify_conversation_grouped(classifiers, CONVERSATION))
+
+    # Two user-message classifiers share one request per user message; the assistant one is alone
+    user_group = "Pain Catastrophizing + Immediate Pain Distress"
+    by_classifier = ledger.by_tag["classifier"]
+    assert set(by_classifier) == {user_group, "Offering Emotional Support"}
+    assert by_classifier[user_group]["calls"] == len(results["Pain Catastrophizing"])
+    assert by_classifier["Offering Emotional Support"]["calls"] == len(results["Offering Emotional Support"])
+    assert sum(totals["calls"] for totals in by_classifier.values()) == ledger.totals["calls"] == len(requests)
@@ -0,0 +1,52 @@
+"""
+Logprob classification mode: answer probabilities from top logprobs, and the flags it excludes.
+
+Run from the repository root:
+    python -m pytest tests/test_logprobs.py
+"""
+import asyncio
+import math
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from Classifiers.emoclassifiers.classification import answer_probabilities
+
+
+def top_logprobs(probabilities: dict[str, float]) -> list:
+    return [SimpleNamespace(token=token, logprob=math.log(p)) for token, p in probabilities.items()]
+
+
+def test_tokens_count_toward_the_answer_they_start():
+    probabilities = answer_probabilities(top_logprobs({"Yes": 0.5, " no": 0.2, "uns": 0.1, "Maybe": 0.2}))
+    assert probabilities.yes == pytest.approx(0.5 / 0.8)
+    assert probabilities.no == pytest.approx(0.2 / 0.8)
+    assert probabilities.unsure == pytest.approx(0.1 / 0.8)
+
+
+def test_punctuation_around_tokens_is_ignored():
+    probabilities = answer_probabilities(top_logprobs({"Yes.": 0.4, "\"yes": 0.2, "no,": 0.3, "**": 0.1}))
+    assert probabilities.yes == pytest.approx(0.6 / 0.9)
+    assert probabilities.no == pytest.approx(0.3 / 0.9)
+
+
+def test_no_answer_token_is_unsure():
+    probabilities = answer_probabilities(top_logprobs({"I": 0.6, "The": 0.3, ".": 0.1}))
+    assert (probabilities.yes, probabilities.no, probabilities.unsure) == (0.0, 0.0, 1.0)
+
+
+@pytest.mark.parametrize("flags", [
+    ["--batch"],
+    ["--short-circuit"],
+    ["--grouped-classification"],
+    ["--single-call-classifiers", "all"],
+])
+def test_logprobs_rejects_label_only_modes(monkeypatch, tmp_path, capsys, flags):
+    monkeypatch.setattr(sys, "argv", ["main.py", "--analyze", str(tmp_path / "conversations.jsonl"),
+                                      "--output-folder", str(tmp_path), "--logprobs", *flags])
+    with pytest.raises(SystemExit) as exit_info:
+        asyncio.run(main.main())
+    assert exit_info.value.code == 2
+    assert f"--logprobs cannot be combined with {flags[0]}" in capsys.readouterr().err
@@ -0,0 +1,98 @@
+"""
+Conversation stream: lazy loading through ConversationIndex, and tree mode writing trees as they complete.
+
+Run from the repository root:
+    python -m pytest tests/test_output_sink.py
+"""
+import asyncio
+import json
+
+import pytest
+
+import main
+from LLMTest.conversation_tree import load_trees_from_jsonl
+from LLMTest.output_sink import ConversationIndex, ConversationSink
+from LLMTest.personas import personas
+
+
+def make_record(conversation_id: str, text: str) -> dict:
+    return {"conversation_id": conversation_id, "persona_conv_id": conversation_id,
+            "conversation": [{"role": "user", "content": text}]}
+
+
+def test_index_reads_records_on_access(tmp_path):
+    sink = ConversationSink(str(tmp_path / "conversations.jsonl"))
+    for i in range(3):
+        sink.append(make_record(f"c{i}", f"message {i}"))
+    with open(sink.path, "a", encoding="utf-8") as f:
+        f.write('{"conversation_id": "truncated", "conv')
+
+    conversations = ConversationIndex(sink, key="persona_conv_id")
+    assert list(conversations) == ["c0", "c1", "c2"]
+    assert "truncated" not in conversations
+    # Only offsets are held; records are read from the stream on access
+    assert all(isinstance(offset, int) for offset in conversations.offsets.values())
+    assert conversations["c1"]["conversation"][0]["content"] == "message 1"
+    assert dict(conversations.items())["c2"] == make_record("c2", "message 2")
+
+
+def test_index_follows_the_given_order(tmp_path):
+    sink = ConversationSink(str(tmp_path / "conversations.jsonl"))
+    for conversation_id in ["b", "a", "c"]:
+        sink.append(make_record(conversation_id, conversation_id))
+
+    conversations = main.load_conversations(sink, ["a", "missing", "b"])
+    assert list(conversations) == ["a", "b"]
+    assert len(conversations) == 2
+    with pytest.raises(KeyError):
+        conversations["c"]
+
+
+def test_append_after_a_partial_line_keeps_every_record(tmp_path):
+    path = str(tmp_path / "conversations.jsonl")
+    ConversationSink(path).append(make_record("c0", "message 0"))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"conversation_id": "truncated", "conv')
+
+    sink = ConversationSink(path)
+    sink.append(make_record("c1", "message 1"))
+    sink.append(make_record("c2", "message 2"))
+    assert [record["conversation_id"] for record in sink] == ["c0", "c1", "c2"]
+
+
+def test_export_jsonl_writes_only_complete_records(tmp_path):
+    sink = ConversationSink(str(tmp_path / "conversations.jsonl"))
+    exported = str(tmp_path / "all_conversations.jsonl")
+    sink.export_jsonl(exported)
+    with open(exported, encoding="utf-8") as f:
+        assert f.read() == ""
+
+    for i in range(2):
+        sink.append(make_record(f"c{i}", f"message {i}"))
+    with open(sink.path, "a", encoding="utf-8") as f:
+        f.write('{"conversation_id": "truncated", "conv')
+    sink.export_jsonl(exported)
+    with open(exported, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [make_record(f"c{i}", f"message {i}") for i in range(2)]
+
+
+def test_trees_are_saved_as_they_complete(tmp_path, monkeypatch, mock_anthropic):
+    monkeypatch.setattr(main, "OUTPUT_FOLDER", str(tmp_path))
+    monkeypatch.setattr(main, "NUM_MESSAGES", 3)
+    monkeypatch.setattr(main, "personas", personas[:2])
+
+    conversations = asyncio.run(main.generate_conversation_trees(
+        2, fork_turns=[1], branches=2, max_concurrent=4, export_formats=()
+    ))
+
+    # Two personas, two trees each, two leaves per tree, numbered in tree order
+    expected = [f"{persona['name']}_{n}" for persona in personas[:2] for n in range(1, 5)]
+    assert list(conversations) == expected
+    for persona_conv_id in expected:
+        record = conversations[persona_conv_id]
+        tree_num = (record["conversation_number"] - 1) // 2 + 1
+        assert record["tree_id"] == f"{record['persona']['name']}-t{tree_num}"
+        assert len(record["conversation"]) == 6
+    trees_files = list(tmp_path.glob("conversation_trees_*.jsonl"))
+    assert len(trees_files) == 1
+    assert len(load_trees_from_jsonl(str(trees_files[0]))) == 4
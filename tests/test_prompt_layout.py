@@ -0,0 +1,88 @@
+"""
+Prefix-stable prompt layout: a shared prefix long enough for provider-side prompt caching.
+
+Run from the repository root:
+    python -m pytest tests/test_prompt_layout.py
+"""
+import asyncio
+import os
+
+import pytest
+from conftest import mock_openai_client
+
+import Classifiers.emoclassifiers.classification as classification
+from Classifiers.benchmark_prompt_layout import layout_prompts, run_benchmark
+from Common.batch_server import default_chat_responder
+from Common.rate_limiting import estimate_tokens
+
+# OpenAI caches prompt prefixes of at least 1024 tokens, in increments of 128 tokens
+MIN_CACHED_TOKENS = 1024
+CONVERSATIONS = [
+    [
+        {"role": "user", "content": "My back hurts today."},
+        {"role": "assistant", "content": "I'm sorry to hear that. What makes it worse?"},
+        {"role": "user", "content": "Sitting for a long time."},
+        {"role": "assistant", "content": "Let's try a short stretching break every hour."},
+    ],
+    [
+        {"role": "user", "content": "I am afraid that walking will make the pain worse."},
+        {"role": "assistant", "content": "That fear is understandable. Gentle movement often helps."},
+    ],
+]
+
+
+def prompt_cache_usage():
+    """Usage reporting the cached tokens OpenAI would: the longest prefix shared with an earlier prompt."""
+    seen = []
+
+    def usage(body):
+        prompt = body["messages"][0]["content"]
+        shared = max((estimate_tokens(os.path.commonprefix([prompt, earlier])) for earlier in seen), default=0)
+        seen.append(prompt)
+        cached = shared // 128 * 128 if shared >= MIN_CACHED_TOKENS else 0
+        prompt_tokens = estimate_tokens(prompt)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5,
+                "prompt_tokens_details": {"cached_tokens": cached}}
+    return usage
+
+
+def load(classifier_set: str, layout: str, client=None) -> dict:
+    model_wrapper = classification.ModelWrapper(openai_client=client or mock_openai_client(default_chat_responder),
+                                                prompt_layout=layout)
+    return classification.load_classifiers(classifier_set=classifier_set, model_wrapper=model_wrapper)
+
+
+@pytest.mark.parametrize("classifier_set", ["v1", "v2"])
+def test_prefix_shared_by_the_set_is_cacheable(classifier_set):
+    prompts = layout_prompts(CONVERSATIONS, load(classifier_set, "prefix_stable"), "prefix_stable")
+    all_prompts = [prompt for chunks in prompts.values() for prompt in chunks]
+    assert estimate_tokens(os.path.commonprefix(all_prompts)) >= MIN_CACHED_TOKENS
+
+
+def test_prefix_stable_prompts_name_their_classifier():
+    classifiers = load("v1", "prefix_stable")
+    classifier = classifiers["Pain Distress"]
+    definition = classifier.classifier_definition
+    chunker = classification.CHUNKER_DICT[definition["chunker"]]
+    chunk = next(iter(chunker.chunk_simple_convo(CONVERSATIONS[0]).values()))
+    prompt = classification.get_emo_classifiers_prompt(definition, chunk, layout="prefix_stable",
+                                                       set_definitions=classifier.model_wrapper.set_definitions)
+    prefix, _, task = prompt.partition(chunk.to_string())[0].rpartition("Your classification task is the one")
+    # Every definition of the set is in the prefix, and the target is named after them
+    assert all(f"### {other.classifier_definition['name']}\n" in prefix for other in classifiers.values())
+    assert f"entitled '{definition['name']}'" in task
+
+
+def test_benchmark_reports_cached_input_for_the_prefix_stable_layout():
+    client = mock_openai_client(default_chat_responder, usage=prompt_cache_usage())
+    names = ["Pain Catastrophizing", "Fear of Movement"]
+    classifiers = load("v1", "default", client)
+    prefix_stable_classifiers = load("v1", "prefix_stable", client)
+    _, summary = asyncio.run(run_benchmark(
+        CONVERSATIONS, {name: classifiers[name] for name in names},
+        {name: prefix_stable_classifiers[name] for name in names},
+    ))
+
+    assert summary["default"]["cached_input_ratio"] == 0
+    assert summary["prefix_stable"]["cached_input_ratio"] > 0
+    assert summary["prefix_stable"]["shared_prefix_tokens"] >= MIN_CACHED_TOKENS
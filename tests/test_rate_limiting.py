@@ -0,0 +1,49 @@
+"""
+Rate limit reconciliation: the tokens of a response that count toward the TPM budget.
+
+Run from the repository root:
+    python -m pytest tests/test_rate_limiting.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+from Common.accounting import UsageLedger
+from Common.rate_limiting import RateLimiter, get_usage_tokens
+
+
+def anthropic_response(**usage) -> SimpleNamespace:
+    return SimpleNamespace(usage=SimpleNamespace(**usage))
+
+
+CACHED_RESPONSE = anthropic_response(input_tokens=50, output_tokens=20, cache_creation_input_tokens=1000,
+                                     cache_read_input_tokens=3000)
+
+
+def test_anthropic_cache_writes_count():
+    assert get_usage_tokens(CACHED_RESPONSE, "claude-sonnet-4-20250514") == 1070
+
+
+def test_anthropic_cache_reads_count_for_older_models():
+    assert get_usage_tokens(CACHED_RESPONSE, "claude-3-5-sonnet-latest") == 4070
+
+
+def test_missing_cache_fields_count_as_zero():
+    response = anthropic_response(input_tokens=50, output_tokens=20, cache_creation_input_tokens=None)
+    assert get_usage_tokens(response, "claude-3-5-sonnet-latest") == 70
+
+
+def test_openai_total_tokens_include_cached_prompt_tokens():
+    response = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=1500, completion_tokens=5, total_tokens=1505,
+                                                     prompt_tokens_details=SimpleNamespace(cached_tokens=1024)))
+    assert get_usage_tokens(response, "gpt-4o-mini-2024-07-18") == 1505
+
+
+def test_reservation_is_reconciled_with_cache_writes():
+    limiter = RateLimiter(limits={("anthropic", "claude-sonnet-4-20250514"): (100, 10000)}, ledger=UsageLedger())
+
+    async def respond():
+        return CACHED_RESPONSE
+
+    asyncio.run(limiter.call("anthropic", "claude-sonnet-4-20250514", 100, respond))
+    level = limiter.get_limit("anthropic", "claude-sonnet-4-20250514").tokens.level
+    assert 10000 - 1070 <= level < 10000 - 1070 + 5
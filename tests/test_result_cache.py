@@ -0,0 +1,68 @@
+"""
+Classification cache: buffered writes and last-used times, flushed in one transaction.
+
+Run from the repository root:
+    python -m pytest tests/test_result_cache.py
+"""
+import sqlite3
+import time
+
+from Classifiers.emoclassifiers.result_cache import ClassificationCache
+
+
+def stored(path) -> dict:
+    """Rows other connections see: key -> (value, last_used)."""
+    connection = sqlite3.connect(path)
+    try:
+        return {key: (value, last_used) for key, value, last_used
+                in connection.execute("SELECT key, value, last_used FROM results")}
+    finally:
+        connection.close()
+
+
+def test_results_are_buffered_until_flush(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ClassificationCache(path, flush_every=4)
+    for i in range(3):
+        cache.put(f"k{i}", {"response": "yes"})
+    assert stored(path) == {}
+    assert cache.get("k1") == {"response": "yes"}
+    assert cache.peek("k2") == {"response": "yes"}
+
+    cache.put("k3", {"response": "no"})
+    assert set(stored(path)) == {"k0", "k1", "k2", "k3"}
+    cache.put("k4", {"response": "no"})
+    cache.close()
+    assert ClassificationCache(path).get("k4") == {"response": "no"}
+
+
+def test_hits_update_last_used_without_a_commit_each(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ClassificationCache(path, flush_every=100)
+    cache.put("k", {"response": "yes"})
+    cache.flush()
+    _, last_used = stored(path)["k"]
+
+    time.sleep(0.01)
+    for _ in range(10):
+        assert cache.get("k") == {"response": "yes"}
+    assert stored(path)["k"][1] == last_used
+    cache.flush()
+    assert stored(path)["k"][1] > last_used
+    assert cache.stats()["hits"] == 10
+
+
+def test_eviction_sees_buffered_hits(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("old", {"response": "yes"})
+    time.sleep(0.01)
+    cache.put("unused", {"response": "yes"})
+    cache.flush()
+    time.sleep(0.01)
+    cache.get("old")
+    cache.put("new", {"response": "no"})
+
+    assert cache.evict() == 1
+    assert cache.peek("unused") is None
+    assert cache.peek("old") == {"response": "yes"}
+    assert cache.peek("new") == {"response": "no"}